@@ -0,0 +1,66 @@
+"""
+CPU time spent against bytes saved by every available response encoding and level, on contact list
+payloads of growing size.
+
+    python -m benchmarks.bench_compression --sizes 1 10 100 1000 10000
+
+brotli and zstd are measured only when the optional packages are installed (poetry install -E compression).
+Use the output to choose compression_minimum_size and the levels in the settings: below the size where the
+saved bytes stop paying for the CPU time the middleware should send the body as it is.
+"""
+import argparse
+import json
+import time
+from datetime import date, datetime
+
+from src.middleware.compression import GzipEncoder, BrotliEncoder, ZstdEncoder, brotli, zstandard
+
+LEVELS = {"gzip": (GzipEncoder, (1, 6, 9))}
+if brotli is not None:
+    LEVELS["br"] = (BrotliEncoder, (1, 4, 9))
+if zstandard is not None:
+    LEVELS["zstd"] = (ZstdEncoder, (1, 3, 9))
+
+
+def contacts_payload(size: int) -> bytes:
+    contacts = [
+        {
+            "id": i,
+            "name": f"name{i}",
+            "sur_name": f"sur_name{i}",
+            "email": f"contact{i}@example.com",
+            "phone": f"+380{i:09d}",
+            "birthday": date(1990, 1 + i % 12, 1 + i % 28).isoformat(),
+            "created_at": datetime(2023, 1, 1).isoformat(),
+            "updated_at": datetime(2023, 1, 1).isoformat(),
+        }
+        for i in range(size)
+    ]
+    return json.dumps(contacts).encode()
+
+
+def measure(encoder_class, level: int, body: bytes, repeat: int):
+    started = time.process_time()
+    for _ in range(repeat):
+        compressed = encoder_class(level).finish(body)
+    return (time.process_time() - started) / repeat * 1000, len(compressed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'contacts':>10}{'bytes':>12}{'encoding':>10}{'level':>7}{'encoded':>12}{'saved %':>9}{'cpu ms':>10}")
+    for size in args.sizes:
+        body = contacts_payload(size)
+        for name, (encoder_class, levels) in LEVELS.items():
+            for level in levels:
+                cpu_ms, encoded = measure(encoder_class, level, body, args.repeat)
+                saved = (1 - encoded / len(body)) * 100
+                print(f"{size:>10}{len(body):>12}{name:>10}{level:>7}{encoded:>12}{saved:>9.1f}{cpu_ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
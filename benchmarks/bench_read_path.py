@@ -0,0 +1,90 @@
+"""
+Cost of listing contacts through the ORM (get_contacts: Contact instances in the identity map) against the
+Core read path (get_contact_rows: ContactRecord tuples), including the JSON serialization of the response.
+
+    python -m benchmarks.bench_read_path --contacts 100000
+
+An in-memory SQLite database keeps the time spent in the database near zero. Memory is the peak traced
+by tracemalloc while the list is loaded and held, scaled to 100k contacts.
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from src.database.models import Base, Contact, User
+from src.repository import contacts as repository_contacts
+from src.schemas import CONTACT_FIELDS, contact_fields_adapter
+
+
+def load_orm(user, session):
+    return repository_contacts.get_contacts(user=user, session=session)
+
+
+def load_rows(user, session):
+    return repository_contacts.get_contact_rows(user=user, session=session)
+
+
+def serialize(contacts) -> bytes:
+    adapter = contact_fields_adapter(CONTACT_FIELDS, many=True)
+    return adapter.dump_json(adapter.validate_python(contacts, from_attributes=True))
+
+
+def measure_memory(engine, user, load, contacts: int) -> float:
+    with Session(engine) as session:
+        gc.collect()
+        tracemalloc.start()
+        result = load(user, session)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del result
+    return peak / contacts * 100_000 / 1024 / 1024
+
+
+def measure_speed(engine, user, load, contacts: int, repeat: int):
+    load_time = serialize_time = 0.0
+    for _ in range(repeat):
+        with Session(engine) as session:
+            started = time.perf_counter()
+            result = load(user, session)
+            loaded = time.perf_counter()
+            serialize(result)
+            load_time += loaded - started
+            serialize_time += time.perf_counter() - loaded
+    return contacts * repeat / load_time, contacts * repeat / (load_time + serialize_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contacts", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine, expire_on_commit=False) as session:
+        user = User(username="bench", email="bench@example.com", password="password")
+        session.add(user)
+        session.flush()
+        now = datetime.now()
+        session.execute(insert(Contact), [
+            {"name": f"name{i}", "sur_name": "sur_name", "email": f"contact{i}@example.com",
+             "phone": f"+380{i:09d}", "birthday": datetime(1990, 1, 1 + i % 28), "user_id": user.id,
+             "created_at": now, "updated_at": now}
+            for i in range(args.contacts)
+        ])
+        session.commit()
+
+    print(f"{'variant':<12}{'MiB/100k':>10}{'rows/s load':>14}{'rows/s load+json':>19}")
+    for name, load in (("ORM", load_orm), ("Core rows", load_rows)):
+        memory = measure_memory(engine, user, load, args.contacts)
+        load_rate, total_rate = measure_speed(engine, user, load, args.contacts, args.repeat)
+        print(f"{name:<12}{memory:>10.1f}{load_rate:>14,.0f}{total_rate:>19,.0f}")
+
+
+if __name__ == "__main__":
+    main()
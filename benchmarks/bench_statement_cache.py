@@ -0,0 +1,81 @@
+"""
+Per-call Python overhead of the repository lookups: legacy session.query(...).filter_by(...) built on every call
+against the module level statements of src.repository.contacts and src.repository.users.
+
+    python -m benchmarks.bench_statement_cache --calls 20000
+
+An in-memory SQLite database keeps the time spent in the database near zero, so the difference between the
+rows is statement construction, cache key generation and compilation. The cache column shows how the
+executions of the variant were served by the compiled cache of the engine.
+"""
+import argparse
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from src.database.models import Base, Contact, User
+from src.repository import contacts as repository_contacts
+from src.repository import users as repository_users
+from src.services.metrics import CACHE_RESULTS
+
+
+def legacy_contact_by_id(contact_id, user, session):
+    return session.query(Contact).filter_by(id=contact_id, user_id=user.id).first()
+
+
+def legacy_user_by_email(email, session):
+    return session.query(User).filter_by(email=email).one_or_none()
+
+
+def measure(session, cache_results: Counter, call, calls: int):
+    cache_results.clear()
+    started = time.perf_counter()
+    for i in range(calls):
+        call(i)
+    elapsed = time.perf_counter() - started
+    return elapsed / calls * 1_000_000, dict(cache_results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    cache_results = Counter()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        cache_results[CACHE_RESULTS.get(context.cache_hit, "other")] += 1
+
+    with Session(engine) as session:
+        user = User(username="bench", email="bench@example.com", password="password")
+        session.add(user)
+        session.flush()
+        session.add_all(Contact(name=f"name{i}", sur_name="sur_name", email=f"{i}@example.com", phone=f"{i}",
+                                birthday=datetime(1990, 1, 1), user_id=user.id) for i in range(100))
+        session.commit()
+
+        variants = [
+            ("contact by id, query()", lambda i: legacy_contact_by_id(1 + i % 100, user, session)),
+            ("contact by id, module statement",
+             lambda i: repository_contacts.get_contact_by_id(1 + i % 100, user, session)),
+            ("contact by id, sparse fields",
+             lambda i: repository_contacts.get_contact_by_id(1 + i % 100, user, session, fields=("id", "name"))),
+            ("user by email, query()", lambda i: legacy_user_by_email("bench@example.com", session)),
+            ("user by email, module statement",
+             lambda i: repository_users.get_user_by_email("bench@example.com", session)),
+        ]
+        print(f"{'variant':<36}{'us/call':>10}  cache")
+        for name, call in variants:
+            call(0)
+            per_call, cache = measure(session, cache_results, call, args.calls)
+            print(f"{name:<36}{per_call:>10.1f}  {cache}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,41 @@
+import asyncio
+import logging
+from datetime import timedelta
+
 import redis.asyncio as redis
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, HTTPException, status
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi_limiter import FastAPILimiter
-from sqlalchemy import text
-from sqlalchemy.orm import Session
 from starlette.middleware.cors import CORSMiddleware
 
 from src.conf.config import config
-from src.database.db import get_db
-from src.routes import contacts, auth, users
+from src.database.db import DBSession, engine
+from src.repository import contacts as repository_contacts
+from src.repository import stats as repository_stats
+from src.routes import contacts, auth, users, tags
+from src.middleware.compression import CompressionMiddleware
+from src.middleware.concurrency import ConcurrencyLimitMiddleware
+from src.services import events, health
+from src.services.audit import audit_log
+from src.services.group_commit import write_batcher
+from src.services.keys import key_ring
+from src.services.revocation import revoked_tokens
+from src.services.metrics import metrics
 
 app = FastAPI()
+health_checker = health.create_checker(engine)
 
+# Innermost, so shed requests still get the CORS headers
+app.add_middleware(ConcurrencyLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=config.compression_minimum_size)
 
 
 # @app.on_event("startup")
@@ -26,10 +44,59 @@ app.add_middleware(
 #     await FastAPILimiter.init(r)
 
 
+def compact_tombstones():
+    with DBSession() as session:
+        return repository_contacts.compact_tombstones(
+            retention=timedelta(days=config.sync_tombstone_retention_days), session=session
+        )
+
+
+def reconcile_contact_stats():
+    # Every worker schedules the job, the one holding the advisory lock runs it
+    with engine.connect() as connection, repository_stats.reconcile_lock(connection) as locked:
+        if not locked:
+            return 0
+        with DBSession(bind=connection) as session:
+            return repository_stats.reconcile_contact_stats(session=session)
+
+
+async def run_periodically(job, interval: float, delay: float = 0):
+    await asyncio.sleep(delay)
+    while True:
+        try:
+            await asyncio.to_thread(job)
+        except Exception as e:
+            logging.error(f"Background job {job.__name__} failed: {e}")
+        await asyncio.sleep(interval)
+
+
+@app.on_event("startup")
+async def start_background_jobs():
+    app.state.background_jobs = [
+        asyncio.create_task(run_periodically(compact_tombstones, config.sync_compaction_interval)),
+        asyncio.create_task(run_periodically(reconcile_contact_stats, config.contact_stats_reconcile_interval,
+                                             delay=config.contact_stats_reconcile_delay)),
+        asyncio.create_task(health_checker.run_periodically()),
+        revoked_tokens.start(),
+    ]
+    audit_log.start()
+
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    for job in app.state.background_jobs:
+        job.cancel()
+    await events.hub.close()
+    await revoked_tokens.close()
+    await asyncio.to_thread(write_batcher.close)
+    await asyncio.to_thread(audit_log.close)
+
+
 app.include_router(auth.router)
 app.include_router(contacts.router)
 app.include_router(contacts.birthday_router)
 app.include_router(users.router)
+app.include_router(tags.router)
 
 
 @app.get("/")
@@ -43,24 +110,63 @@ def read_root():
     return {"message": "Application started"}
 
 
+@app.get("/livez")
+def livez():
+    """
+    The livez function tells the orchestrator that the process is alive. It does no I/O at all,
+    a failing dependency must not get a healthy process restarted.
+
+    :return: A dictionary with the status
+    """
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    """
+    The readyz function returns the readiness of the application from the results of the background checker
+    (database, Redis and mail relay), with the saturation of the connection pool. Probes never touch the pool.
+
+    :return: The cached status, with code 503 when the application should not get traffic
+    """
+    result = health_checker.status()
+    status_code = status.HTTP_200_OK if result["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(result, status_code=status_code)
+
+
+@app.get("/.well-known/jwks.json")
+def read_jwks():
+    """
+    The read_jwks function publishes the public keys of the tokens, so other services verify tokens themselves.
+    The document is serialized once when the keys are loaded.
+
+    :return: The JSON Web Key Set
+    """
+    return Response(content=key_ring.jwks_json, media_type="application/json",
+                    headers={"Cache-Control": f"public, max-age={config.jwks_max_age}"})
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    """
+    The read_metrics function exports the counters of the application in the Prometheus text format,
+    e.g. the hit ratio of the compiled statement cache.
+
+    :return: The metrics as plain text
+    """
+    return metrics.render()
+
+
 @app.get("/api/healthchecker")
-def healthchecker(session: Session = Depends(get_db)):
+def healthchecker():
     """
-    The healthchecker function is a simple function that checks if the database is configured correctly.
-    It does this by making a request to the database and checking if it returns any results.
-    If there are no results, then we know something went wrong with our connection.
+    The healthchecker function checks if the database is configured correctly.
+    It answers from the last result of the background checker instead of querying the database on every call.
 
-    :param session: Session: Pass the database session into the function
     :return: A dictionary with a message
     """
-    try:
-        # Make request
-        result = session.execute(text("SELECT 1")).fetchone()
-        if result is None:
-            raise HTTPException(status_code=500, detail="Database is not configured correctly")
-        return {"message": "Welcome to FastAPI!"}
-    except Exception as e:
-        print(e)
+    if not health_checker.is_ok("database"):
         raise HTTPException(status_code=500, detail="Error connecting to the database")
+    return {"message": "Welcome to FastAPI!"}
 
 # uvicorn main:app --host localhost --port 8000 --reload
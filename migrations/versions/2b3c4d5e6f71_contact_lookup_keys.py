@@ -0,0 +1,94 @@
+"""contact lookup keys
+
+Revision ID: 2b3c4d5e6f71
+Revises: 1a2b3c4d5e60
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.conf.config import config
+
+
+# revision identifiers, used by Alembic.
+revision = '2b3c4d5e6f71'
+down_revision = '1a2b3c4d5e60'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 1000
+E164_MAX_DIGITS = 15
+
+contacts = sa.table('contacts', sa.column('id', sa.Integer), sa.column('phone', sa.String),
+                    sa.column('email', sa.String), sa.column('phone_e164', sa.String),
+                    sa.column('email_lower', sa.String))
+
+
+# Frozen copies of src.services.normalize at this revision, the migration does not change with the app
+def normalize_phone(phone):
+    if not phone:
+        return None
+    country_code = config.phone_country_code
+    raw = phone.strip()
+    digits = re.sub(r"\D", "", raw)
+    if not digits:
+        return None
+    if raw.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif digits.startswith(country_code):
+        pass
+    elif digits.startswith("0"):
+        digits = country_code + digits[1:]
+    else:
+        digits = country_code + digits
+    return "+" + digits[:E164_MAX_DIGITS]
+
+
+def normalize_email(email):
+    if not email:
+        return None
+    return email.strip().lower()
+
+
+def backfill(connection) -> None:
+    stmt = (
+        contacts.update()
+        .where(contacts.c.id == sa.bindparam('b_id'))
+        .values(phone_e164=sa.bindparam('v_phone_e164'), email_lower=sa.bindparam('v_email_lower'))
+    )
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(contacts.c.id, contacts.c.phone, contacts.c.email)
+            .where(contacts.c.id > last_id).order_by(contacts.c.id).limit(CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(stmt, [{'b_id': row.id, 'v_phone_e164': normalize_phone(row.phone),
+                                   'v_email_lower': normalize_email(row.email)} for row in rows])
+        last_id = rows[-1].id
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('phone_e164', sa.String(length=16), nullable=True))
+    op.add_column('contacts', sa.Column('email_lower', sa.String(length=120), nullable=True))
+
+    # The ADD COLUMN is committed first and every chunk is a transaction of its own,
+    # so the lock of the table is not held for the whole backfill
+    with op.get_context().autocommit_block():
+        backfill(op.get_bind())
+
+    op.create_index('ix_contacts_user_id_phone_e164', 'contacts', ['user_id', 'phone_e164'])
+    op.create_index('ix_contacts_user_id_email_lower', 'contacts', ['user_id', 'email_lower'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_email_lower', table_name='contacts')
+    op.drop_index('ix_contacts_user_id_phone_e164', table_name='contacts')
+    op.drop_column('contacts', 'email_lower')
+    op.drop_column('contacts', 'phone_e164')
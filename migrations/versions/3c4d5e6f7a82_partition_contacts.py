@@ -0,0 +1,71 @@
+"""partition contacts by user
+
+Revision ID: 3c4d5e6f7a82
+Revises: 2b3c4d5e6f71
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from src.conf.config import config
+
+
+# revision identifiers, used by Alembic.
+revision = '3c4d5e6f7a82'
+down_revision = '2b3c4d5e6f71'
+branch_labels = None
+depends_on = None
+
+# Frozen copy of the offline conversion of src.database.partitioning at this revision,
+# later revisions add columns and indexes that do not exist yet here
+INDEXES = {
+    'ix_contacts_user_id_phone_e164': '(user_id, phone_e164)',
+    'ix_contacts_user_id_email_lower': '(user_id, email_lower)',
+}
+
+
+def migrate_offline(connection, partitions: int) -> None:
+    connection.execute(sa.text(
+        'CREATE TABLE contacts_partitioned (LIKE contacts INCLUDING DEFAULTS) PARTITION BY HASH (user_id)'
+    ))
+    connection.execute(sa.text('ALTER TABLE contacts_partitioned ALTER COLUMN user_id SET NOT NULL'))
+    connection.execute(sa.text('ALTER TABLE contacts_partitioned ADD CONSTRAINT contacts_partitioned_pkey '
+                               'PRIMARY KEY (id, user_id)'))
+    connection.execute(sa.text('ALTER TABLE contacts_partitioned ADD CONSTRAINT contacts_partitioned_user_id_fkey '
+                               'FOREIGN KEY (user_id) REFERENCES users (id)'))
+    for remainder in range(partitions):
+        connection.execute(sa.text(f'CREATE TABLE contacts_partitioned_p{remainder} PARTITION OF contacts_partitioned '
+                                   f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'))
+    for name, columns in INDEXES.items():
+        connection.execute(sa.text(f'CREATE INDEX {name}_p ON contacts_partitioned {columns}'))
+    connection.execute(sa.text('INSERT INTO contacts_partitioned SELECT * FROM contacts WHERE user_id IS NOT NULL'))
+
+    connection.execute(sa.text('LOCK TABLE contacts IN ACCESS EXCLUSIVE MODE'))
+    connection.execute(sa.text('ALTER TABLE contacts RENAME TO contacts_unpartitioned'))
+    connection.execute(sa.text('ALTER TABLE contacts_partitioned RENAME TO contacts'))
+    for name in INDEXES:
+        connection.execute(sa.text(f'ALTER INDEX IF EXISTS {name} RENAME TO {name}_old'))
+        connection.execute(sa.text(f'ALTER INDEX {name}_p RENAME TO {name}'))
+    connection.execute(sa.text('ALTER SEQUENCE IF EXISTS contacts_id_seq OWNED BY contacts.id'))
+
+
+def _enabled() -> bool:
+    return op.get_bind().dialect.name == 'postgresql' and config.contacts_partitions > 0
+
+
+def upgrade() -> None:
+    # Only runs with CONTACTS_PARTITIONS > 0 on PostgreSQL. Big live tables should be converted with
+    # python -m src.database.partitioning before this revision, the revision is a no-op on a partitioned table.
+    if not _enabled():
+        return
+    partitioned = op.get_bind().exec_driver_sql(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'contacts'::regclass"
+    ).scalar()
+    if not partitioned:
+        migrate_offline(op.get_bind(), config.contacts_partitions)
+
+
+def downgrade() -> None:
+    if _enabled():
+        raise NotImplementedError("contacts partitioning is irreversible, the old rows stay in contacts_unpartitioned")
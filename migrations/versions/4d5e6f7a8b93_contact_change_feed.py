@@ -0,0 +1,62 @@
+"""contact change feed
+
+Revision ID: 4d5e6f7a8b93
+Revises: 3c4d5e6f7a82
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d5e6f7a8b93'
+down_revision = '3c4d5e6f7a82'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 10000
+
+
+def backfill(connection) -> None:
+    max_id = connection.execute(sa.text("SELECT coalesce(max(id), 0) FROM contacts")).scalar()
+    for low in range(0, max_id, CHUNK_SIZE):
+        connection.execute(sa.text("UPDATE contacts SET change_seq = id WHERE id > :low AND id <= :high"),
+                           {"low": low, "high": low + CHUNK_SIZE})
+
+
+def upgrade() -> None:
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    if postgresql:
+        op.execute(sa.schema.CreateSequence(sa.Sequence('contact_change_seq')))
+
+    op.add_column('contacts', sa.Column('change_seq', sa.BigInteger(), nullable=True))
+    # The ADD COLUMN is committed first and every id range is a transaction of its own,
+    # so the lock of the table is not held for the whole backfill
+    with op.get_context().autocommit_block():
+        backfill(op.get_bind())
+    if postgresql:
+        op.execute("SELECT setval('contact_change_seq', (SELECT coalesce(max(id), 0) + 1 FROM contacts), false)")
+    op.create_index('ix_contacts_user_id_change_seq', 'contacts', ['user_id', 'change_seq'])
+
+    op.create_table(
+        'contact_tombstones',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('contact_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('change_seq', sa.BigInteger(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_contact_tombstones_user_id_change_seq', 'contact_tombstones', ['user_id', 'change_seq'])
+    op.create_index('ix_contact_tombstones_deleted_at', 'contact_tombstones', ['deleted_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contact_tombstones_deleted_at', table_name='contact_tombstones')
+    op.drop_index('ix_contact_tombstones_user_id_change_seq', table_name='contact_tombstones')
+    op.drop_table('contact_tombstones')
+    op.drop_index('ix_contacts_user_id_change_seq', table_name='contacts')
+    op.drop_column('contacts', 'change_seq')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(sa.schema.DropSequence(sa.Sequence('contact_change_seq')))
@@ -0,0 +1,24 @@
+"""user tokens valid after
+
+Revision ID: 5e6f7a8b9ca4
+Revises: 4d5e6f7a8b93
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e6f7a8b9ca4'
+down_revision = '4d5e6f7a8b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('tokens_valid_after', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'tokens_valid_after')
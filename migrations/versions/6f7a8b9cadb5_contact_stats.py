@@ -0,0 +1,73 @@
+"""contact stats
+
+Revision ID: 6f7a8b9cadb5
+Revises: 5e6f7a8b9ca4
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f7a8b9cadb5'
+down_revision = '5e6f7a8b9ca4'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 1000
+MONTH_COLUMNS = [f'birthdays_{month:02d}' for month in range(1, 13)]
+
+users = sa.table('users', sa.column('id', sa.Integer))
+contacts = sa.table('contacts', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer),
+                    sa.column('birthday', sa.DateTime), sa.column('created_at', sa.DateTime))
+contact_stats = sa.table('contact_stats', sa.column('user_id', sa.Integer), sa.column('total', sa.Integer),
+                         *(sa.column(column, sa.Integer) for column in MONTH_COLUMNS),
+                         sa.column('last_added_at', sa.DateTime), sa.column('updated_at', sa.DateTime))
+
+
+def backfill(connection) -> None:
+    month = sa.extract('month', contacts.c.birthday)
+    last_user_id = 0
+    while True:
+        user_ids = connection.scalars(
+            sa.select(users.c.id).where(users.c.id > last_user_id).order_by(users.c.id).limit(CHUNK_SIZE)
+        ).all()
+        if not user_ids:
+            break
+        counted = (
+            sa.select(users.c.id, sa.func.count(contacts.c.id),
+                      *(sa.func.coalesce(sa.func.sum(sa.case((month == number, 1), else_=0)), 0)
+                        for number in range(1, 13)),
+                      sa.func.max(contacts.c.created_at), sa.func.now())
+            .select_from(users.outerjoin(contacts, contacts.c.user_id == users.c.id))
+            .where(users.c.id.in_(user_ids))
+            .group_by(users.c.id)
+        )
+        connection.execute(contact_stats.insert().from_select(
+            ['user_id', 'total', *MONTH_COLUMNS, 'last_added_at', 'updated_at'], counted
+        ))
+        last_user_id = user_ids[-1]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'contact_stats',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Integer(), server_default='0', nullable=False),
+        *(sa.Column(column, sa.Integer(), server_default='0', nullable=False) for column in MONTH_COLUMNS),
+        sa.Column('last_added_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.create_index('ix_contacts_user_id_created_at', 'contacts', ['user_id', 'created_at'])
+
+    # The table is committed first and every chunk of users is a transaction of its own
+    with op.get_context().autocommit_block():
+        backfill(op.get_bind())
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_created_at', table_name='contacts')
+    op.drop_table('contact_stats')
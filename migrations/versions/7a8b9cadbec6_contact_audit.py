@@ -0,0 +1,41 @@
+"""contact audit
+
+Revision ID: 7a8b9cadbec6
+Revises: 6f7a8b9cadb5
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a8b9cadbec6'
+down_revision = '6f7a8b9cadb5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'contact_audit',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('event_id', sa.String(length=32), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('contact_id', sa.Integer(), nullable=False),
+        sa.Column('action', sa.String(length=16), nullable=False),
+        sa.Column('changes', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('event_id'),
+    )
+    op.create_index('ix_contact_audit_user_id_contact_id', 'contact_audit', ['user_id', 'contact_id'])
+    if op.get_bind().dialect.name == 'postgresql':
+        # Append-only: rows are never changed once written
+        op.execute('CREATE RULE contact_audit_no_update AS ON UPDATE TO contact_audit DO INSTEAD NOTHING')
+        op.execute('CREATE RULE contact_audit_no_delete AS ON DELETE TO contact_audit DO INSTEAD NOTHING')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contact_audit_user_id_contact_id', table_name='contact_audit')
+    op.drop_table('contact_audit')
@@ -0,0 +1,46 @@
+"""contact tags
+
+Revision ID: 8b9cadbecfd7
+Revises: 7a8b9cadbec6
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b9cadbecfd7'
+down_revision = '7a8b9cadbec6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'tags',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('contact_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_tags_user_id_name', 'tags', ['user_id', 'name'], unique=True)
+    op.create_table(
+        'contact_tags',
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.Column('contact_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('tag_id', 'contact_id'),
+    )
+    op.create_index('ix_contact_tags_contact_id', 'contact_tags', ['contact_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contact_tags_contact_id', table_name='contact_tags')
+    op.drop_table('contact_tags')
+    op.drop_index('ix_tags_user_id_name', table_name='tags')
+    op.drop_table('tags')
@@ -0,0 +1,73 @@
+"""contact query indexes
+
+Revision ID: 9cadbecfd7e8
+Revises: 8b9cadbecfd7
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9cadbecfd7e8'
+down_revision = '8b9cadbecfd7'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 1000
+QUERY_COLUMNS = ('updated_at', 'name', 'sur_name', 'email_domain', 'birthday')
+
+contacts = sa.table('contacts', sa.column('id', sa.Integer), sa.column('email', sa.String),
+                    sa.column('email_domain', sa.String))
+
+
+# Frozen copy of src.services.normalize.email_domain at this revision, the migration does not change with the app
+def email_domain(email):
+    if not email:
+        return None
+    email = email.strip().lower()
+    if not email or '@' not in email:
+        return None
+    return email.rsplit('@', 1)[1]
+
+
+def backfill(connection) -> None:
+    stmt = (
+        contacts.update()
+        .where(contacts.c.id == sa.bindparam('b_id'))
+        .values(email_domain=sa.bindparam('v_email_domain'))
+    )
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(contacts.c.id, contacts.c.email)
+            .where(contacts.c.id > last_id).order_by(contacts.c.id).limit(CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(stmt, [{'b_id': row.id, 'v_email_domain': email_domain(row.email)} for row in rows])
+        last_id = rows[-1].id
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('email_domain', sa.String(length=120), nullable=True))
+
+    # The ADD COLUMN is committed first and every chunk is a transaction of its own,
+    # so the lock of the table is not held for the whole backfill
+    with op.get_context().autocommit_block():
+        backfill(op.get_bind())
+
+    # The id makes the index serve the keyset order (column, id) of the query API
+    op.drop_index('ix_contacts_user_id_created_at', table_name='contacts')
+    op.create_index('ix_contacts_user_id_created_at', 'contacts', ['user_id', 'created_at', 'id'])
+    for name in QUERY_COLUMNS:
+        op.create_index(f'ix_contacts_user_id_{name}', 'contacts', ['user_id', name, 'id'])
+
+
+def downgrade() -> None:
+    for name in reversed(QUERY_COLUMNS):
+        op.drop_index(f'ix_contacts_user_id_{name}', table_name='contacts')
+    op.drop_index('ix_contacts_user_id_created_at', table_name='contacts')
+    op.create_index('ix_contacts_user_id_created_at', 'contacts', ['user_id', 'created_at'])
+    op.drop_column('contacts', 'email_domain')
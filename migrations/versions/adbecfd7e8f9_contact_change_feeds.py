@@ -0,0 +1,30 @@
+"""contact change feeds
+
+Revision ID: adbecfd7e8f9
+Revises: 9cadbecfd7e8
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'adbecfd7e8f9'
+down_revision = '9cadbecfd7e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'contact_change_feeds',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('writes', sa.BigInteger(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('contact_change_feeds')
@@ -22,6 +22,53 @@ class Settings(BaseSettings):
     cloudinary_name: str = "cloudinary_name"
     cloudinary_api_key: str = "cloudinary_api_key"
     cloudinary_api_secret: str = "cloudinary_api_secret"
+    phone_country_code: str = "380"
+    contacts_partitions: int = 0
+    sync_tombstone_retention_days: int = 30
+    sync_compaction_interval: int = 3600
+    contact_events_heartbeat: float = 15.0
+    contact_events_queue_size: int = 100
+    contact_events_max_bytes: int = 256 * 1024
+    compression_minimum_size: int = 1024
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 4
+    compression_zstd_level: int = 3
+    health_check_interval: float = 5.0
+    health_check_timeout: float = 2.0
+    health_max_pool_saturation: float = 0.0
+    database_prepare_threshold: int = 5
+    revocation_bloom_capacity: int = 100000
+    revocation_bloom_error_rate: float = 0.001
+    revocation_fail_closed: bool = True
+    jwt_keys_dir: str = ""
+    jwt_signing_kid: str = ""
+    jwt_accept_secret: bool = True
+    jwks_max_age: int = 300
+    contact_stats_reconcile_interval: int = 24 * 3600
+    contact_stats_reconcile_delay: int = 3600
+    concurrency_database_limit: int = 5
+    concurrency_database_max_limit: int = 40
+    concurrency_auth_limit: int = 2
+    concurrency_auth_max_limit: int = 8
+    concurrency_uploads_limit: int = 4
+    concurrency_uploads_max_limit: int = 16
+    concurrency_writes_share: float = 0.8
+    concurrency_reads_queue_timeout: float = 1.0
+    concurrency_auth_queue_timeout: float = 1.0
+    concurrency_writes_queue_timeout: float = 0.5
+    concurrency_uploads_queue_timeout: float = 0.5
+    concurrency_retry_after: int = 1
+    audit_enabled: bool = True
+    audit_sink: str = "database"
+    audit_mode: str = "queue"
+    audit_dir: str = "audit"
+    audit_queue_size: int = 10000
+    audit_batch_size: int = 500
+    audit_flush_interval: float = 1.0
+    audit_replay_interval: float = 60.0
+    write_coalescing_enabled: bool = False
+    write_coalescing_batch_size: int = 64
+    write_coalescing_max_wait: float = 0.005
 
     # model_config = ConfigDict(env_file=file_env, env_file_encoding="utf-8")
 
@@ -1,13 +1,28 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import logging
+
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.orm import sessionmaker, Session
 
 from src.conf.config import config
+from src.services.metrics import instrument_engine
 
 URI = config.sqlalchemy_database_url
 print(URI)
 
-engine = create_engine(URI, echo=False, pool_size=5, max_overflow=0)
-DBSession = sessionmaker(bind=engine)
+
+def _connect_args(url: str) -> dict:
+    # psycopg 3 prepares a statement on the server after it ran prepare_threshold times on a connection.
+    # psycopg2 has no server side prepared statements, use a postgresql+psycopg:// URL to get them.
+    if make_url(url).drivername == "postgresql+psycopg" and config.database_prepare_threshold:
+        return {"prepare_threshold": config.database_prepare_threshold}
+    return {}
+
+
+engine = create_engine(URI, echo=False, pool_size=5, max_overflow=0, connect_args=_connect_args(URI))
+instrument_engine(engine)
+# Objects stay loaded after commit: the write paths get generated values through RETURNING,
+# so nothing has to be reloaded when a response is serialized.
+DBSession = sessionmaker(bind=engine, expire_on_commit=False)
 
 
 # session_debug = DBSession()
@@ -20,3 +35,28 @@ def get_db():
         yield session
     finally:
         session.close()
+
+
+def after_commit(session: Session, callback) -> None:
+    """
+    The after_commit function schedules a callback to run once the current transaction of the session is committed.
+    It is used for side effects like publishing events, which must not happen for a rolled back transaction.
+
+    :param session: Session: Database session
+    :param callback: Callable without arguments
+    """
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session):
+    for callback in session.info.pop("after_commit", []):
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"after_commit callback failed: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_commit(session):
+    session.info.pop("after_commit", None)
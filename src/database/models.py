@@ -1,31 +1,196 @@
 from datetime import date
 
-from sqlalchemy import String, Integer, DateTime, func, ForeignKey, Boolean
+from sqlalchemy import String, Integer, BigInteger, DateTime, func, ForeignKey, Boolean, Index, Sequence, JSON
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import DeclarativeBase, mapped_column, Mapped, relationship
+from sqlalchemy.sql.functions import FunctionElement
+
+from src.conf.config import config
+from src.database.partitioning import attach_partition_ddl
+
+# With hash partitioning on PostgreSQL user_id becomes part of the primary key, so ORM updates and deletes
+# always carry the partition key and touch a single partition.
+CONTACTS_PARTITIONED = config.contacts_partitions > 0
 
 
 class Base(DeclarativeBase):
     pass
 
 
+contact_change_seq = Sequence("contact_change_seq", metadata=Base.metadata)
+
+
+class next_change_seq(FunctionElement):
+    """
+    Next value of the change sequence shared by contacts and contact_tombstones.
+    PostgreSQL uses contact_change_seq, other databases (SQLite in tests) take max + 1,
+    which is safe there because writers are serialized.
+    Values are handed out at flush, not at commit; they follow the commit order of a user only because the write
+    paths lock the ContactChangeFeed row of the user first (src.repository.contacts.lock_change_feed).
+    """
+    type = BigInteger()
+    name = "next_change_seq"
+    inherit_cache = True
+
+
+@compiles(next_change_seq, "postgresql")
+def _next_change_seq_postgresql(element, compiler, **kw):
+    return f"nextval('{contact_change_seq.name}')"
+
+
+@compiles(next_change_seq)
+def _next_change_seq_default(element, compiler, **kw):
+    return ("(SELECT coalesce(max(seq), 0) + 1 FROM ("
+            "SELECT max(change_seq) AS seq FROM contacts "
+            "UNION ALL SELECT max(change_seq) AS seq FROM contact_tombstones))")
+
+
 class Contact(Base):
     __tablename__ = "contacts"
-    id = mapped_column(Integer, primary_key=True)
+    __table_args__ = (
+        Index("ix_contacts_user_id_phone_e164", "user_id", "phone_e164"),
+        Index("ix_contacts_user_id_email_lower", "user_id", "email_lower"),
+        Index("ix_contacts_user_id_change_seq", "user_id", "change_seq"),
+        # (user_id, column, id): filter and keyset sort of the list query API (src.repository.contacts.QUERY_PLANS)
+        Index("ix_contacts_user_id_created_at", "user_id", "created_at", "id"),
+        Index("ix_contacts_user_id_updated_at", "user_id", "updated_at", "id"),
+        Index("ix_contacts_user_id_name", "user_id", "name", "id"),
+        Index("ix_contacts_user_id_sur_name", "user_id", "sur_name", "id"),
+        Index("ix_contacts_user_id_email_domain", "user_id", "email_domain", "id"),
+        Index("ix_contacts_user_id_birthday", "user_id", "birthday", "id"),
+        {"postgresql_partition_by": "HASH (user_id)"} if CONTACTS_PARTITIONED else {},
+    )
+    # Generated columns come back in the RETURNING clause of the INSERT / UPDATE itself,
+    # so reading them after a write does not cost another SELECT.
+    __mapper_args__ = {"eager_defaults": True}
+    id = mapped_column(Integer, primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String(100))
     sur_name: Mapped[str] = mapped_column(String(100))
     email: Mapped[str] = mapped_column(String(120))
     phone: Mapped[str] = mapped_column(String(13))
+    phone_e164: Mapped[str] = mapped_column(String(16), nullable=True)
+    email_lower: Mapped[str] = mapped_column(String(120), nullable=True)
+    email_domain: Mapped[str] = mapped_column(String(120), nullable=True)
     birthday: Mapped[date] = mapped_column(DateTime)
     created_at: Mapped[date] = mapped_column('created_at', DateTime, default=func.now(), nullable=True)
     updated_at: Mapped[date] = mapped_column('updated_at', DateTime, default=func.now(), onupdate=func.now(),
                                              nullable=True)
+    change_seq: Mapped[int] = mapped_column(BigInteger, default=next_change_seq(), onupdate=next_change_seq(),
+                                            nullable=True)
+
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=not CONTACTS_PARTITIONED,
+                                         primary_key=CONTACTS_PARTITIONED)
+    user: Mapped["User"] = relationship('User', backref="contacts", lazy='select')
+
+
+if CONTACTS_PARTITIONED:
+    attach_partition_ddl(Contact.__table__)
+
+
+class ContactTombstone(Base):
+    __tablename__ = "contact_tombstones"
+    __table_args__ = (
+        Index("ix_contact_tombstones_user_id_change_seq", "user_id", "change_seq"),
+        Index("ix_contact_tombstones_deleted_at", "deleted_at"),
+    )
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    contact_id: Mapped[int] = mapped_column(Integer)
+    user_id: Mapped[int] = mapped_column(Integer)
+    change_seq: Mapped[int] = mapped_column(BigInteger, default=next_change_seq())
+    deleted_at: Mapped[date] = mapped_column(DateTime, default=func.now())
+
+
+class ContactChangeFeed(Base):
+    """
+    One row per user, locked by every transaction that changes the contacts of the user before it takes
+    change_seq values. change_seq is taken at flush but becomes visible at commit; with the writers of a user
+    serialized on this row, a transaction that got a lower change_seq is always committed before the next writer
+    takes a higher one, so the sync cursor of the user follows commit order.
+    """
+    __tablename__ = "contact_change_feeds"
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    writes: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
+
+
+BIRTHDAY_MONTH_COLUMNS = tuple(f"birthdays_{month:02d}" for month in range(1, 13))
+
+
+class ContactStats(Base):
+    """
+    Per-user aggregates of the contacts, kept up to date by the write paths of the contacts repository
+    and rebuilt by reconcile_contact_stats. Dashboards read one row instead of counting the address book.
+    """
+    __tablename__ = "contact_stats"
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    total: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_01: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_02: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_03: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_04: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_05: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_06: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_07: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_08: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_09: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_10: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_11: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    birthdays_12: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    last_added_at: Mapped[date] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[date] = mapped_column(DateTime, default=func.now(), onupdate=func.now(), nullable=True)
+
+
+class Tag(Base):
+    """
+    A tag of contacts of one user. contact_count is maintained by the tag and contact write paths
+    in the transaction of the change, so listing tags with their sizes does not count the links.
+    """
+    __tablename__ = "tags"
+    __table_args__ = (
+        Index("ix_tags_user_id_name", "user_id", "name", unique=True),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    name: Mapped[str] = mapped_column(String(50))
+    contact_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    created_at: Mapped[date] = mapped_column(DateTime, default=func.now(), nullable=True)
+
+
+class ContactTag(Base):
+    """
+    Links of contacts and tags. The primary key (tag_id, contact_id) serves the listing of a tag in contact order,
+    the contact_id index the removal of the links of deleted contacts. There is no foreign key to contacts,
+    whose primary key includes user_id when the table is partitioned; the contact delete paths remove the links.
+    """
+    __tablename__ = "contact_tags"
+    __table_args__ = (
+        Index("ix_contact_tags_contact_id", "contact_id"),
+    )
+    tag_id: Mapped[int] = mapped_column(Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True)
+    contact_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer)
+
 
-    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=True)
-    user: Mapped["User"] = relationship('User', backref="contacts", lazy='joined')
+class ContactAudit(Base):
+    """
+    Append-only trail of contact changes, written in batches by the audit writer (src.services.audit).
+    changes holds the changed fields as {field: [old, new]}.
+    """
+    __tablename__ = "contact_audit"
+    __table_args__ = (
+        Index("ix_contact_audit_user_id_contact_id", "user_id", "contact_id"),
+    )
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    event_id: Mapped[str] = mapped_column(String(32), unique=True)
+    user_id: Mapped[int] = mapped_column(Integer)
+    contact_id: Mapped[int] = mapped_column(Integer)
+    action: Mapped[str] = mapped_column(String(16))
+    changes: Mapped[dict] = mapped_column(JSON)
+    created_at: Mapped[date] = mapped_column(DateTime)
 
 
 class User(Base):
     __tablename__ = "users"
+    __mapper_args__ = {"eager_defaults": True}
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     username: Mapped[str] = mapped_column(String(50))
     email: Mapped[str] = mapped_column(String(250), nullable=False, unique=True)
@@ -35,3 +200,4 @@ class User(Base):
     avatar: Mapped[str] = mapped_column(String(255), nullable=True)
     refresh_token: Mapped[str] = mapped_column(String(255), nullable=True)
     confirmed: Mapped[bool] = mapped_column(Boolean, default=False)
+    tokens_valid_after: Mapped[date] = mapped_column(DateTime, nullable=True)
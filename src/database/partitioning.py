@@ -0,0 +1,212 @@
+import argparse
+import logging
+import time
+
+from sqlalchemy import text, Connection, DDL, event
+
+from src.conf.config import config
+
+TABLE = "contacts"
+NEW_TABLE = "contacts_partitioned"
+OLD_TABLE = "contacts_unpartitioned"
+# Keys of the rows deleted from the live table while it is copied
+DELETED_TABLE = "contacts_partitioned_deleted"
+INDEXES = {
+    "ix_contacts_user_id_phone_e164": "(user_id, phone_e164)",
+    "ix_contacts_user_id_email_lower": "(user_id, email_lower)",
+    "ix_contacts_user_id_change_seq": "(user_id, change_seq)",
+    "ix_contacts_user_id_created_at": "(user_id, created_at, id)",
+    "ix_contacts_user_id_updated_at": "(user_id, updated_at, id)",
+    "ix_contacts_user_id_name": "(user_id, name, id)",
+    "ix_contacts_user_id_sur_name": "(user_id, sur_name, id)",
+    "ix_contacts_user_id_email_domain": "(user_id, email_domain, id)",
+    "ix_contacts_user_id_birthday": "(user_id, birthday, id)",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def partition_name(table: str, remainder: int) -> str:
+    return f"{table}_p{remainder}"
+
+
+def create_partitions_ddl(table: str, partitions: int) -> list:
+    """
+    The create_partitions_ddl function returns the statements that attach the hash partitions to a table
+    created with PARTITION BY HASH (user_id).
+
+    :param table: str: Name of the partitioned table
+    :param partitions: int: Number of partitions
+    :return: A list of SQL statements
+    """
+    return [
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, remainder)} PARTITION OF {table} "
+        f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        for remainder in range(partitions)
+    ]
+
+
+def attach_partition_ddl(table) -> None:
+    """
+    The attach_partition_ddl function makes metadata.create_all create the partitions right after the parent
+    table, so a fresh database is partitioned without running the migration tool.
+
+    :param table: Table: The contacts table
+    """
+    for statement in create_partitions_ddl(table.name, config.contacts_partitions):
+        event.listen(table, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+
+def _create_shadow_table(connection: Connection, partitions: int) -> None:
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {NEW_TABLE} (LIKE {TABLE} INCLUDING DEFAULTS)
+        PARTITION BY HASH (user_id)
+    """))
+    connection.execute(text(f"ALTER TABLE {NEW_TABLE} ALTER COLUMN user_id SET NOT NULL"))
+    for constraint in (f"{NEW_TABLE}_pkey PRIMARY KEY (id, user_id)",
+                       f"{NEW_TABLE}_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)"):
+        connection.execute(text(f"""
+            DO $$ BEGIN
+                ALTER TABLE {NEW_TABLE} ADD CONSTRAINT {constraint};
+            EXCEPTION WHEN duplicate_table OR duplicate_object OR invalid_table_definition THEN NULL;
+            END $$
+        """))
+    for statement in create_partitions_ddl(NEW_TABLE, partitions):
+        connection.execute(text(statement))
+    for name, columns in INDEXES.items():
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name}_p ON {NEW_TABLE} {columns}"))
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {DELETED_TABLE} (id bigint NOT NULL, user_id integer NOT NULL,
+                                                    PRIMARY KEY (id, user_id))
+    """))
+
+
+def _create_mirror_trigger(connection: Connection) -> None:
+    columns = connection.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = :table AND column_name NOT IN ('id', 'user_id')
+        ORDER BY ordinal_position
+    """), {"table": TABLE}).scalars().all()
+    assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns)
+    # The trigger upserts, so a row copied by a batch that raced with a live update ends up with the newer version.
+    # A delete can not be mirrored that way: a batch whose snapshot still has the row inserts it after the trigger
+    # deleted nothing, so the key is also recorded in DELETED_TABLE and removed again by _apply_deletes.
+    connection.execute(text(f"""
+        CREATE OR REPLACE FUNCTION {NEW_TABLE}_mirror() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.user_id IS DISTINCT FROM NEW.user_id) THEN
+                DELETE FROM {NEW_TABLE} WHERE id = OLD.id AND user_id = OLD.user_id;
+                IF OLD.user_id IS NOT NULL THEN
+                    INSERT INTO {DELETED_TABLE} VALUES (OLD.id, OLD.user_id) ON CONFLICT DO NOTHING;
+                END IF;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.user_id IS NOT NULL THEN
+                INSERT INTO {NEW_TABLE} SELECT (NEW).*
+                ON CONFLICT (id, user_id) DO UPDATE SET {assignments};
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    connection.execute(text(f"DROP TRIGGER IF EXISTS {NEW_TABLE}_mirror ON {TABLE}"))
+    connection.execute(text(f"""
+        CREATE TRIGGER {NEW_TABLE}_mirror AFTER INSERT OR UPDATE OR DELETE ON {TABLE}
+        FOR EACH ROW EXECUTE FUNCTION {NEW_TABLE}_mirror()
+    """))
+
+
+def _apply_deletes(connection: Connection) -> int:
+    # Rows copied from a snapshot taken before their delete committed; the key must also be gone from the live
+    # table, so a row whose user_id was changed back is kept
+    result = connection.execute(text(f"""
+        DELETE FROM {NEW_TABLE} n USING {DELETED_TABLE} d
+        WHERE n.id = d.id AND n.user_id = d.user_id
+          AND NOT EXISTS (SELECT 1 FROM {TABLE} c WHERE c.id = d.id AND c.user_id = d.user_id)
+    """))
+    return result.rowcount
+
+
+def _copy_batches(connection: Connection, batch_size: int, pause: float) -> int:
+    max_id = connection.execute(text(f"SELECT coalesce(max(id), 0) FROM {TABLE}")).scalar()
+    connection.commit()
+    copied = 0
+    for low in range(0, max_id, batch_size):
+        result = connection.execute(text(f"""
+            INSERT INTO {NEW_TABLE}
+            SELECT * FROM {TABLE} WHERE id > :low AND id <= :high AND user_id IS NOT NULL
+            ON CONFLICT DO NOTHING
+        """), {"low": low, "high": low + batch_size})
+        connection.commit()
+        # Deletes that committed after the snapshot of the batch; a delete still in flight now is applied
+        # by a later batch or under the lock of the swap
+        _apply_deletes(connection)
+        connection.commit()
+        copied += result.rowcount
+        logger.info("partitioning: copied ids up to %s of %s", min(low + batch_size, max_id), max_id)
+        if pause:
+            time.sleep(pause)
+    return copied
+
+
+def _swap_tables(connection: Connection) -> None:
+    connection.execute(text(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE"))
+    connection.execute(text(f"DROP TRIGGER IF EXISTS {NEW_TABLE}_mirror ON {TABLE}"))
+    connection.execute(text(f"DROP FUNCTION IF EXISTS {NEW_TABLE}_mirror()"))
+    # Every writer of the live table has finished, the last deletes are committed
+    if connection.execute(text(f"SELECT to_regclass('{DELETED_TABLE}')")).scalar() is not None:
+        _apply_deletes(connection)
+        connection.execute(text(f"DROP TABLE {DELETED_TABLE}"))
+    connection.execute(text(f"ALTER TABLE {TABLE} RENAME TO {OLD_TABLE}"))
+    connection.execute(text(f"ALTER TABLE {NEW_TABLE} RENAME TO {TABLE}"))
+    for name in INDEXES:
+        connection.execute(text(f"ALTER INDEX IF EXISTS {name} RENAME TO {name}_old"))
+        connection.execute(text(f"ALTER INDEX {name}_p RENAME TO {name}"))
+    connection.execute(text(f"ALTER SEQUENCE IF EXISTS {TABLE}_id_seq OWNED BY {TABLE}.id"))
+
+
+def migrate_online(connection: Connection, partitions: int, batch_size: int = 10000, pause: float = 0.0) -> dict:
+    """
+    The migrate_online function converts the existing contacts table into a hash partitioned one
+    while the application keeps writing to it. The partitioned copy is created next to the live table,
+    concurrent writes are mirrored into it by a trigger, rows are copied in primary key batches
+    (one transaction per batch) and the tables are swapped under a short ACCESS EXCLUSIVE lock.
+    Rows deleted while a batch copied them are removed again after every batch and under the lock of the swap.
+    Run it with: python -m src.database.partitioning --partitions 16 --batch-size 10000
+
+    :param connection: Connection: A PostgreSQL connection
+    :param partitions: int: Number of hash partitions
+    :param batch_size: int: Ids copied per transaction
+    :param pause: float: Seconds to sleep between batches to limit the load
+    :return: A dict with the number of copied rows and rows left behind because they have no user
+    """
+    if connection.dialect.name != "postgresql":
+        raise RuntimeError("Partitioning of contacts is supported on PostgreSQL only")
+
+    _create_shadow_table(connection, partitions)
+    _create_mirror_trigger(connection)
+    connection.commit()
+
+    copied = _copy_batches(connection, batch_size, pause)
+
+    _swap_tables(connection)
+    orphans = connection.execute(text(f"SELECT count(*) FROM {OLD_TABLE} WHERE user_id IS NULL")).scalar()
+    connection.commit()
+    if orphans:
+        logger.warning("partitioning: %s contacts without user stay in %s", orphans, OLD_TABLE)
+
+    return {"copied": copied, "orphans": orphans}
+
+
+if __name__ == "__main__":
+    from src.database.db import engine
+
+    parser = argparse.ArgumentParser(description="Convert contacts into a hash partitioned table online")
+    parser.add_argument("--partitions", type=int, default=config.contacts_partitions or 16)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--pause", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with engine.connect() as db_connection:
+        summary = migrate_online(db_connection, args.partitions, args.batch_size, args.pause)
+    logger.info("partitioning finished: %s", summary)
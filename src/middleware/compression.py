@@ -0,0 +1,208 @@
+import zlib
+from typing import Optional
+
+from fastapi import Request
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.conf.config import config
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+SCOPE_KEY = "compression"
+EXCLUDED_CONTENT_TYPES = (
+    "image/", "video/", "audio/", "font/woff", "application/zip", "application/gzip", "application/x-gzip",
+    "application/zstd", "application/x-brotli", "application/octet-stream",
+)
+
+
+class GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    name = "br"
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+class ZstdEncoder:
+    name = "zstd"
+
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+def available_encoders() -> dict:
+    encoders = {"gzip": (GzipEncoder, config.compression_gzip_level)}
+    if brotli is not None:
+        encoders["br"] = (BrotliEncoder, config.compression_brotli_quality)
+    if zstandard is not None:
+        encoders["zstd"] = (ZstdEncoder, config.compression_zstd_level)
+    return encoders
+
+
+def negotiate_encoding(accept_encoding: str, supported) -> Optional[str]:
+    """
+    The negotiate_encoding function picks the encoding for a response from the Accept-Encoding header.
+    Encodings with q=0 are refused, among the accepted ones the client's q value wins and the order of supported
+    (the server preference) breaks ties.
+
+    :param accept_encoding: str: Value of the Accept-Encoding header
+    :param supported: Iterable[str]: Encodings the server can produce, preferred first
+    :return: The name of the encoding or None
+    """
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip()] = quality
+    candidates = []
+    for preference, name in enumerate(supported):
+        quality = accepted.get(name, accepted.get("*", 0.0))
+        if quality > 0:
+            candidates.append((-quality, preference, name))
+    return min(candidates)[2] if candidates else None
+
+
+def no_compression(request: Request) -> None:
+    """
+    The no_compression dependency turns the compression off for one route:
+    @router.get("/path", dependencies=[Depends(no_compression)])
+
+    :param request: Request: The current request
+    """
+    request.scope[SCOPE_KEY] = False
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with zstd, brotli or gzip, whichever the client accepts and the server has installed.
+    Small bodies (under minimum_size), already encoded bodies, binary content types and routes with the
+    no_compression dependency are sent as they are. Streaming responses are compressed chunk by chunk and flushed
+    after every chunk, so nothing is buffered and the client receives each chunk as soon as it is produced.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = None, encoders: dict = None):
+        self.app = app
+        self.minimum_size = config.compression_minimum_size if minimum_size is None else minimum_size
+        self.encoders = encoders or available_encoders()
+        self.preference = [name for name in ("zstd", "br", "gzip") if name in self.encoders]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""), self.preference)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        encoder_class, level = self.encoders[encoding]
+        responder = CompressionResponder(self.app, lambda: encoder_class(level), self.minimum_size)
+        await responder(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoder_factory, minimum_size: int):
+        self.app = app
+        self.encoder_factory = encoder_factory
+        self.minimum_size = minimum_size
+        self.scope: Scope = {}
+        self.send: Optional[Send] = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+        self.encoder = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.scope = scope
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def _skip(self, headers: Headers) -> bool:
+        content_type = headers.get("content-type", "")
+        return (
+            self.scope.get(SCOPE_KEY) is False
+            or "content-encoding" in headers
+            or content_type.startswith(EXCLUDED_CONTENT_TYPES)
+        )
+
+    def _set_headers(self, streaming: bool, length: int = 0) -> None:
+        headers = MutableHeaders(raw=self.initial_message["headers"])
+        headers["Content-Encoding"] = self.encoder.name
+        headers.add_vary_header("Accept-Encoding")
+        if streaming:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(length)
+
+    async def send_compressed(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Held back until the first body chunk shows whether the response is worth compressing
+            self.initial_message = message
+            self.passthrough = self._skip(Headers(raw=message["headers"]))
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.started:
+            self.started = True
+            if self.passthrough or (not more_body and len(body) < self.minimum_size):
+                self.passthrough = True
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+            self.encoder = self.encoder_factory()
+            if more_body:
+                self._set_headers(streaming=True)
+                message["body"] = self.encoder.compress(body)
+            else:
+                message["body"] = self.encoder.finish(body)
+                self._set_headers(streaming=False, length=len(message["body"]))
+            await self.send(self.initial_message)
+            await self.send(message)
+            return
+
+        if not self.passthrough:
+            message["body"] = self.encoder.compress(body) if more_body else self.encoder.finish(body)
+        await self.send(message)
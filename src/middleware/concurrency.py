@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.conf.config import config
+from src.services.metrics import metrics
+
+# Paths that never wait for a slot: probes must answer while the application is overloaded,
+# the events stream holds its connection for minutes and does not use the database pool.
+EXEMPT_PATHS = (
+    "/livez", "/readyz", "/metrics", "/.well-known/", "/api/healthchecker", "/api/contacts/events",
+    "/docs", "/redoc", "/openapi.json",
+)
+
+metrics.describe("requests_shed_total", "Requests rejected with 503 by the concurrency limiter, by route group")
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdaptiveLimiter:
+    """
+    A concurrency limit that follows the latency of the requests it admits (AIMD, gradient style).
+    The lowest latency seen recently is the baseline of the unloaded service. While samples stay below
+    baseline * tolerance and the limit is in use, the limit grows by one per limit completed requests.
+    A slower sample or a failure multiplies the limit by backoff, at most once per baseline latency,
+    so a burst of slow responses counts as one congestion signal.
+    Waiting requests are admitted by priority (lower first), then in arrival order.
+    """
+
+    def __init__(self, name: str, initial: int, min_limit: int = 1, max_limit: int = 100,
+                 tolerance: float = 2.0, backoff: float = 0.9):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters = []
+        self._order = itertools.count()
+        metrics.gauge(f"concurrency_limit_{name}", lambda: int(self.limit),
+                      f"Current concurrency limit of the {name} requests")
+        metrics.gauge(f"concurrency_in_flight_{name}", lambda: self.in_flight,
+                      f"Admitted {name} requests that did not finish yet")
+
+    def _has_room(self, share: float) -> bool:
+        return self.in_flight < max(1, int(self.limit * share))
+
+    async def acquire(self, priority: int = 0, timeout: float = 1.0, share: float = 1.0) -> None:
+        """
+        The acquire method waits for a free slot.
+
+        :param priority: int: Requests with a lower priority number are admitted first
+        :param timeout: float: Longest wait in the queue
+        :param share: float: Part of the limit the request may use, keeps room for other route groups
+        :raises Overloaded: When no slot is free before the timeout
+        """
+        if self._has_room(share) and (not self._waiters or self._waiters[0][0] > priority):
+            self.in_flight += 1
+            return
+        if timeout <= 0:
+            raise Overloaded(self.name)
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._order), future, share]
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._abandon(entry)
+            raise Overloaded(self.name) from None
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+
+    def _abandon(self, entry: list) -> None:
+        future = entry[2]
+        if future.done() and not future.cancelled():
+            # Admitted while the wait was given up: hand the slot on
+            self.in_flight -= 1
+            self._wake()
+            return
+        future.cancel()
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+
+    def release(self, latency: float, failed: bool = False) -> None:
+        """
+        The release method frees a slot and adapts the limit to the latency of the finished request.
+
+        :param latency: float: Time the request held the slot, in seconds
+        :param failed: bool: The request failed on the server side
+        """
+        saturated = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            # Let the baseline follow a lasting change of the service instead of the best sample ever seen
+            self.baseline += (latency - self.baseline) * 0.01
+
+        now = time.monotonic()
+        if failed or latency > self.baseline * self.tolerance:
+            if now - self._last_decrease > self.baseline:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif saturated:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            priority, order, future, share = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._has_room(share):
+                return
+            heapq.heappop(self._waiters)
+            self.in_flight += 1
+            future.set_result(None)
+
+
+@dataclass(slots=True)
+class RouteGroup:
+    name: str
+    limiter: AdaptiveLimiter
+    priority: int
+    queue_timeout: float
+    share: float = 1.0
+
+
+def default_groups() -> dict:
+    """
+    The default_groups function builds the route groups of the application.
+    Logins and signups are bound by bcrypt and have their own limit. Contact reads and writes share
+    the limit of the database pool; reads are admitted first and writes may use only a part of it,
+    so a storm of writes is shed while reads keep being served. Avatar uploads wait for Cloudinary
+    and are limited on their own.
+
+    :return: The route groups by name
+    """
+    database = AdaptiveLimiter("database", config.concurrency_database_limit,
+                               max_limit=config.concurrency_database_max_limit)
+    auth = AdaptiveLimiter("auth", config.concurrency_auth_limit, max_limit=config.concurrency_auth_max_limit)
+    uploads = AdaptiveLimiter("uploads", config.concurrency_uploads_limit,
+                              max_limit=config.concurrency_uploads_max_limit)
+    return {
+        "reads": RouteGroup("reads", database, priority=0, queue_timeout=config.concurrency_reads_queue_timeout),
+        "auth": RouteGroup("auth", auth, priority=1, queue_timeout=config.concurrency_auth_queue_timeout),
+        "writes": RouteGroup("writes", database, priority=2, queue_timeout=config.concurrency_writes_queue_timeout,
+                             share=config.concurrency_writes_share),
+        "uploads": RouteGroup("uploads", uploads, priority=3,
+                              queue_timeout=config.concurrency_uploads_queue_timeout),
+    }
+
+
+def route_group(method: str, path: str) -> Optional[str]:
+    """
+    The route_group function maps a request to its route group.
+
+    :param method: str: HTTP method
+    :param path: str: Path of the request
+    :return: Name of the group, None for requests that are not limited
+    """
+    if path.startswith(EXEMPT_PATHS) or method == "OPTIONS":
+        return None
+    if path.startswith("/auth/"):
+        return "auth"
+    if path.startswith("/users/avatar"):
+        return "uploads"
+    if path.startswith(("/api/", "/users/")):
+        return "reads" if method in ("GET", "HEAD") else "writes"
+    return None
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Admits requests through the adaptive limit of their route group. A request that waits in the queue
+    longer than the deadline of its group gets a 503 with Retry-After at once, instead of holding a
+    threadpool worker until the client times out.
+    """
+
+    def __init__(self, app: ASGIApp, groups: dict = None, retry_after: int = None):
+        self.app = app
+        self.groups = default_groups() if groups is None else groups
+        self.retry_after = config.concurrency_retry_after if retry_after is None else retry_after
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        name = route_group(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        group = self.groups.get(name)
+        if group is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await group.limiter.acquire(group.priority, group.queue_timeout, group.share)
+        except Overloaded:
+            metrics.inc("requests_shed_total", group=group.name)
+            await self.reject(send)
+            return
+
+        failed = False
+
+        async def send_status(message: Message) -> None:
+            nonlocal failed
+            if message["type"] == "http.response.start":
+                # 503 and 504 come from exhausted dependencies, other errors say nothing about the load
+                failed = message["status"] in (503, 504)
+            await send(message)
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send_status)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            group.limiter.release(time.monotonic() - started, failed)
+
+    async def reject(self, send: Send) -> None:
+        body = json.dumps({"detail": "Server is overloaded, retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
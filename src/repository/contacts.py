@@ -1,82 +1,746 @@
-from datetime import datetime
+import base64
+import binascii
+import json
+from collections import defaultdict, Counter, namedtuple
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
 
-from sqlalchemy import text
+from sqlalchemy import text, select, update, delete, insert, bindparam, union, tuple_, literal, type_coerce, \
+    DateTime, String
 
-from src.database.models import Contact
-from sqlalchemy.orm import Session
+from src.database.models import Contact, ContactTombstone, ContactTag, Tag, ContactChangeFeed
+from sqlalchemy.orm import Session, load_only, noload
 from src.database.models import User
+from src.repository.stats import apply_stats_delta, contact_delta, birthday_moved, UPSERT_DIALECTS
+from src.repository.tags import remove_contact_tags, copy_contact_tags
+from src.schemas import CONTACT_FIELDS
+from src.services.audit import AUDIT_FIELDS, audit_contact_change, contact_snapshot
+from src.services.events import publish_contact_event, publish_contact_events, contact_event
+from src.services.group_commit import commit
+from src.services.singleflight import coalesce, forget_after_commit
+from src.services.normalize import normalize_phone, normalize_email, email_domain
 
 
-def get_contacts(user: User, session: Session):
-    contacts = session.query(Contact).filter_by(user=user).all()
+# Hot queries are built once: a module level statement has a memoized cache key and always hits
+# the compiled cache of the engine, values are passed as bind parameters on every call.
+CONTACTS_BY_USER = select(Contact).where(Contact.user_id == bindparam("user_id"))
+CONTACT_BY_ID = CONTACTS_BY_USER.where(Contact.id == bindparam("contact_id")).limit(1)
+CONTACT_BY_PHONE = CONTACTS_BY_USER.where(Contact.phone_e164 == bindparam("phone_e164")).limit(1)
+CONTACT_BY_NAME = CONTACTS_BY_USER.where(Contact.name == bindparam("name")).limit(1)
+CONTACT_BY_EMAIL = CONTACTS_BY_USER.where(Contact.email_lower == bindparam("email_lower")).limit(1)
+CONTACT_BY_SUR_NAME = CONTACTS_BY_USER.where(Contact.sur_name == bindparam("sur_name")).limit(1)
+AUDITED_COLUMNS = tuple(getattr(Contact, name) for name in AUDIT_FIELDS)
+
+
+@lru_cache(maxsize=256)
+def _only_fields(stmt, fields):
+    # Sparse fieldsets: load only the requested columns and never touch the users row.
+    # Cached per (statement, fields), so a repeated fieldset reuses the same statement object.
+    if fields:
+        stmt = stmt.options(load_only(*(getattr(Contact, name) for name in fields)), noload(Contact.user))
+    return stmt
+
+
+def _fields_key(fields):
+    return tuple(fields) if fields else None
+
+
+def get_contacts(user: User, session: Session, fields=None):
+    contacts = session.scalars(_only_fields(CONTACTS_BY_USER, _fields_key(fields)), {"user_id": user.id}).all()
     return contacts
 
 
-def get_contact_by_id(contact_id, user: User, session: Session):
-    contact = session.query(Contact).filter_by(id=contact_id, user=user).first()
+contacts_table = Contact.__table__
+
+
+@lru_cache(maxsize=256)
+def _rows_statement(fields):
+    return select(*(contacts_table.c[name] for name in fields or CONTACT_FIELDS)) \
+        .where(contacts_table.c.user_id == bindparam("user_id"))
+
+
+@lru_cache(maxsize=256)
+def _record_class(fields):
+    # Attribute access by name for the response adapters; a tuple with __slots__ = (), smaller than
+    # a Row of the result or a Contact with its instance state, and immutable, so coalesced callers can share it
+    return namedtuple("ContactRecord", fields or CONTACT_FIELDS)
+
+
+@coalesce(lambda user, fields, **_: (user.id, _fields_key(fields)))
+def get_contact_rows(user: User, session: Session, fields=None):
+    """
+    The get_contact_rows function is the read-only variant of get_contacts for responses that are serialized
+    right away. It runs a Core select of the contacts columns on the connection of the session, so no Contact
+    objects are built: no identity map, no unit of work, no relationship loading.
+
+    :param user: User: Owner of the contacts
+    :param session: Session: Database session, its transaction is used
+    :param fields: Requested fields or None for all fields of the response
+    :return: A list of ContactRecord tuples with the requested fields
+    """
+    key = _fields_key(fields)
+    result = session.connection().execute(_rows_statement(key), {"user_id": user.id})
+    return list(map(_record_class(key)._make, result))
+
+
+@lru_cache(maxsize=256)
+def _row_statement(fields):
+    return _rows_statement(fields).where(contacts_table.c.id == bindparam("contact_id")).limit(1)
+
+
+@coalesce(lambda contact_id, user, fields, **_: (user.id, contact_id, _fields_key(fields)))
+def get_contact_row(contact_id, user: User, session: Session, fields=None):
+    """
+    The get_contact_row function is the read-only variant of get_contact_by_id, a ContactRecord tuple
+    that concurrent readers of the same contact can share. Write paths load the contact with get_contact_by_id.
+
+    :param contact_id: int: Id of the contact
+    :param user: User: Owner of the contact
+    :param session: Session: Database session, its transaction is used
+    :param fields: Requested fields or None for all fields of the response
+    :return: A ContactRecord tuple or None
+    """
+    key = _fields_key(fields)
+    row = session.connection().execute(_row_statement(key), {"user_id": user.id, "contact_id": contact_id}).first()
+    return None if row is None else _record_class(key)._make(row)
+
+
+def get_contacts_by_tags(names, match_all: bool, user: User, session: Session, limit: int, after: int = 0,
+                         fields=None):
+    """
+    The get_contacts_by_tags function lists the contacts of a user that have any or all of the given tags,
+    in id order and a page at a time (after is the last id of the previous page).
+    Every step is an index lookup: the tags by (user_id, name), the links of a tag in contact order by the
+    (tag_id, contact_id) key. With any, each tag contributes at most one page of ids; with all, the smallest tag
+    drives the scan and the other tags are probed per contact until the page is full. The cost follows the page
+    size and the tags, not the size of the address book.
+
+    :param names: List[str]: Names of the tags
+    :param match_all: bool: Contacts must have all tags, otherwise any of them
+    :param user: User: Owner of the contacts
+    :param session: Session: Database session
+    :param limit: int: Size of the page
+    :param after: int: Return contacts with a greater id
+    :param fields: Requested fields or None for all fields of the response
+    :return: A list of ContactRecord tuples
+    """
+    names = set(names)
+    tags = session.execute(
+        select(Tag.id, Tag.contact_count).where(Tag.user_id == user.id, Tag.name.in_(names))
+    ).all()
+    if not tags or (match_all and len(tags) < len(names)):
+        return []
+
+    links = ContactTag.__table__
+
+    def page_of(tag_id, *conditions):
+        # The next ids of one tag straight from the (tag_id, contact_id) key, at most one page of them
+        page = (
+            select(links.c.contact_id)
+            .where(links.c.tag_id == tag_id, links.c.contact_id > after, *conditions)
+            .order_by(links.c.contact_id)
+            .limit(limit)
+            .subquery()
+        )
+        return select(page.c.contact_id)
+
+    if match_all:
+        driver, *others = sorted(tags, key=lambda tag: tag.contact_count)
+        probes = []
+        for tag in others:
+            other = links.alias()
+            probes.append(select(other.c.contact_id)
+                          .where(other.c.tag_id == tag.id, other.c.contact_id == links.c.contact_id).exists())
+        contact_ids = page_of(driver.id, *probes)
+    else:
+        contact_ids = union(*(page_of(tag.id) for tag in tags))
+
+    key = _fields_key(fields)
+    ids = contact_ids.subquery()
+    # The page of ids drives the join, the contacts are fetched by primary key
+    stmt = (
+        select(*(contacts_table.c[name] for name in key or CONTACT_FIELDS))
+        .join_from(ids, contacts_table, contacts_table.c.id == ids.c.contact_id)
+        .where(contacts_table.c.user_id == bindparam("user_id"))
+        .order_by(contacts_table.c.id)
+        .limit(limit)
+    )
+    result = session.connection().execute(stmt, {"user_id": user.id})
+    return list(map(_record_class(key)._make, result))
+
+
+@dataclass(frozen=True, slots=True)
+class QueryPlan:
+    column: str
+    index: str
+    filters: tuple
+
+
+# The list query API: every sort key is served by one (user_id, column, id) index and only filters on that same
+# column are accepted, so the WHERE, the ORDER BY and the keyset condition are all ranges of that index.
+# Any other combination is rejected instead of silently falling back to a scan of the address book.
+QUERY_PLANS = {
+    "name": QueryPlan("name", "ix_contacts_user_id_name", ("name_prefix",)),
+    "sur_name": QueryPlan("sur_name", "ix_contacts_user_id_sur_name", ("sur_name_prefix",)),
+    "email_domain": QueryPlan("email_domain", "ix_contacts_user_id_email_domain", ("email_domain",)),
+    "birthday": QueryPlan("birthday", "ix_contacts_user_id_birthday", ("birthday_from", "birthday_to")),
+    "created_at": QueryPlan("created_at", "ix_contacts_user_id_created_at", ("created_from", "created_to")),
+    "updated_at": QueryPlan("updated_at", "ix_contacts_user_id_updated_at", ("updated_from", "updated_to")),
+}
+QUERY_FILTERS = {name: key for key, plan in QUERY_PLANS.items() for name in plan.filters}
+DEFAULT_QUERY_SORT = "created_at"
+# Datetimes go into the cursor as the database returns the column as text. SQLite keeps them as strings in two
+# forms (func.now() without microseconds, Python values with them), a parsed and reformatted value would not be
+# equal to the stored one and the keyset condition would skip the rows of the same second.
+SORT_KEY = "sort_key"
+
+_declared_indexes = {index.name: tuple(item.name for item in index.columns) for index in contacts_table.indexes}
+for _plan in QUERY_PLANS.values():
+    if _declared_indexes.get(_plan.index) != ("user_id", _plan.column, "id"):
+        raise RuntimeError(f"Query plan {_plan.column} needs index {_plan.index} on (user_id, {_plan.column}, id)")
+
+
+def plan_contact_query(filters: dict, sort=None):
+    """
+    The plan_contact_query function picks the index that serves a query of the contact list.
+
+    :param filters: dict: Filter names of QUERY_FILTERS and their values, None values are ignored
+    :param sort: str: Sort key of QUERY_PLANS, with a - prefix for the descending order, or None
+    :return: A tuple of the QueryPlan and whether the order is descending
+    :raises ValueError: If the filters and the sort can not be served by one index
+    """
+    keys = {QUERY_FILTERS[name] for name, value in filters.items() if value is not None}
+    descending = bool(sort) and sort.startswith("-")
+    if sort:
+        sort = sort.lstrip("-")
+        if sort not in QUERY_PLANS:
+            raise ValueError(f"Unknown sort {sort}. Allowed: {', '.join(QUERY_PLANS)}")
+        keys.add(sort)
+    if len(keys) > 1:
+        raise ValueError(f"Filters and sort must use the same field, got: {', '.join(sorted(keys))}")
+    return QUERY_PLANS[keys.pop() if keys else DEFAULT_QUERY_SORT], descending
+
+
+def encode_query_cursor(plan: QueryPlan, descending: bool, record) -> str:
+    value = getattr(record, SORT_KEY, None) or getattr(record, plan.column)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([plan.column, descending, value, record.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_query_cursor(cursor: str, plan: QueryPlan, descending: bool):
+    """
+    The decode_query_cursor function parses a cursor returned by query_contacts.
+
+    :param cursor: str: Cursor of the previous page
+    :param plan: QueryPlan: Plan of the current query
+    :param descending: bool: Order of the current query
+    :return: A tuple of the sort value and the id of the last contact of the previous page
+    :raises ValueError: If the cursor is malformed or belongs to another sort
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        column_name, cursor_descending, value, last_id = json.loads(payload)
+    except (TypeError, binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as error:
+        raise ValueError("Invalid cursor") from error
+    if column_name != plan.column or cursor_descending != descending:
+        raise ValueError("Cursor belongs to another sort")
+    # Every sort value is a string in the cursor, datetimes in ISO format; anything else is a crafted cursor
+    if not isinstance(value, str) or not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise ValueError("Invalid cursor")
+    if isinstance(contacts_table.c[plan.column].type, DateTime):
+        # Compared as sent, in the form the column stored it, see SORT_KEY
+        try:
+            datetime.fromisoformat(value)
+        except ValueError as error:
+            raise ValueError("Invalid cursor") from error
+        value = literal(value, String)
+    return value, last_id
+
+
+def _as_datetime(value, end: bool = False):
+    # Dates of a range cover the whole day, the upper bound is exclusive midnight of the next day
+    if isinstance(value, datetime):
+        return value
+    return datetime.combine(value + timedelta(days=1) if end else value, datetime.min.time())
+
+
+def _query_conditions(plan: QueryPlan, filters: dict):
+    column_ = contacts_table.c[plan.column]
+    conditions = []
+    for name in plan.filters:
+        value = filters.get(name)
+        if value is None:
+            continue
+        if name.endswith("_prefix"):
+            # The range is what the index serves (LIKE is not sargable under every collation),
+            # startswith keeps the result exact
+            conditions += [column_ >= value, column_ < value + "\uffff", column_.startswith(value, autoescape=True)]
+        elif name.endswith("_from"):
+            conditions.append(column_ >= _as_datetime(value))
+        elif name.endswith("_to"):
+            if isinstance(value, datetime):
+                conditions.append(column_ <= value)
+            else:
+                conditions.append(column_ < _as_datetime(value, end=True))
+        else:
+            conditions.append(column_ == value.lower())
+    return conditions
+
+
+def query_contacts(filters: dict, sort, limit: int, cursor, user: User, session: Session, fields=None):
+    """
+    The query_contacts function returns one page of the contacts of a user filtered and sorted through
+    one of the QUERY_PLANS. The page continues after the (sort value, id) of the cursor, a keyset condition
+    on the same index, so a deep page costs as much as the first one. Rows with a NULL sort value are not listed.
+
+    :param filters: dict: Filter names of QUERY_FILTERS and their values
+    :param sort: str: Sort key, e.g. name or -created_at, or None for the order of the filter
+    :param limit: int: Size of the page
+    :param cursor: str: Cursor of the previous page or None
+    :param user: User: Owner of the contacts
+    :param session: Session: Database session
+    :param fields: Requested fields or None for all fields of the response
+    :return: A tuple of the list of ContactRecord tuples and the cursor of the next page or None
+    :raises ValueError: If the query is not served by an index or the cursor does not match it
+    """
+    plan, descending = plan_contact_query(filters, sort)
+    key = _fields_key(fields) or CONTACT_FIELDS
+    # The sort value and the id make the cursor, they are selected even when the response does not contain them
+    selected = key + tuple(name for name in ("id", plan.column) if name not in key)
+    column_, id_column = contacts_table.c[plan.column], contacts_table.c.id
+    columns = [contacts_table.c[name] for name in selected]
+    if isinstance(column_.type, DateTime):
+        columns.append(type_coerce(column_, String).label(SORT_KEY))
+        selected += (SORT_KEY,)
+
+    conditions = [contacts_table.c.user_id == user.id, *_query_conditions(plan, filters)]
+    if column_.nullable:
+        # A NULL has no place in the keyset order, such rows are not listed by a query on the column
+        conditions.append(column_.is_not(None))
+    if cursor:
+        value, last_id = decode_query_cursor(cursor, plan, descending)
+        after = tuple_(column_, id_column) < tuple_(value, last_id) if descending \
+            else tuple_(column_, id_column) > tuple_(value, last_id)
+        conditions.append(after)
+    order = (column_.desc(), id_column.desc()) if descending else (column_, id_column)
+
+    stmt = select(*columns).where(*conditions).order_by(*order).limit(limit + 1)
+    records = list(map(_record_class(selected)._make, session.connection().execute(stmt)))
+    if len(records) <= limit:
+        return records, None
+    records = records[:limit]
+    return records, encode_query_cursor(plan, descending, records[-1])
+
+
+def get_contact_by_id(contact_id, user: User, session: Session, fields=None):
+    stmt = _only_fields(CONTACT_BY_ID, _fields_key(fields))
+    contact = session.scalars(stmt, {"user_id": user.id, "contact_id": contact_id}).first()
 
     return contact
 
 
 def get_contact_by_phone(phone, user: User, session: Session):
-    return session.query(Contact).filter_by(phone=phone, user=user).first()
+    return session.scalars(CONTACT_BY_PHONE, {"user_id": user.id, "phone_e164": normalize_phone(phone)}).first()
 
 
-def get_contact_by_name(name, user: User, session: Session):
-    return session.query(Contact).filter_by(name=name).first()
+def get_contact_by_name(name, user: User, session: Session, fields=None):
+    stmt = _only_fields(CONTACT_BY_NAME, _fields_key(fields))
+    return session.scalars(stmt, {"user_id": user.id, "name": name}).first()
 
 
-def get_contact_by_email(email, user: User, session: Session):
-    return session.query(Contact).filter_by(email=email).first()
+def get_contact_by_email(email, user: User, session: Session, fields=None):
+    stmt = _only_fields(CONTACT_BY_EMAIL, _fields_key(fields))
+    return session.scalars(stmt, {"user_id": user.id, "email_lower": normalize_email(email)}).first()
 
 
-def get_contact_by_sur_name(sur_name, user: User, session: Session):
-    return session.query(Contact).filter_by(sur_name=sur_name).first()
+def get_contact_by_sur_name(sur_name, user: User, session: Session, fields=None):
+    stmt = _only_fields(CONTACT_BY_SUR_NAME, _fields_key(fields))
+    return session.scalars(stmt, {"user_id": user.id, "sur_name": sur_name}).first()
+
+
+def lock_change_feed(user_id: int, session: Session) -> None:
+    """
+    The lock_change_feed function locks the change feed row of a user until the end of the current transaction.
+    Every write path calls it before its first change of a contact or a tombstone, so the writers of one user
+    take their change_seq values one transaction at a time, in commit order.
+
+    :param user_id: int: Owner of the contacts
+    :param session: Session: Database session of the write
+    """
+    feeds = ContactChangeFeed.__table__
+    stmt = UPSERT_DIALECTS[session.get_bind().dialect.name](feeds).values(user_id=user_id, writes=1)
+    session.execute(stmt.on_conflict_do_update(index_elements=[feeds.c.user_id],
+                                               set_={"writes": feeds.c.writes + 1}))
+
+
+def lock_change_feeds(user_ids, session: Session) -> None:
+    """
+    The lock_change_feeds function locks the change feed rows of several users in the order of their ids,
+    without counting a write. The write batcher calls it before the writes of a batch, which lock the rows
+    again without waiting.
+
+    :param user_ids: Ids of the users, sorted
+    :param session: Session: Database session of the batch
+    """
+    feeds = ContactChangeFeed.__table__
+    stmt = UPSERT_DIALECTS[session.get_bind().dialect.name](feeds).values(user_id=bindparam("b_user_id"), writes=0)
+    stmt = stmt.on_conflict_do_update(index_elements=[feeds.c.user_id], set_={"writes": feeds.c.writes})
+    for user_id in user_ids:
+        session.execute(stmt, {"b_user_id": user_id})
 
 
 def create_contact(body, user: User, session: Session):
+    lock_change_feed(user.id, session)
     contact = Contact()
     contact.phone = body.phone
+    contact.phone_e164 = normalize_phone(body.phone)
     contact.email = body.email
+    contact.email_lower = normalize_email(body.email)
+    contact.email_domain = email_domain(body.email)
     contact.name = body.name
     contact.sur_name = body.sur_name
     contact.birthday = body.birthday
-    contact.user = user
+    contact.user_id = user.id
     session.add(contact)
-    session.commit()
-    session.refresh(contact)
+    session.flush()
+    apply_stats_delta(user.id, contact_delta(1, contact.birthday), session, added=True)
+    forget_after_commit(session, user.id)
+    publish_contact_event(session, user.id, "created", contact.id, _event_fields(body))
+    audit_contact_change(session, user.id, contact.id, "created", after=contact_snapshot(contact))
+    commit(session)
     return contact
 
 
 def delete_contact(contact, session: Session):
+    lock_change_feed(contact.user_id, session)
     session.delete(contact)
-    session.commit()
+    _record_tombstones(contact.user_id, [contact.id], session)
+    remove_contact_tags([contact.id], session)
+    apply_stats_delta(contact.user_id, contact_delta(-1, contact.birthday), session)
+    forget_after_commit(session, contact.user_id)
+    publish_contact_event(session, contact.user_id, "deleted", contact.id)
+    audit_contact_change(session, contact.user_id, contact.id, "deleted", before=contact_snapshot(contact))
+    commit(session)
 
     return contact
 
 
 def update_contact(body, contact, session):
+    lock_change_feed(contact.user_id, session)
+    stats_delta = birthday_moved(contact.birthday, body.birthday)
+    before = contact_snapshot(contact)
     contact.phone = body.phone
+    contact.phone_e164 = normalize_phone(body.phone)
     contact.email = body.email
+    contact.email_lower = normalize_email(body.email)
+    contact.email_domain = email_domain(body.email)
     contact.name = body.name
     contact.sur_name = body.sur_name
     contact.birthday = body.birthday
     session.add(contact)
-    session.commit()
+    apply_stats_delta(contact.user_id, stats_delta, session)
+    forget_after_commit(session, contact.user_id)
+    publish_contact_event(session, contact.user_id, "updated", contact.id, _event_fields(body))
+    audit_contact_change(session, contact.user_id, contact.id, "updated", before, contact_snapshot(contact))
+    commit(session)
 
     return contact
 
 
-def get_contact_week_birthdays(user: User, session: Session):
-    current_date = datetime.now()
-    current_month = current_date.month
+def _event_fields(body) -> dict:
+    return {"name": body.name, "sur_name": body.sur_name, "email": body.email, "phone": body.phone,
+            "birthday": str(body.birthday)}
+
 
-    contacts = session.execute(text("""
+WEEK_BIRTHDAYS = text("""
             SELECT *
             FROM contacts AS con
             WHERE user_id = :userid
                 AND EXTRACT(WEEK FROM con.birthday) = EXTRACT(WEEK FROM :current_date)
               AND EXTRACT(MONTH FROM con.birthday) = :current_month;
-            """), {"userid":user.id, "current_date": current_date, "current_month": current_month}).all()
+            """)
+
+
+def get_contact_week_birthdays(user: User, session: Session):
+    current_date = datetime.now()
+    current_month = current_date.month
+
+    contacts = session.execute(WEEK_BIRTHDAYS, {"userid": user.id, "current_date": current_date,
+                                                "current_month": current_month}).all()
 
     return contacts
+
+
+BATCH_CHUNK_SIZE = 1000
+SYNC_CURSOR_SEPARATOR = "."
+
+
+def _chunked(items, size=BATCH_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _record_tombstones(user_id, contact_ids, session: Session):
+    # Core executemany, so every row takes its own value of the change sequence
+    if contact_ids:
+        session.execute(insert(ContactTombstone.__table__),
+                        [{"contact_id": contact_id, "user_id": user_id} for contact_id in contact_ids])
+
+
+def _deleted_delta(birthdays) -> Counter:
+    delta = Counter()
+    for birthday in birthdays:
+        delta.update(contact_delta(-1, birthday))
+    return delta
+
+
+def update_contacts_batch(patches, user: User, session: Session):
+    """
+    The update_contacts_batch function applies a list of partial updates to the contacts of a user.
+    Patches that set the same fields are grouped and sent as one executemany UPDATE, so the whole batch
+    costs a handful of statements and a single commit instead of one transaction per contact.
+
+    :param patches: List[ContactPatchSchema]: Partial updates, each one carries the id of the contact
+    :param user: User: Owner of the contacts
+    :param session: Session: Database session
+    :return: A list of dicts with the id and the outcome (updated, unchanged, not_found or conflict) of each patch
+    """
+    ids = {patch.id for patch in patches}
+    # Current values of the audited fields, also the "before" of the audit diffs
+    existing = {}
+    for chunk in _chunked(ids):
+        rows = session.execute(
+            select(Contact.id, *AUDITED_COLUMNS).where(Contact.user_id == user.id, Contact.id.in_(chunk))
+        )
+        existing.update({row.id: row._asdict() for row in rows})
+
+    phones = {normalize_phone(patch.phone) for patch in patches if patch.phone is not None and patch.id in existing}
+    phone_owners = {}
+    for chunk in _chunked(phones):
+        rows = session.execute(
+            select(Contact.id, Contact.phone_e164).where(Contact.user_id == user.id, Contact.phone_e164.in_(chunk))
+        )
+        phone_owners.update({row.phone_e164: row.id for row in rows})
+
+    lock_change_feed(user.id, session)
+    results = []
+    groups = defaultdict(list)
+    stats_delta = Counter()
+    events = []
+    for patch in patches:
+        if patch.id not in existing:
+            results.append({"id": patch.id, "status": "not_found"})
+            continue
+        values = patch.model_dump(exclude_unset=True, exclude={"id"})
+        if "phone" in values:
+            values["phone_e164"] = normalize_phone(values["phone"])
+            owner = phone_owners.get(values["phone_e164"])
+            if owner is not None and owner != patch.id:
+                results.append({"id": patch.id, "status": "conflict",
+                                "detail": f"Another contact id={owner} already had phone {values['phone']}!"})
+                continue
+            phone_owners[values["phone_e164"]] = patch.id
+        if "email" in values:
+            values["email_lower"] = normalize_email(values["email"])
+            values["email_domain"] = email_domain(values["email"])
+        if "birthday" in values:
+            stats_delta.update(birthday_moved(existing[patch.id]["birthday"], values["birthday"]))
+        if not values:
+            results.append({"id": patch.id, "status": "unchanged"})
+            continue
+        groups[tuple(sorted(values))].append({"b_id": patch.id, **{f"v_{key}": value for key, value in values.items()}})
+        changed = patch.model_dump(mode="json", exclude_unset=True, exclude={"id"})
+        events.append(contact_event("updated", patch.id, changed))
+        after = {**existing[patch.id], **values}
+        audit_contact_change(session, user.id, patch.id, "updated", existing[patch.id], after)
+        existing[patch.id] = after
+        results.append({"id": patch.id, "status": "updated"})
+
+    for fields, params in groups.items():
+        stmt = (
+            update(contacts_table)
+            .where(contacts_table.c.id == bindparam("b_id"), contacts_table.c.user_id == user.id)
+            .values({field: bindparam(f"v_{field}") for field in fields})
+        )
+        session.execute(stmt, params)
+    apply_stats_delta(user.id, stats_delta, session)
+    forget_after_commit(session, user.id)
+    publish_contact_events(session, user.id, events)
+    session.commit()
+
+    return results
+
+
+def delete_contacts_batch(contact_ids, user: User, session: Session):
+    """
+    The delete_contacts_batch function deletes a list of contacts of a user with set-based DELETE statements.
+
+    :param contact_ids: List[int]: Ids of the contacts to delete
+    :param user: User: Owner of the contacts
+    :param session: Session: Database session
+    :return: A list of dicts with the id and the outcome (deleted or not_found) of each requested id
+    """
+    lock_change_feed(user.id, session)
+    deleted = {}
+    for chunk in _chunked(set(contact_ids)):
+        stmt = (
+            delete(Contact)
+            .where(Contact.user_id == user.id, Contact.id.in_(chunk))
+            .returning(Contact.id, *AUDITED_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )
+        deleted.update({row.id: row._asdict() for row in session.execute(stmt)})
+    _record_tombstones(user.id, sorted(deleted), session)
+    for chunk in _chunked(sorted(deleted)):
+        remove_contact_tags(chunk, session)
+    apply_stats_delta(user.id, _deleted_delta(row["birthday"] for row in deleted.values()), session)
+    forget_after_commit(session, user.id)
+    publish_contact_events(session, user.id, [contact_event("deleted", contact_id) for contact_id in sorted(deleted)])
+    for contact_id in sorted(deleted):
+        audit_contact_change(session, user.id, contact_id, "deleted", before=deleted[contact_id])
+    session.commit()
+
+    return [{"id": contact_id, "status": "deleted" if contact_id in deleted else "not_found"}
+            for contact_id in contact_ids]
+
+
+def merge_contacts(primary_id, duplicate_ids, user: User, session: Session):
+    """
+    The merge_contacts function collapses duplicates into one contact of the user in a single transaction.
+    The primary contact keeps its data and the duplicates are deleted.
+
+    :param primary_id: int: Id of the contact that survives the merge
+    :param duplicate_ids: List[int]: Ids of the contacts merged into the primary one
+    :param user: User: Owner of the contacts
+    :param session: Session: Database session
+    :return: The primary contact or None if it does not exist
+    """
+    return merge_contacts_by_user_id(primary_id, duplicate_ids, user.id, session)
+
+
+def merge_contacts_by_user_id(primary_id, duplicate_ids, user_id, session: Session):
+    primary = session.scalar(select(Contact).where(Contact.id == primary_id, Contact.user_id == user_id))
+    if primary is None:
+        return None
+
+    lock_change_feed(user_id, session)
+    duplicate_ids = set(duplicate_ids) - {primary_id}
+    deleted = {}
+    for chunk in _chunked(duplicate_ids):
+        rows = session.execute(
+            delete(Contact)
+            .where(Contact.user_id == user_id, Contact.id.in_(chunk))
+            .returning(Contact.id, *AUDITED_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )
+        deleted.update({row.id: row._asdict() for row in rows})
+    _record_tombstones(user_id, sorted(deleted), session)
+    for chunk in _chunked(sorted(deleted)):
+        copy_contact_tags(chunk, primary_id, user_id, session)
+        remove_contact_tags(chunk, session)
+    apply_stats_delta(user_id, _deleted_delta(row["birthday"] for row in deleted.values()), session)
+    forget_after_commit(session, user_id)
+    publish_contact_events(session, user_id, [contact_event("deleted", contact_id) for contact_id in sorted(deleted)])
+    for contact_id in sorted(deleted):
+        audit_contact_change(session, user_id, contact_id, "deleted", before=deleted[contact_id])
+    session.commit()
+
+    return primary
+
+
+def encode_sync_cursor(change_seq: int, issued_at: datetime) -> str:
+    return f"{change_seq}{SYNC_CURSOR_SEPARATOR}{int(issued_at.timestamp())}"
+
+
+def decode_sync_cursor(cursor: str):
+    """
+    The decode_sync_cursor function parses a cursor returned by get_contact_changes.
+
+    :param cursor: str: Cursor from the previous sync
+    :return: A tuple of the last seen change sequence and the time the sync chain started
+    :raises ValueError: If the cursor is malformed
+    """
+    change_seq, issued_at = cursor.split(SYNC_CURSOR_SEPARATOR)
+    try:
+        return int(change_seq), datetime.fromtimestamp(int(issued_at))
+    except (OSError, OverflowError) as error:
+        # A timestamp out of the range of the platform
+        raise ValueError("Invalid cursor") from error
+
+
+def get_contact_changes(user: User, since, limit: int, retention: timedelta, session: Session) -> dict:
+    """
+    The get_contact_changes function returns the contacts changed and deleted since a cursor.
+    Both streams are read through the (user_id, change_seq) indexes, so the cost depends on the number of changes
+    and not on the size of the address book. A cursor older than the tombstone retention window, or no cursor at all,
+    starts a full resync (reset=True) and the client has to drop its local copy.
+
+    :param user: User: Owner of the contacts
+    :param since: str: Cursor of the previous call or None
+    :param limit: int: Maximal number of changes in the page
+    :param retention: timedelta: How long tombstones are kept
+    :param session: Session: Database session
+    :return: A dict with cursor, reset, has_more, changed contacts and deleted contact ids
+    """
+    now = datetime.now()
+    since_seq, issued_at = decode_sync_cursor(since) if since else (0, now)
+    reset = since is None or now - issued_at > retention
+    if reset:
+        since_seq, issued_at = 0, now
+
+    contacts = session.scalars(
+        select(Contact)
+        .where(Contact.user_id == user.id, Contact.change_seq > since_seq)
+        .order_by(Contact.change_seq)
+        .limit(limit + 1)
+    ).all()
+    tombstones = [] if reset else session.execute(
+        select(ContactTombstone.contact_id, ContactTombstone.change_seq)
+        .where(ContactTombstone.user_id == user.id, ContactTombstone.change_seq > since_seq)
+        .order_by(ContactTombstone.change_seq)
+        .limit(limit + 1)
+    ).all()
+
+    changes = sorted([(contact.change_seq, contact, None) for contact in contacts]
+                     + [(row.change_seq, None, row.contact_id) for row in tombstones], key=lambda item: item[0])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    last_seq = changes[-1][0] if changes else since_seq
+
+    return {
+        # The start of the chain is kept while paging, a finished sync starts a new chain
+        "cursor": encode_sync_cursor(last_seq, issued_at if has_more else now),
+        "reset": reset,
+        "has_more": has_more,
+        "changed": [contact for _, contact, _ in changes if contact is not None],
+        "deleted": [contact_id for _, _, contact_id in changes if contact_id is not None],
+    }
+
+
+def compact_tombstones(retention: timedelta, session: Session, chunk_size: int = BATCH_CHUNK_SIZE) -> int:
+    """
+    The compact_tombstones function removes tombstones older than the retention window in chunks.
+    Clients with older cursors get a full resync from get_contact_changes instead.
+
+    :param retention: timedelta: How long tombstones are kept
+    :param session: Session: Database session
+    :param chunk_size: int: Tombstones deleted per transaction
+    :return: The number of removed tombstones
+    """
+    threshold = datetime.now() - retention
+    removed = 0
+    while True:
+        ids = session.scalars(
+            select(ContactTombstone.id).where(ContactTombstone.deleted_at < threshold).limit(chunk_size)
+        ).all()
+        if not ids:
+            break
+        session.execute(delete(ContactTombstone).where(ContactTombstone.id.in_(ids)))
+        session.commit()
+        removed += len(ids)
+
+    return removed
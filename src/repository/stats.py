@@ -0,0 +1,180 @@
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+
+from sqlalchemy import select, bindparam, func, extract, case, text, Connection
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from src.database.models import Contact, ContactStats, User, BIRTHDAY_MONTH_COLUMNS
+
+stats_table = ContactStats.__table__
+# contact_stats is maintained with INSERT ... ON CONFLICT, available on PostgreSQL and SQLite
+UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+RECONCILE_CHUNK_SIZE = 1000
+# Key of the PostgreSQL advisory lock held by the worker that runs the reconciliation
+RECONCILE_LOCK_KEY = 0x636F6E74
+
+STATS_BY_USER = select(ContactStats).where(ContactStats.user_id == bindparam("user_id")) \
+    .execution_options(populate_existing=True)
+RECENT_CONTACTS = (
+    select(Contact)
+    .where(Contact.user_id == bindparam("user_id"))
+    .order_by(Contact.created_at.desc(), Contact.id.desc())
+    .limit(bindparam("limit"))
+)
+
+
+def birthday_column(birthday) -> str:
+    return BIRTHDAY_MONTH_COLUMNS[birthday.month - 1]
+
+
+@lru_cache(maxsize=64)
+def _increment_statement(dialect: str, columns: tuple, touch_last_added: bool):
+    # One statement per set of changed columns, built once and reused with new values
+    values = {column: bindparam(f"v_{column}") for column in columns}
+    if touch_last_added:
+        values["last_added_at"] = func.now()
+    stmt = UPSERT_DIALECTS[dialect](stats_table).values(user_id=bindparam("b_user_id"), **values)
+    set_ = {column: stats_table.c[column] + stmt.excluded[column] for column in columns}
+    if touch_last_added:
+        set_["last_added_at"] = stmt.excluded.last_added_at
+    set_["updated_at"] = func.now()
+    return stmt.on_conflict_do_update(index_elements=[stats_table.c.user_id], set_=set_)
+
+
+def apply_stats_delta(user_id: int, delta: Counter, session: Session, added: bool = False) -> None:
+    """
+    The apply_stats_delta function adds a change of the contacts of a user to the user's contact_stats row in the
+    current transaction. The increment is done by the database (total = total + delta) in one upsert,
+    so concurrent writers do not lose updates.
+
+    :param user_id: int: Owner of the contacts
+    :param delta: Counter: Change of total and of the birthdays_MM columns
+    :param session: Session: Database session of the write
+    :param added: bool: A contact was created, last_added_at is moved to now
+    """
+    columns = tuple(sorted(column for column, value in delta.items() if value))
+    if not columns and not added:
+        return
+    stmt = _increment_statement(session.get_bind().dialect.name, columns, added)
+    session.execute(stmt, {"b_user_id": user_id, **{f"v_{column}": delta[column] for column in columns}})
+
+
+def contact_delta(sign: int, birthday) -> Counter:
+    delta = Counter(total=sign)
+    if birthday is not None:
+        delta[birthday_column(birthday)] += sign
+    return delta
+
+
+def birthday_moved(old_birthday, new_birthday) -> Counter:
+    delta = Counter()
+    if old_birthday is not None:
+        delta[birthday_column(old_birthday)] -= 1
+    if new_birthday is not None:
+        delta[birthday_column(new_birthday)] += 1
+    return delta
+
+
+def get_contact_stats(user: User, session: Session, recent: int = 5) -> dict:
+    """
+    The get_contact_stats function reads the aggregates of a user from the user's contact_stats row and the most
+    recently added contacts through the (user_id, created_at) index. The cost does not depend on the size
+    of the address book.
+
+    :param user: User: Owner of the contacts
+    :param session: Session: Database session
+    :param recent: int: Number of recently added contacts to return
+    :return: A dict with total, birthdays per month, last_added_at and the recent contacts
+    """
+    stats = session.scalars(STATS_BY_USER, {"user_id": user.id}).first()
+    contacts = session.scalars(RECENT_CONTACTS, {"user_id": user.id, "limit": recent}).all() if recent else []
+    return {
+        "total": max(stats.total, 0) if stats else 0,
+        "birthdays_by_month": {month: max(getattr(stats, column), 0) if stats else 0
+                               for month, column in enumerate(BIRTHDAY_MONTH_COLUMNS, start=1)},
+        "last_added_at": stats.last_added_at if stats else None,
+        "recent": contacts,
+    }
+
+
+def reconcile_contact_stats(session: Session, chunk_size: int = RECONCILE_CHUNK_SIZE) -> int:
+    """
+    The reconcile_contact_stats function recounts the aggregates of every user from the contacts table and
+    overwrites the contact_stats rows, which removes any drift of the incremental counters. Users are processed
+    in chunks, each chunk in its own transaction. Missing stats rows of the chunk are inserted and all of them
+    are locked before counting, so a concurrent write either is counted or applies its increment after
+    the rebuilt row, also for a user whose first stats row is written concurrently.
+
+    :param session: Session: Database session
+    :param chunk_size: int: Users recounted per transaction
+    :return: The number of processed users
+    """
+    month = extract("month", Contact.birthday)
+    aggregate = (
+        select(Contact.user_id, func.count(Contact.id).label("total"), func.max(Contact.created_at).label("last"),
+               *(func.sum(case((month == number, 1), else_=0)).label(column)
+                 for number, column in enumerate(BIRTHDAY_MONTH_COLUMNS, start=1)))
+        .where(Contact.user_id.in_(bindparam("user_ids", expanding=True)))
+        .group_by(Contact.user_id)
+    )
+    upsert = UPSERT_DIALECTS[session.get_bind().dialect.name](stats_table)
+    create_missing = upsert.on_conflict_do_nothing(index_elements=[stats_table.c.user_id])
+    overwrite = upsert.on_conflict_do_update(
+        index_elements=[stats_table.c.user_id],
+        set_={column: upsert.excluded[column] for column in ("total", "last_added_at", *BIRTHDAY_MONTH_COLUMNS)}
+        | {"updated_at": func.now()},
+    )
+
+    last_user_id = 0
+    processed = 0
+    while True:
+        user_ids = session.scalars(
+            select(User.id).where(User.id > last_user_id).order_by(User.id).limit(chunk_size)
+        ).all()
+        if not user_ids:
+            break
+        session.execute(create_missing, [{"user_id": user_id} for user_id in user_ids])
+        session.execute(select(stats_table.c.user_id).where(stats_table.c.user_id.in_(user_ids))
+                        .order_by(stats_table.c.user_id).with_for_update()).all()
+        counted = {row.user_id: row for row in session.execute(aggregate, {"user_ids": user_ids})}
+        rows = []
+        for user_id in user_ids:
+            row = counted.get(user_id)
+            rows.append({
+                "user_id": user_id,
+                "total": row.total if row else 0,
+                "last_added_at": row.last if row else None,
+                **{column: getattr(row, column) if row else 0 for column in BIRTHDAY_MONTH_COLUMNS},
+            })
+        session.execute(overwrite, rows)
+        session.commit()
+        processed += len(user_ids)
+        last_user_id = user_ids[-1]
+
+    return processed
+
+
+@contextmanager
+def reconcile_lock(connection: Connection):
+    """
+    The reconcile_lock function takes the advisory lock of the reconciliation without waiting for it,
+    so when every worker of every pod schedules the job only one of them runs it at a time.
+    The lock belongs to the database session, it is kept over the commits of the chunks.
+    Other databases have no advisory locks, the job always runs there.
+
+    :param connection: Connection: Connection the reconciliation runs on
+    :return: A context manager that yields True if the lock was taken
+    """
+    if connection.dialect.name != "postgresql":
+        yield True
+        return
+    locked = connection.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": RECONCILE_LOCK_KEY})
+    connection.commit()
+    try:
+        yield locked
+    finally:
+        if locked:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RECONCILE_LOCK_KEY})
+            connection.commit()
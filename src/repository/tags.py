@@ -0,0 +1,145 @@
+from collections import Counter
+
+from sqlalchemy import select, update, delete, bindparam, literal
+from sqlalchemy.orm import Session, attributes
+
+from src.database.models import Contact, ContactTag, Tag, User
+from src.repository.stats import UPSERT_DIALECTS
+
+tags_table = Tag.__table__
+links_table = ContactTag.__table__
+
+TAGS_BY_USER = select(Tag).where(Tag.user_id == bindparam("user_id")).order_by(Tag.name)
+TAG_BY_NAME = select(Tag).where(Tag.user_id == bindparam("user_id"), Tag.name == bindparam("name")).limit(1) \
+    .execution_options(populate_existing=True)
+ADJUST_COUNT = (
+    update(tags_table)
+    .where(tags_table.c.id == bindparam("b_id"))
+    .values(contact_count=tags_table.c.contact_count + bindparam("v_delta"))
+)
+
+
+def _adjust_counts(delta: Counter, session: Session) -> None:
+    # One executemany UPDATE; the database adds the delta, so concurrent writers do not lose counts
+    params = [{"b_id": tag_id, "v_delta": value} for tag_id, value in delta.items() if value]
+    if params:
+        session.execute(ADJUST_COUNT, params)
+
+
+def _refresh_count(tag: Tag, delta: int) -> None:
+    attributes.set_committed_value(tag, "contact_count", tag.contact_count + delta)
+
+
+def get_tags(user: User, session: Session):
+    return session.scalars(TAGS_BY_USER, {"user_id": user.id}).all()
+
+
+def get_tag(name: str, user: User, session: Session):
+    return session.scalars(TAG_BY_NAME, {"user_id": user.id, "name": name}).first()
+
+
+def tag_contacts(name: str, contact_ids, user: User, session: Session) -> Tag:
+    """
+    The tag_contacts function adds a tag to contacts of a user, the tag is created if it does not exist.
+    The links are inserted with one INSERT ... SELECT over the contacts of the user, so ids of other users
+    and contacts that already have the tag are skipped by the database.
+
+    :param name: str: Name of the tag
+    :param contact_ids: List[int]: Ids of the contacts
+    :param user: User: Owner of the contacts and of the tag
+    :param session: Session: Database session
+    :return: The tag with its updated contact_count
+    """
+    dialect = session.get_bind().dialect.name
+    session.execute(UPSERT_DIALECTS[dialect](tags_table).values(user_id=user.id, name=name, contact_count=0)
+                    .on_conflict_do_nothing(index_elements=[tags_table.c.user_id, tags_table.c.name]))
+    tag = session.scalars(TAG_BY_NAME, {"user_id": user.id, "name": name}).first()
+
+    owned = select(Contact.id, literal(tag.id), literal(user.id)) \
+        .where(Contact.user_id == user.id, Contact.id.in_(set(contact_ids)))
+    stmt = (
+        UPSERT_DIALECTS[dialect](links_table)
+        .from_select(["contact_id", "tag_id", "user_id"], owned)
+        .on_conflict_do_nothing(index_elements=[links_table.c.tag_id, links_table.c.contact_id])
+        .returning(links_table.c.contact_id)
+    )
+    added = len(session.execute(stmt).all())
+    _adjust_counts(Counter({tag.id: added}), session)
+    session.commit()
+    _refresh_count(tag, added)
+    return tag
+
+
+def untag_contacts(name: str, contact_ids, user: User, session: Session):
+    """
+    The untag_contacts function removes a tag from contacts of a user.
+
+    :param name: str: Name of the tag
+    :param contact_ids: List[int]: Ids of the contacts
+    :param user: User: Owner of the tag
+    :param session: Session: Database session
+    :return: The tag with its updated contact_count or None if the user has no such tag
+    """
+    tag = get_tag(name, user, session)
+    if tag is None:
+        return None
+    removed = len(session.execute(
+        delete(links_table)
+        .where(links_table.c.tag_id == tag.id, links_table.c.contact_id.in_(set(contact_ids)))
+        .returning(links_table.c.contact_id)
+    ).all())
+    _adjust_counts(Counter({tag.id: -removed}), session)
+    session.commit()
+    _refresh_count(tag, -removed)
+    return tag
+
+
+def delete_tag(name: str, user: User, session: Session):
+    tag = get_tag(name, user, session)
+    if tag is None:
+        return None
+    session.execute(delete(links_table).where(links_table.c.tag_id == tag.id))
+    session.delete(tag)
+    session.commit()
+    return tag
+
+
+def remove_contact_tags(contact_ids, session: Session) -> None:
+    """
+    The remove_contact_tags function deletes the links of deleted contacts and decrements the counts of their tags
+    in the current transaction.
+
+    :param contact_ids: List[int]: Ids of the deleted contacts
+    :param session: Session: Database session of the delete
+    """
+    if not contact_ids:
+        return
+    rows = session.execute(
+        delete(links_table).where(links_table.c.contact_id.in_(contact_ids)).returning(links_table.c.tag_id)
+    )
+    delta = Counter()
+    for row in rows:
+        delta[row.tag_id] -= 1
+    _adjust_counts(delta, session)
+
+
+def copy_contact_tags(contact_ids, target_id: int, user_id: int, session: Session) -> None:
+    """
+    The copy_contact_tags function gives a contact the tags of other contacts, e.g. of the duplicates merged into it.
+
+    :param contact_ids: List[int]: Ids of the contacts whose tags are copied
+    :param target_id: int: Id of the contact that gets the tags
+    :param user_id: int: Owner of the contacts
+    :param session: Session: Database session of the write
+    """
+    if not contact_ids:
+        return
+    tag_ids = select(links_table.c.tag_id, literal(target_id), literal(user_id)).distinct() \
+        .where(links_table.c.contact_id.in_(contact_ids), links_table.c.user_id == user_id)
+    stmt = (
+        UPSERT_DIALECTS[session.get_bind().dialect.name](links_table)
+        .from_select(["tag_id", "contact_id", "user_id"], tag_ids)
+        .on_conflict_do_nothing(index_elements=[links_table.c.tag_id, links_table.c.contact_id])
+        .returning(links_table.c.tag_id)
+    )
+    _adjust_counts(Counter(row.tag_id for row in session.execute(stmt)), session)
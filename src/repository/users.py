@@ -1,20 +1,51 @@
 import logging
+from collections import namedtuple
+from datetime import datetime
 
 from libgravatar import Gravatar
-from sqlalchemy import select
+from sqlalchemy import select, update, bindparam
 
 from src.database.models import User
 from src.schemas import UserSchema
+from src.services.group_commit import commit
+from src.services.singleflight import coalesce, forget_after_commit
 
 
+USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
+USER_ROW_FIELDS = ("id", "username", "email", "avatar", "confirmed", "tokens_valid_after")
+USER_ROW_BY_EMAIL = select(*(User.__table__.c[name] for name in USER_ROW_FIELDS)) \
+    .where(User.email == bindparam("email"))
+UserRecord = namedtuple("UserRecord", USER_ROW_FIELDS)
+CONFIRM_EMAIL = update(User).where(User.email == bindparam("b_email")).values(confirmed=True)
+UPDATE_AVATAR = update(User).where(User.email == bindparam("b_email")).values(avatar=bindparam("b_avatar")) \
+    .returning(User)
+REVOKE_TOKENS = update(User).where(User.id == bindparam("b_id")) \
+    .values(refresh_token=None, tokens_valid_after=bindparam("b_valid_after"))
+
+
+# Not coalesced: the user is an ORM object that login, refresh and logout go on to change
 def get_user_by_email(email: str, session) -> User:
-    sq = select(User).filter_by(email=email)
-    result = session.execute(sq)
+    result = session.execute(USER_BY_EMAIL, {"email": email})
     user = result.scalar_one_or_none()
     # logging.error(f"!!!!!!!!!!!!!!USER!!!!!!!!!!!!!!!!   {user}")
     return user
 
 
+@coalesce(lambda email, **_: (email,))
+def get_user_row(email: str, session) -> UserRecord | None:
+    """
+    The get_user_row function is the read-only variant of get_user_by_email for authenticated requests,
+    an immutable UserRecord that concurrent requests of the same user can share. Writes of the user
+    load the User with get_user_by_email.
+
+    :param email: str: Email of the user
+    :param session: Database session
+    :return: A UserRecord or None
+    """
+    row = session.connection().execute(USER_ROW_BY_EMAIL, {"email": email}).first()
+    return None if row is None else UserRecord._make(row)
+
+
 def create_user(body: UserSchema, session) -> User:
     avatar = None
     try:
@@ -25,24 +56,37 @@ def create_user(body: UserSchema, session) -> User:
 
     new_user = User(**body.model_dump(), avatar=avatar)  # User(username=username, email=email, password=password)
     session.add(new_user)
+    forget_after_commit(session, new_user.email)
     session.commit()
-    session.refresh(new_user)
     return new_user
 
 
 def update_token(user: User, token: str | None, session) -> None:
     user.refresh_token = token
-    session.commit()
+    forget_after_commit(session, user.email)
+    commit(session)
 
 
 def confirmed_email(email: str, session) -> None:
-    user = get_user_by_email(email, session)
-    user.confirmed = True
+    session.execute(CONFIRM_EMAIL, {"b_email": email})
+    forget_after_commit(session, email)
     session.commit()
 
 
 def update_avatar(email, url: str, session) -> User:
-    user = get_user_by_email(email, session)
-    user.avatar = url
+    user = session.scalar(UPDATE_AVATAR, {"b_email": email, "b_avatar": url})
+    forget_after_commit(session, email)
     session.commit()
     return user
+
+
+def revoke_tokens(user: User, session) -> None:
+    """
+    The revoke_tokens function invalidates every token of the user issued until now and drops the refresh token.
+
+    :param user: User: Owner of the tokens
+    :param session: Database session
+    """
+    session.execute(REVOKE_TOKENS, {"b_id": user.id, "b_valid_after": datetime.utcnow()})
+    forget_after_commit(session, user.email)
+    session.commit()
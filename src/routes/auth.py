@@ -1,12 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Security, Request, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.ext.asyncio import AsyncSession
+import redis
 from sqlalchemy.orm import Session
 
 from src.database.db import get_db
 from src.repository import users as repository_users
 from src.schemas import UserSchema, UserResponseSchema, TokenModel, MailSchema
+from src.database.models import User
 from src.services.auth import auth_service
+from src.services.group_commit import write
+from src.services.revocation import revoked_tokens
 from src.services.email import send_email, simple_send_mail
 
 router = APIRouter(prefix='/auth', tags=["auth"])
@@ -43,7 +47,7 @@ def login(body: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = D
     access_token = auth_service.create_access_token(data={"sub": user.email})
     refresh_token = auth_service.create_refresh_token(data={"sub": user.email})
 
-    repository_users.update_token(user, refresh_token, session)
+    write(repository_users.update_token, user, refresh_token, session=session)
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
@@ -55,15 +59,49 @@ def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security)
     user = repository_users.get_user_by_email(email, session)
 
     if user.refresh_token != token:
-        repository_users.update_token(user, None, session)
+        write(repository_users.update_token, user, None, session=session)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
     access_token = auth_service.create_access_token(data={"sub": email})
     refresh_token = auth_service.create_refresh_token(data={"sub": email})
-    repository_users.update_token(user, refresh_token, session)
+    write(repository_users.update_token, user, refresh_token, session=session)
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
+@router.post('/logout', status_code=status.HTTP_204_NO_CONTENT)
+def logout(token: str = Depends(auth_service.oauth2_scheme), user: User = Depends(auth_service.get_current_user),
+           session: Session = Depends(get_db)):
+    """
+    The logout function revokes the access token of the request and drops the refresh token of the user.
+    The token id is kept in Redis until the token expires and reaches the other workers over pub/sub.
+
+    :param token: str: The access token of the request
+    :param user: User: The current user
+    :param session: Session: The database session
+    """
+    payload = auth_service.decode_access_token(token)
+    if "jti" in payload:
+        try:
+            revoked_tokens.revoke(payload["jti"], payload["exp"])
+        except redis.RedisError:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Token was not revoked")
+    # The current user is a shared snapshot, the row that is changed is loaded on its own
+    user = repository_users.get_user_by_email(user.email, session)
+    write(repository_users.update_token, user, None, session=session)
+
+
+@router.post('/revoke_all', status_code=status.HTTP_204_NO_CONTENT)
+def revoke_all(user: User = Depends(auth_service.get_current_user), session: Session = Depends(get_db)):
+    """
+    The revoke_all function invalidates every access and refresh token of the current user issued until now.
+    The cut-off is stored on the user row, which every authenticated request loads anyway.
+
+    :param user: User: The current user
+    :param session: Session: The database session
+    """
+    repository_users.revoke_tokens(user, session)
+
+
 @router.get('/confirmed_email/{token}')
 def confirmed_email(token: str, session: Session = Depends(get_db)):
     email = auth_service.get_email_from_token(token)
@@ -1,38 +1,214 @@
-from typing import List
+from datetime import date, datetime, timedelta
+from typing import List, Optional
 
-from fastapi import Depends, HTTPException, status, Path, APIRouter
+from fastapi import Depends, HTTPException, status, Path, APIRouter, Query
+from fastapi.responses import StreamingResponse, Response
 from fastapi_limiter.depends import RateLimiter
 from pydantic import EmailStr
 from sqlalchemy.orm import Session
 
 import src.repository.contacts as res_contacts
+import src.repository.stats as res_stats
+from src.conf.config import config
 from src.database.db import get_db
 from src.database.models import User
-from src.schemas import ContactSchema, ContactSchemaResponse
+from src.schemas import ContactSchema, ContactSchemaResponse, ContactBatchUpdateSchema, ContactBatchDeleteSchema, \
+    ContactBatchResultSchema, DuplicateCandidateSchema, ContactMergeSchema, ContactChangesResponseSchema, \
+    ContactStatsResponseSchema, CONTACT_FIELDS, contact_fields_adapter
+from src.middleware.compression import no_compression
+from src.services import dedupe, events
 from src.services.auth import auth_service
+from src.services.group_commit import write
 
 router = APIRouter(prefix='/api/contacts', tags=["contacts"])
 birthday_router = APIRouter(prefix='/api/week_birthday', tags=["birthday"])
 
 
+def contact_fields(fields: Optional[str] = Query(None, description="Comma separated fields, e.g. id,name,phone")):
+    """
+    The contact_fields function parses the fields query parameter of the sparse fieldset routes.
+
+    :param fields: str: Comma separated names of the fields of ContactSchemaResponse
+    :return: A tuple of the field names in schema order or None when all fields are requested
+    """
+    if fields is None:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(CONTACT_FIELDS)
+    if unknown or not requested:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unknown fields: {', '.join(sorted(unknown))}. Allowed: {', '.join(CONTACT_FIELDS)}")
+    return tuple(name for name in CONTACT_FIELDS if name in requested)
+
+
+def sparse_response(data, fields, many: bool = False) -> Response:
+    adapter = contact_fields_adapter(fields, many)
+    return Response(content=adapter.dump_json(adapter.validate_python(data, from_attributes=True)),
+                    media_type="application/json")
+
+
+def contact_query(name_prefix: Optional[str] = Query(None, min_length=1, max_length=100),
+                  sur_name_prefix: Optional[str] = Query(None, min_length=1, max_length=100),
+                  email_domain: Optional[str] = Query(None, min_length=1, max_length=120),
+                  birthday_from: Optional[date] = None, birthday_to: Optional[date] = None,
+                  created_from: Optional[datetime] = None, created_to: Optional[datetime] = None,
+                  updated_from: Optional[datetime] = None, updated_to: Optional[datetime] = None):
+    """
+    The contact_query function collects the filters of the contact list query API.
+
+    :return: A dict of the given filters, empty when the list is not filtered
+    """
+    filters = {"name_prefix": name_prefix, "sur_name_prefix": sur_name_prefix, "email_domain": email_domain,
+               "birthday_from": birthday_from, "birthday_to": birthday_to, "created_from": created_from,
+               "created_to": created_to, "updated_from": updated_from, "updated_to": updated_to}
+    return {name: value for name, value in filters.items() if value is not None}
+
+
 # @router.get("/", response_model=List[ContactSchemaResponse], dependencies=[Depends(RateLimiter(times=2, seconds=5))])
 @router.get("/", response_model=List[ContactSchemaResponse])
-def get_contacts(user: User = Depends(auth_service.get_current_user), session: Session = Depends(get_db)):
+def get_contacts(filters: dict = Depends(contact_query),
+                 sort: Optional[str] = Query(None, pattern="^-?[a-z_]+$", description="e.g. name or -created_at"),
+                 limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = Query(None, max_length=512),
+                 fields: Optional[tuple] = Depends(contact_fields), user: User = Depends(auth_service.get_current_user),
+                 session: Session = Depends(get_db)):
     """
     The get_contacts function returns a list of contacts for the current user.
         The function takes in two parameters:
             - user: A User object that represents the currently logged-in user. This is passed in by default from auth_service.get_current_user().
             - session: A Session object that represents an active database connection to be used for querying data from the database.
-
+        With ?fields=id,name,phone only the requested columns are loaded and returned.
+        Contacts are read as plain rows and serialized straight to JSON, no ORM objects are built.
+        With any of the filters, sort, limit or cursor the list is paged: e.g. ?name_prefix=Al&sort=-name&limit=50.
+        Only a filter and a sort of the same field are accepted, so every page is read from an index,
+        other combinations are rejected with 400. The cursor of the next page is in the X-Next-Cursor header.
+
+    :param filters: dict: Filters of the query API
+    :param sort: str: Sort key with an optional - for the descending order
+    :param limit: int: Size of the page, 100 by default
+    :param cursor: str: X-Next-Cursor of the previous page
+    :param fields: tuple: Requested fields or None for all of them
     :param user: User: Get the user from the auth_service
     :param session: Session: Pass the database session to the function
     :return: A list of contacts
     """
-    return res_contacts.get_contacts(user=user, session=session)
+    if not filters and sort is None and limit is None and cursor is None:
+        contacts = res_contacts.get_contact_rows(user=user, session=session, fields=fields)
+        return sparse_response(contacts, fields or CONTACT_FIELDS, many=True)
+    try:
+        contacts, next_cursor = res_contacts.query_contacts(filters, sort, limit or 100, cursor, user=user,
+                                                            session=session, fields=fields)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    response = sparse_response(contacts, fields or CONTACT_FIELDS, many=True)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+@router.patch("/batch", response_model=List[ContactBatchResultSchema])
+def update_contacts_batch(body: ContactBatchUpdateSchema, user: User = Depends(auth_service.get_current_user),
+                          session: Session = Depends(get_db)):
+    """
+    The update_contacts_batch function updates many contacts of the current user in one transaction.
+    Every patch carries the id of the contact and only the fields that have to be changed.
+
+    :param body: ContactBatchUpdateSchema: List of patches
+    :param user: User: Get the current user
+    :param session: Session: Get the database session
+    :return: The outcome of every patch, in request order
+    """
+    return res_contacts.update_contacts_batch(patches=body.contacts, user=user, session=session)
+
+
+@router.delete("/batch", response_model=List[ContactBatchResultSchema])
+def delete_contacts_batch(body: ContactBatchDeleteSchema, user: User = Depends(auth_service.get_current_user),
+                          session: Session = Depends(get_db)):
+    """
+    The delete_contacts_batch function deletes many contacts of the current user in one transaction.
+
+    :param body: ContactBatchDeleteSchema: Ids of the contacts to delete
+    :param user: User: Get the current user
+    :param session: Session: Get the database session
+    :return: The outcome of every id, in request order
+    """
+    return res_contacts.delete_contacts_batch(contact_ids=body.ids, user=user, session=session)
+
+
+@router.get("/events", response_class=StreamingResponse, dependencies=[Depends(no_compression)])
+async def stream_contact_events(user: User = Depends(auth_service.get_current_user),
+                                session: Session = Depends(get_db)):
+    """
+    The stream_contact_events function streams created, updated and deleted events of the current user's contacts
+    as server-sent events. Events come from Redis pub/sub, so writes made on any worker reach every connection.
+    A reset event means that the client was too slow and has to resync with /api/contacts/changes.
+
+    :param user: User: Get the current user
+    :param session: Session: The database session, released before streaming starts
+    :return: A text/event-stream response
+    """
+    session.close()
+    subscription = events.hub.subscribe(user.id)
+    return StreamingResponse(events.hub.stream(subscription), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/changes", response_model=ContactChangesResponseSchema)
+def get_contact_changes(since: Optional[str] = Query(None, max_length=64), limit: int = Query(500, ge=1, le=5000),
+                        user: User = Depends(auth_service.get_current_user), session: Session = Depends(get_db)):
+    """
+    The get_contact_changes function returns the contacts created or updated and the ids of the contacts deleted
+    since the cursor of the previous sync. Without a cursor, or with a cursor older than the tombstone retention,
+    the whole address book is returned with reset=true. The client repeats the call with the returned cursor
+    while has_more is true.
+
+    :param since: str: Cursor of the previous sync
+    :param limit: int: Maximal number of changes per page
+    :param user: User: Get the current user
+    :param session: Session: Get the database session
+    :return: The changes and the cursor for the next sync
+    """
+    try:
+        return res_contacts.get_contact_changes(
+            user=user, since=since, limit=limit,
+            retention=timedelta(days=config.sync_tombstone_retention_days), session=session,
+        )
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+@router.get("/duplicates", response_model=List[DuplicateCandidateSchema])
+def get_duplicate_contacts(min_score: float = Query(0.5, ge=0, le=1),
+                           user: User = Depends(auth_service.get_current_user), session: Session = Depends(get_db)):
+    """
+    The get_duplicate_contacts function returns pairs of contacts of the current user that look like duplicates.
+    Only contacts sharing a phone, an email or a phonetic name key are compared.
+
+    :param min_score: float: Minimal similarity score of a returned pair
+    :param user: User: Get the current user
+    :param session: Session: Get the database session
+    :return: A list of scored candidate pairs
+    """
+    return dedupe.find_user_duplicates(user=user, session=session, min_score=min_score)
+
+
+@router.get("/stats", response_model=ContactStatsResponseSchema)
+def get_contact_stats(recent: int = Query(5, ge=0, le=50), user: User = Depends(auth_service.get_current_user),
+                      session: Session = Depends(get_db)):
+    """
+    The get_contact_stats function returns the number of contacts of the current user, their birthdays per month
+    and the most recently added contacts. The counters are read from one precomputed row.
+
+    :param recent: int: Number of recently added contacts to return
+    :param user: User: Get the current user
+    :param session: Session: Get the database session
+    :return: The contact statistics
+    """
+    return res_stats.get_contact_stats(user=user, session=session, recent=recent)
 
 
 @router.get("/{contact_id}", response_model=ContactSchemaResponse)
-def get_contact_by_id(contact_id: int = Path(ge=1), user: User = Depends(auth_service.get_current_user),
+def get_contact_by_id(contact_id: int = Path(ge=1), fields: Optional[tuple] = Depends(contact_fields),
+                      user: User = Depends(auth_service.get_current_user),
                       session: Session = Depends(get_db)):
     """
     The get_contact_by_id function returns a contact by its id.
@@ -41,22 +217,24 @@ def get_contact_by_id(contact_id: int = Path(ge=1), user: User = Depends(auth_se
                 This is the id of the contact to be returned. It must be greater than or equal to 0.
 
     :param contact_id: int: Get the contact_id from the url
+    :param fields: tuple: Requested fields or None for all of them
     :param user: User: Get the current user, and the session: session parameter is used to get a database
     :param session: Session: Get the database session
     :return: A single contact object
     """
-    contact = res_contacts.get_contact_by_id(contact_id=contact_id, user=user, session=session)
+    contact = res_contacts.get_contact_row(contact_id=contact_id, user=user, session=session, fields=fields)
 
     if contact is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="NOT FOUND",
         )
-    return contact
+    return sparse_response(contact, fields or CONTACT_FIELDS)
 
 
 @router.get("/name/{name}", response_model=ContactSchemaResponse)
 def get_contact_by_name(name: str = Path(min_length=3, max_length=100),
+                        fields: Optional[tuple] = Depends(contact_fields),
                         user: User = Depends(auth_service.get_current_user), session: Session = Depends(get_db)):
     """
     The get_contact_by_name function is used to retrieve a contact by name.
@@ -66,43 +244,51 @@ def get_contact_by_name(name: str = Path(min_length=3, max_length=100),
 
     :param name: str: Get the contact name from the request body
     :param max_length: Limit the length of the name parameter
+    :param fields: tuple: Requested fields or None for all of them
     :param user: User: Get the current user from the auth_service
     :param session: Session: Access the database
     :return: A contact object, which is a pydantic model
     """
-    contact = res_contacts.get_contact_by_name(name=name, user=user, session=session)
+    contact = res_contacts.get_contact_by_name(name=name, user=user, session=session, fields=fields)
 
     if contact is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="NOT FOUND",
         )
+    if fields:
+        return sparse_response(contact, fields)
     return contact
 
 
 @router.get("/email/{email}", response_model=ContactSchemaResponse)
-def get_contact_by_email(email: EmailStr, user: User = Depends(auth_service.get_current_user),
+def get_contact_by_email(email: EmailStr, fields: Optional[tuple] = Depends(contact_fields),
+                         user: User = Depends(auth_service.get_current_user),
                          session: Session = Depends(get_db)):
     """
     The get_contact_by_email function is a GET request that returns the contact with the given email.
     If no such contact exists, it will return a 404 NOT FOUND error.
 
     :param email: EmailStr: Validate the email address
+    :param fields: tuple: Requested fields or None for all of them
     :param user: User: Get the current user
     :param session: Session: Pass the database session to the function
     :return: A contact object, which is a dictionary
     """
-    contact = res_contacts.get_contact_by_email(email=email, user=user, session=session)
+    contact = res_contacts.get_contact_by_email(email=email, user=user, session=session, fields=fields)
     if contact is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="NOT FOUND",
         )
+    if fields:
+        return sparse_response(contact, fields)
     return contact
 
 
 @router.get("/sur_name/{sur_name}", response_model=ContactSchemaResponse)
 def get_contact_by_sur_name(sur_name: str = Path(min_length=3, max_length=100),
+                            fields: Optional[tuple] = Depends(contact_fields),
                             user: User = Depends(auth_service.get_current_user), session: Session = Depends(get_db)):
     """
     The get_contact_by_sur_name function is used to retrieve a contact by their sur_name.
@@ -111,16 +297,19 @@ def get_contact_by_sur_name(sur_name: str = Path(min_length=3, max_length=100),
 
     :param sur_name: str: Get the contact by sur_name
     :param max_length: Limit the length of a string
+    :param fields: tuple: Requested fields or None for all of them
     :param user: User: Get the current user
     :param session: Session: Get the database session
     :return: A contact object, which is a pydantic model
     """
-    contact = res_contacts.get_contact_by_sur_name(sur_name=sur_name, user=user, session=session)
+    contact = res_contacts.get_contact_by_sur_name(sur_name=sur_name, user=user, session=session, fields=fields)
     if contact is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="NOT FOUND",
         )
+    if fields:
+        return sparse_response(contact, fields)
     return contact
 
 
@@ -143,7 +332,7 @@ def create_contact(body: ContactSchema, user: User = Depends(auth_service.get_cu
             detail=f"Phone {body.phone} already exist!"
         )
 
-    return res_contacts.create_contact(body=body, user=user, session=session)
+    return write(res_contacts.create_contact, body, user, session=session, lock_key=user.id)
 
 
 @router.delete("/{contact_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -165,7 +354,7 @@ def delete_contact(contact_id: int = Path(ge=1), user: User = Depends(auth_servi
             detail="NOT FOUND",
         )
 
-    return res_contacts.delete_contact(contact=contact, session=session)
+    return write(res_contacts.delete_contact, contact, session=session, lock_key=user.id)
 
 
 @router.patch("/{contact_id}", response_model=ContactSchemaResponse)
@@ -188,7 +377,7 @@ def update_contact(body: ContactSchema, contact_id: int = Path(ge=1),
             detail="NOT FOUND",
         )
 
-    contact_phone = res_contacts.get_contact_by_phone(phone=body.phone, session=session)
+    contact_phone = res_contacts.get_contact_by_phone(phone=body.phone, user=user, session=session)
 
     if contact_phone and contact.id != contact_phone.id:
         raise HTTPException(
@@ -196,7 +385,30 @@ def update_contact(body: ContactSchema, contact_id: int = Path(ge=1),
             detail=f"Another contact id={contact_phone.id} already had phone {body.phone}!"
         )
 
-    return res_contacts.update_contact(body=body, contact=contact, session=session)
+    return write(res_contacts.update_contact, body, contact, session=session, lock_key=user.id)
+
+
+@router.post("/{contact_id}/merge", response_model=ContactSchemaResponse)
+def merge_contacts(body: ContactMergeSchema, contact_id: int = Path(ge=1),
+                   user: User = Depends(auth_service.get_current_user), session: Session = Depends(get_db)):
+    """
+    The merge_contacts function merges duplicates into the contact with contact_id in one transaction.
+    The contact keeps its own data and the duplicates are deleted.
+
+    :param body: ContactMergeSchema: Ids of the duplicates
+    :param contact_id: int: Id of the contact that survives the merge
+    :param user: User: Get the current user
+    :param session: Session: Get the database session
+    :return: The merged contact
+    """
+    contact = res_contacts.merge_contacts(primary_id=contact_id, duplicate_ids=body.duplicate_ids, user=user,
+                                          session=session)
+    if contact is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="NOT FOUND",
+        )
+    return contact
 
 
 @birthday_router.get("/", response_model=List[ContactSchemaResponse])
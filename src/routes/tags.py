@@ -0,0 +1,100 @@
+from typing import List, Optional
+
+from fastapi import Depends, HTTPException, status, Path, APIRouter, Query
+from sqlalchemy.orm import Session
+
+import src.repository.contacts as res_contacts
+import src.repository.tags as res_tags
+from src.database.db import get_db
+from src.database.models import User
+from src.routes.contacts import contact_fields, sparse_response
+from src.schemas import ContactSchemaResponse, TagResponseSchema, TagContactsSchema, CONTACT_FIELDS
+from src.services.auth import auth_service
+
+router = APIRouter(prefix='/api/tags', tags=["tags"])
+
+TAG_NAME = Path(min_length=1, max_length=50)
+
+
+@router.get("/", response_model=List[TagResponseSchema])
+def get_tags(user: User = Depends(auth_service.get_current_user), session: Session = Depends(get_db)):
+    """
+    The get_tags function returns the tags of the current user with the number of tagged contacts.
+
+    :param user: User: Get the current user
+    :param session: Session: Get the database session
+    :return: A list of tags ordered by name
+    """
+    return res_tags.get_tags(user=user, session=session)
+
+
+@router.get("/contacts", response_model=List[ContactSchemaResponse])
+def get_tagged_contacts(tag: List[str] = Query(..., min_length=1, max_length=20),
+                        match: str = Query("any", pattern="^(any|all)$"),
+                        limit: int = Query(100, ge=1, le=1000), after: int = Query(0, ge=0),
+                        fields: Optional[tuple] = Depends(contact_fields),
+                        user: User = Depends(auth_service.get_current_user), session: Session = Depends(get_db)):
+    """
+    The get_tagged_contacts function lists the contacts of the current user with the given tags,
+    e.g. ?tag=work&tag=family&match=all. Pages are ordered by id, the next page starts after the last id.
+
+    :param tag: List[str]: Names of the tags
+    :param match: str: any or all of the tags
+    :param limit: int: Size of the page
+    :param after: int: Last id of the previous page
+    :param fields: tuple: Requested fields or None for all of them
+    :param user: User: Get the current user
+    :param session: Session: Get the database session
+    :return: A list of contacts
+    """
+    contacts = res_contacts.get_contacts_by_tags(tag, match == "all", user=user, session=session, limit=limit,
+                                                 after=after, fields=fields)
+    return sparse_response(contacts, fields or CONTACT_FIELDS, many=True)
+
+
+@router.post("/{name}/contacts", response_model=TagResponseSchema)
+def tag_contacts(body: TagContactsSchema, name: str = TAG_NAME,
+                 user: User = Depends(auth_service.get_current_user), session: Session = Depends(get_db)):
+    """
+    The tag_contacts function adds a tag to contacts of the current user, the tag is created on first use.
+    Ids of unknown contacts and contacts that already have the tag are ignored.
+
+    :param body: TagContactsSchema: Ids of the contacts
+    :param name: str: Name of the tag
+    :param user: User: Get the current user
+    :param session: Session: Get the database session
+    :return: The tag
+    """
+    return res_tags.tag_contacts(name, body.ids, user=user, session=session)
+
+
+@router.delete("/{name}/contacts", response_model=TagResponseSchema)
+def untag_contacts(body: TagContactsSchema, name: str = TAG_NAME,
+                   user: User = Depends(auth_service.get_current_user), session: Session = Depends(get_db)):
+    """
+    The untag_contacts function removes a tag from contacts of the current user.
+
+    :param body: TagContactsSchema: Ids of the contacts
+    :param name: str: Name of the tag
+    :param user: User: Get the current user
+    :param session: Session: Get the database session
+    :return: The tag
+    """
+    tag = res_tags.untag_contacts(name, body.ids, user=user, session=session)
+    if tag is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
+    return tag
+
+
+@router.delete("/{name}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_tag(name: str = TAG_NAME, user: User = Depends(auth_service.get_current_user),
+               session: Session = Depends(get_db)):
+    """
+    The delete_tag function deletes a tag of the current user, the contacts are kept.
+
+    :param name: str: Name of the tag
+    :param user: User: Get the current user
+    :param session: Session: Get the database session
+    """
+    if res_tags.delete_tag(name, user=user, session=session) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
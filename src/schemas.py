@@ -1,6 +1,8 @@
 from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, ConfigDict, TypeAdapter, create_model, field_validator
 
 
 class UserSchema(BaseModel):
@@ -45,3 +47,107 @@ class ContactSchemaResponse(ContactSchema):
     id: int
     created_at: datetime
     updated_at: datetime
+
+
+CONTACT_FIELDS = tuple(ContactSchemaResponse.model_fields)
+RESPONSE_ANNOTATIONS = {EmailStr: str}
+
+
+@lru_cache(maxsize=256)
+def contact_fields_adapter(fields: Tuple[str, ...], many: bool = False) -> TypeAdapter:
+    """
+    The contact_fields_adapter function builds (once per set of fields) a response model with only the requested
+    fields of ContactSchemaResponse and returns a TypeAdapter that validates ORM objects and dumps them to JSON.
+
+    :param fields: Tuple[str, ...]: Field names in the order of CONTACT_FIELDS
+    :param many: bool: Adapter for a list of contacts
+    :return: A TypeAdapter for the model or for a list of the models
+    """
+    # Stored emails were validated when they were written, checking them again costs more than the whole row
+    definitions = {name: (RESPONSE_ANNOTATIONS.get(annotation, annotation), ...)
+                   for name in fields for annotation in (ContactSchemaResponse.model_fields[name].annotation,)}
+    model = create_model(f"ContactFields_{'_'.join(fields)}", __config__=ConfigDict(from_attributes=True),
+                         **definitions)
+    return TypeAdapter(List[model] if many else model)
+
+
+class ContactPatchSchema(BaseModel):
+    id: int = Field(ge=1)
+    name: Optional[str] = Field(None, min_length=3, max_length=100)
+    sur_name: Optional[str] = Field(None, min_length=3, max_length=100)
+    email: Optional[EmailStr] = None
+    phone: Optional[str] = Field(None, length=13)
+    birthday: Optional[date] = None
+
+    @field_validator("name", "sur_name", "email", "phone", "birthday")
+    @classmethod
+    def not_null(cls, value):
+        # Fields are optional to leave them unchanged, the columns themselves are NOT NULL
+        if value is None:
+            raise ValueError("must not be null, leave the field out to keep it")
+        return value
+
+
+class ContactBatchUpdateSchema(BaseModel):
+    contacts: List[ContactPatchSchema] = Field(min_length=1, max_length=5000)
+
+    @field_validator("contacts")
+    @classmethod
+    def unique_ids(cls, contacts):
+        # Patches are grouped by their set of fields, so two patches of one contact would not apply in request order
+        ids = [patch.id for patch in contacts]
+        if len(ids) != len(set(ids)):
+            raise ValueError("every contact id may appear only once")
+        return contacts
+
+
+class ContactBatchDeleteSchema(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=5000)
+
+
+class ContactBatchResultSchema(BaseModel):
+    id: int
+    status: str
+    detail: Optional[str] = None
+
+
+class DuplicateCandidateSchema(BaseModel):
+    contact_id: int
+    duplicate_id: int
+    score: float
+    reasons: List[str]
+
+    class Config:
+        from_attributes = True
+
+
+class ContactMergeSchema(BaseModel):
+    duplicate_ids: List[int] = Field(min_length=1, max_length=1000)
+
+
+class ContactStatsResponseSchema(BaseModel):
+    total: int
+    birthdays_by_month: Dict[int, int]
+    last_added_at: Optional[datetime]
+    recent: List[ContactSchemaResponse]
+
+
+class ContactChangesResponseSchema(BaseModel):
+    cursor: str
+    reset: bool
+    has_more: bool
+    changed: List[ContactSchemaResponse]
+    deleted: List[int]
+
+
+class TagResponseSchema(BaseModel):
+    id: int
+    name: str
+    contact_count: int
+
+    class Config:
+        from_attributes = True
+
+
+class TagContactsSchema(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=5000)
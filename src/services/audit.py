@@ -0,0 +1,268 @@
+import json
+import logging
+import os
+import pathlib
+import queue
+import threading
+import time
+import uuid
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from src.conf.config import config
+from src.database.db import DBSession, after_commit
+from src.database.models import ContactAudit
+from src.services.metrics import metrics
+
+AUDIT_FIELDS = ("name", "sur_name", "email", "phone", "birthday")
+SPILL_FILE = "spill.jsonl"
+REPLAY_SUFFIX = ".replay"
+# Entries carry a unique event_id, a batch that is written again after a crash or a replay is skipped
+INSERT_IGNORING_DUPLICATES = {
+    "postgresql": lambda table: postgresql.insert(table).on_conflict_do_nothing(index_elements=["event_id"]),
+    "sqlite": lambda table: sqlite.insert(table).on_conflict_do_nothing(index_elements=["event_id"]),
+}
+
+metrics.describe("audit_records_total", "Audit entries by outcome (written, spilled, failed)")
+
+
+def _json_value(value):
+    if isinstance(value, datetime) and value == datetime.combine(value.date(), datetime.min.time()):
+        value = value.date()
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def contact_snapshot(contact) -> dict:
+    return {field: getattr(contact, field) for field in AUDIT_FIELDS}
+
+
+def contact_diff(before: Optional[dict], after: Optional[dict]) -> dict:
+    """
+    The contact_diff function compares two snapshots of a contact.
+
+    :param before: dict: Audited fields before the change, None for a created contact
+    :param after: dict: Audited fields after the change, None for a deleted contact
+    :return: A dict of the changed fields with [old, new] values ready for JSON
+    """
+    diff = {}
+    for field in AUDIT_FIELDS:
+        old = _json_value(before.get(field)) if before else None
+        new = _json_value(after.get(field)) if after else None
+        if old != new:
+            diff[field] = [old, new]
+    return diff
+
+
+class DatabaseSink:
+    """Appends entries to the contact_audit table, one executemany INSERT per batch."""
+
+    def __init__(self, session_factory=None):
+        self.session_factory = session_factory or DBSession
+
+    def write(self, entries: list) -> None:
+        rows = [{**entry, "created_at": datetime.fromisoformat(entry["created_at"])} for entry in entries]
+        with self.session_factory() as session:
+            table = ContactAudit.__table__
+            stmt = INSERT_IGNORING_DUPLICATES.get(session.get_bind().dialect.name, insert)(table)
+            session.execute(stmt, rows)
+            session.commit()
+
+
+class FileSink:
+    """Appends entries as JSON lines to one file per day."""
+
+    def __init__(self, directory: str):
+        self.directory = pathlib.Path(directory)
+
+    def write(self, entries: list) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"audit-{date.today():%Y%m%d}.jsonl"
+        with open(path, "a", encoding="utf-8") as file:
+            file.writelines(json.dumps(entry) + "\n" for entry in entries)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class AuditLog:
+    """
+    Audit entries are handed over to an in-process bounded queue and written by a background thread in batches,
+    when batch_size entries are waiting or flush_interval passed, so a write request never waits for the audit
+    table. When the queue is full the entry is appended to a spill file instead of blocking the request or being
+    dropped. Batches the sink refuses go to the spill file as well. The writer replays spill files on start and
+    after every replay_interval; the sink skips entries it already has, so a replay interrupted by a crash can be
+    repeated. In spill mode every entry goes through the spill file, which survives a crash of the process.
+    """
+
+    def __init__(self, sink=None, queue_size: int = None, batch_size: int = None, flush_interval: float = None,
+                 spill_dir: str = None, mode: str = None, replay_interval: float = None):
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=queue_size or config.audit_queue_size)
+        self.batch_size = batch_size or config.audit_batch_size
+        self.flush_interval = flush_interval or config.audit_flush_interval
+        self.replay_interval = replay_interval or config.audit_replay_interval
+        self.spill_dir = pathlib.Path(spill_dir or config.audit_dir) / "spill"
+        self.mode = mode or config.audit_mode
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        metrics.gauge("audit_queue_depth", self.queue.qsize, "Audit entries waiting for the writer")
+
+    def record(self, entry: dict) -> None:
+        """
+        The record method hands an entry over to the writer without waiting for it.
+
+        :param entry: dict: The audit entry
+        """
+        if self.mode != "spill":
+            try:
+                self.queue.put_nowait(entry)
+                return
+            except queue.Full:
+                pass
+        self.spill([entry])
+
+    def spill(self, entries: list) -> None:
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        with self._spill_lock:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.spill_dir / SPILL_FILE, "a", encoding="utf-8") as file:
+                file.write(lines)
+                file.flush()
+        metrics.inc("audit_records_total", len(entries), outcome="spilled")
+
+    def _write(self, entries: list) -> bool:
+        try:
+            self.sink.write(entries)
+        except Exception as e:
+            logging.error(f"Audit batch of {len(entries)} entries could not be written: {e}")
+            metrics.inc("audit_records_total", len(entries), outcome="failed")
+            return False
+        metrics.inc("audit_records_total", len(entries), outcome="written")
+        return True
+
+    def next_batch(self, timeout: float, linger: float = 0.0) -> list:
+        """
+        The next_batch method takes up to batch_size entries from the queue.
+
+        :param timeout: float: Longest wait for the first entry
+        :param linger: float: Longest wait for the batch to fill up after the first entry
+        :return: The entries, an empty list when the queue stayed empty
+        """
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self) -> None:
+        """
+        The flush method writes every queued entry, the entries of failed batches are spilled.
+        """
+        while True:
+            batch = self.next_batch(timeout=0)
+            if not batch:
+                return
+            if not self._write(batch):
+                self.spill(batch)
+
+    def replay_spilled(self) -> None:
+        """
+        The replay_spilled method writes the spill files to the sink. The current spill file is renamed first,
+        so requests keep appending to a new one, and a replay file is removed only once all its entries
+        are written.
+        """
+        with self._spill_lock:
+            spill_file = self.spill_dir / SPILL_FILE
+            if spill_file.exists():
+                spill_file.rename(self.spill_dir / f"{time.time_ns()}{REPLAY_SUFFIX}")
+        for path in sorted(self.spill_dir.glob(f"*{REPLAY_SUFFIX}")):
+            entries = []
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # A line torn by a crash during the append
+                        logging.warning(f"Skipping a malformed audit entry in {path}")
+            for start in range(0, len(entries), self.batch_size):
+                if not self._write(entries[start:start + self.batch_size]):
+                    return
+            path.unlink()
+
+    def _run(self) -> None:
+        replayed_at = 0.0
+        replay_every = self.flush_interval if self.mode == "spill" else self.replay_interval
+        while not self._stop.is_set():
+            if time.monotonic() - replayed_at > replay_every:
+                self.replay_spilled()
+                replayed_at = time.monotonic()
+            batch = self.next_batch(timeout=self.flush_interval, linger=self.flush_interval)
+            if batch and not self._write(batch):
+                self.spill(batch)
+        self.flush()
+
+    def start(self) -> None:
+        if self.sink is None:
+            self.sink = FileSink(config.audit_dir) if config.audit_sink == "file" else DatabaseSink()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        The close method stops the writer after it wrote the queued entries. Entries that are still queued
+        when the timeout passes are spilled, so a shutdown loses nothing.
+
+        :param timeout: float: Longest wait for the writer
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        leftover = []
+        while True:
+            try:
+                leftover.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            self.spill(leftover)
+
+
+audit_log = AuditLog()
+
+
+def audit_contact_change(session: Session, user_id: int, contact_id: int, action: str,
+                         before: Optional[dict] = None, after: Optional[dict] = None) -> None:
+    """
+    The audit_contact_change function records the change of a contact once the transaction of the session
+    is committed. The diff is taken now, from the values the write path already has in memory.
+
+    :param session: Session: Session of the write
+    :param user_id: int: Owner of the contact
+    :param contact_id: int: Id of the contact
+    :param action: str: created, updated or deleted
+    :param before: dict: Audited fields before the change
+    :param after: dict: Audited fields after the change
+    """
+    if not config.audit_enabled:
+        return
+    changes = contact_diff(before, after)
+    if not changes and action == "updated":
+        return
+    entry = {"event_id": uuid.uuid4().hex, "user_id": user_id, "contact_id": contact_id, "action": action,
+             "changes": changes, "created_at": datetime.now().isoformat()}
+    after_commit(session, lambda: audit_log.record(entry))
@@ -1,21 +1,23 @@
+import calendar
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional
 
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+from jose import JWTError
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 
 from src.database.db import get_db
-from src.conf.config import config
 from src.repository import users as repository_users
+from src.services.keys import key_ring
+from src.services.revocation import revoked_tokens
 
 
 class Auth:
     pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    SECRET_KEY = config.secret_key
-    ALGORITHM = config.algorithm
+    keys = key_ring
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
     def verify_password(self, plain_password, hashed_password):
@@ -31,9 +33,10 @@ class Auth:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
             expire = datetime.utcnow() + timedelta(minutes=120)
-        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"})
+        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token",
+                          "jti": uuid.uuid4().hex})
 
-        encoded_access_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        encoded_access_token = self.keys.encode(to_encode)
         return encoded_access_token
 
     # define a function to generate a new refresh token
@@ -43,13 +46,14 @@ class Auth:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
             expire = datetime.utcnow() + timedelta(days=7)
-        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"})
-        encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token",
+                          "jti": uuid.uuid4().hex})
+        encoded_refresh_token = self.keys.encode(to_encode)
         return encoded_refresh_token
 
     def decode_refresh_token(self, refresh_token: str):
         try:
-            payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.keys.decode(refresh_token)
             if payload['scope'] == 'refresh_token':
                 email = payload['sub']
                 return email
@@ -57,7 +61,14 @@ class Auth:
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
 
-    def get_current_user(self, token: str = Depends(oauth2_scheme), session: Session = Depends(get_db)):
+    def decode_access_token(self, token: str) -> dict:
+        """
+        The decode_access_token function validates an access token and returns its claims.
+        Tokens with a revoked jti are rejected, the check is answered from memory unless the jti is a Bloom filter hit.
+
+        :param token: str: The access token
+        :return: The claims of the token
+        """
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
@@ -66,31 +77,45 @@ class Auth:
 
         try:
             # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'access_token':
-                email = payload["sub"]
-                if email is None:
-                    raise credentials_exception
-            else:
-                raise credentials_exception
+            payload = self.keys.decode(token)
         except JWTError as e:
             raise credentials_exception
-
-        user = repository_users.get_user_by_email(email, session)
-        if user is None:
+        if payload.get('scope') != 'access_token' or payload.get("sub") is None:
+            raise credentials_exception
+        if "jti" in payload and revoked_tokens.is_revoked(payload["jti"]):
             raise credentials_exception
+        return payload
+
+    def get_current_user(self, token: str = Depends(oauth2_scheme), session: Session = Depends(get_db)):
+        payload = self.decode_access_token(token)
+
+        user = repository_users.get_user_row(payload["sub"], session)
+        if user is None or not self.issued_after_revocation(payload, user):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
         return user
 
+    @staticmethod
+    def issued_after_revocation(payload: dict, user) -> bool:
+        # revoke-all stores a timestamp on the user row, which get_current_user loads anyway.
+        # iat has a precision of a second, tokens issued in the second of the revocation are rejected too.
+        if user.tokens_valid_after is None:
+            return True
+        return payload.get("iat", 0) > calendar.timegm(user.tokens_valid_after.utctimetuple())
+
     def create_email_token(self, data: dict):
         to_encode = data.copy()
         expire = datetime.utcnow() + timedelta(days=7)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire})
-        token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        token = self.keys.encode(to_encode)
         return token
 
     def get_email_from_token(self, token: str):
         try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.keys.decode(token)
             email = payload["sub"]
             return email
         except JWTError as e:
@@ -0,0 +1,278 @@
+import argparse
+import logging
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from itertools import combinations
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from src.database.models import Contact, User
+from src.repository import contacts as repository_contacts
+from src.services.normalize import normalize_phone, normalize_email
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+MAX_BLOCK_SIZE = 50
+
+WEIGHT_PHONE = 0.45
+WEIGHT_EMAIL = 0.35
+WEIGHT_NAME = 0.15
+WEIGHT_BIRTHDAY = 0.05
+
+
+@dataclass(slots=True)
+class ContactKeys:
+    id: int
+    name: str
+    sur_name: str
+    email: str
+    phone: str
+    birthday: object
+
+
+@dataclass(slots=True)
+class DuplicateCandidate:
+    contact_id: int
+    duplicate_id: int
+    score: float
+    reasons: list = field(default_factory=list)
+
+
+def soundex(value: str) -> str:
+    """
+    The soundex function returns the American Soundex code of a name, so that names which sound alike
+    (Johnson / Jonson) share a blocking key. Names without latin letters are returned lowercased.
+
+    :param value: str: A first name or a surname
+    :return: A four character phonetic code
+    """
+    letters = re.sub(r"[^a-z]", "", (value or "").lower())
+    if not letters:
+        return (value or "").strip().lower()
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0], "")
+    for char in letters[1:]:
+        digit = SOUNDEX_CODES.get(char, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if char not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def phone_key(phone: str) -> str:
+    """
+    The phone_key function returns the E.164 form of a phone number,
+    so +380 96 777 44 11 and 0967774411 get the same key.
+
+    :param phone: str: Phone number in any format
+    :return: The blocking key of the phone
+    """
+    return normalize_phone(phone) or ""
+
+
+def email_key(email: str) -> str:
+    return normalize_email(email) or ""
+
+
+def blocking_keys(contact: ContactKeys) -> list:
+    keys = []
+    if phone := phone_key(contact.phone):
+        keys.append(("phone", phone))
+    if email := email_key(contact.email):
+        keys.append(("email", email))
+    keys.append(("name", soundex(contact.name), soundex(contact.sur_name)))
+    return keys
+
+
+def score_pair(left: ContactKeys, right: ContactKeys) -> DuplicateCandidate:
+    """
+    The score_pair function compares two contacts field by field and returns a score between 0 and 1.
+
+    :param left: ContactKeys: First contact
+    :param right: ContactKeys: Second contact
+    :return: A DuplicateCandidate with the score and the fields that matched
+    """
+    score = 0.0
+    reasons = []
+    if phone_key(left.phone) and phone_key(left.phone) == phone_key(right.phone):
+        score += WEIGHT_PHONE
+        reasons.append("phone")
+    if email_key(left.email) and email_key(left.email) == email_key(right.email):
+        score += WEIGHT_EMAIL
+        reasons.append("email")
+    left_name = f"{left.name} {left.sur_name}".lower()
+    right_name = f"{right.name} {right.sur_name}".lower()
+    name_ratio = SequenceMatcher(None, left_name, right_name).ratio()
+    if name_ratio >= 0.8:
+        reasons.append("name")
+    score += WEIGHT_NAME * name_ratio
+    if left.birthday is not None and left.birthday == right.birthday:
+        score += WEIGHT_BIRTHDAY
+        reasons.append("birthday")
+    return DuplicateCandidate(contact_id=left.id, duplicate_id=right.id, score=round(score, 4), reasons=reasons)
+
+
+def find_duplicates(contacts: Iterable[ContactKeys], min_score: float = 0.5,
+                    max_block_size: int = MAX_BLOCK_SIZE) -> list:
+    """
+    The find_duplicates function finds likely duplicates in an address book without comparing every pair.
+    Contacts are grouped by blocking keys (phone, lowercased email, phonetic name) and only contacts that share
+    a block are scored. Blocks bigger than max_block_size are skipped, which keeps the work near-linear.
+
+    :param contacts: Iterable[ContactKeys]: Contacts of one user
+    :param min_score: float: Minimal score of a reported pair
+    :param max_block_size: int: Blocks with more contacts are ignored
+    :return: A list of DuplicateCandidate sorted by score, the older contact is always contact_id
+    """
+    by_id = {}
+    blocks = defaultdict(list)
+    for contact in contacts:
+        by_id[contact.id] = contact
+        for key in blocking_keys(contact):
+            blocks[key].append(contact.id)
+
+    pairs = set()
+    for ids in blocks.values():
+        if 1 < len(ids) <= max_block_size:
+            pairs.update(combinations(sorted(ids), 2))
+
+    candidates = []
+    for left_id, right_id in pairs:
+        candidate = score_pair(by_id[left_id], by_id[right_id])
+        if candidate.score >= min_score:
+            candidates.append(candidate)
+    candidates.sort(key=lambda item: (-item.score, item.contact_id, item.duplicate_id))
+    return candidates
+
+
+def cluster_duplicates(candidates: Iterable[DuplicateCandidate]) -> dict:
+    """
+    The cluster_duplicates function joins candidate pairs into groups with a union-find,
+    so A~B and B~C are merged into one contact.
+
+    :param candidates: Iterable[DuplicateCandidate]: Scored pairs
+    :return: A dict primary id -> sorted list of duplicate ids, the smallest id is the primary
+    """
+    parent = {}
+
+    def find(item):
+        parent.setdefault(item, item)
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    for candidate in candidates:
+        left, right = find(candidate.contact_id), find(candidate.duplicate_id)
+        if left != right:
+            parent[max(left, right)] = min(left, right)
+
+    clusters = defaultdict(list)
+    for item in list(parent):
+        root = find(item)
+        if root != item:
+            clusters[root].append(item)
+    return {primary: sorted(ids) for primary, ids in clusters.items()}
+
+
+def load_contact_keys(user_id: int, session: Session, chunk_size: int = 1000):
+    """
+    The load_contact_keys function streams the columns needed for deduplication of one user in chunks,
+    without building ORM objects.
+
+    :param user_id: int: Owner of the contacts
+    :param session: Session: Database session
+    :param chunk_size: int: Rows fetched per round trip
+    :return: A generator of ContactKeys
+    """
+    stmt = (
+        select(Contact.id, Contact.name, Contact.sur_name, Contact.email, Contact.phone, Contact.birthday)
+        .where(Contact.user_id == user_id)
+        .order_by(Contact.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for row in session.execute(stmt):
+        yield ContactKeys(*row)
+
+
+def find_user_duplicates(user: User, session: Session, min_score: float = 0.5) -> list:
+    """
+    The find_user_duplicates function returns the duplicate candidates of one address book.
+
+    :param user: User: Owner of the contacts
+    :param session: Session: Database session
+    :param min_score: float: Minimal score of a reported pair
+    :return: A list of DuplicateCandidate
+    """
+    return find_duplicates(load_contact_keys(user.id, session), min_score=min_score)
+
+
+def run_dedupe_job(session: Session, min_score: float = 0.8, merge: bool = False, chunk_size: int = 1000,
+                   progress: Optional[Callable[[int, int, int], None]] = None) -> dict:
+    """
+    The run_dedupe_job function walks the whole contacts table user by user and finds (and optionally merges)
+    duplicates. Only the keys of one user are held in memory at a time and rows are streamed in chunks.
+
+    :param session: Session: Database session
+    :param min_score: float: Minimal score of a pair to be reported or merged
+    :param merge: bool: Merge the found duplicates into the oldest contact of each group
+    :param chunk_size: int: Rows fetched per round trip
+    :param progress: Callable: Called with (processed contacts, total contacts, processed users) after every user
+    :return: A dict with the totals of the run
+    """
+    total = session.scalar(select(func.count(Contact.id)).where(Contact.user_id.is_not(None)))
+    processed = users = pairs = merged = 0
+    last_user_id = 0
+    while True:
+        user_ids = session.scalars(
+            select(Contact.user_id).where(Contact.user_id > last_user_id)
+            .group_by(Contact.user_id).order_by(Contact.user_id).limit(chunk_size)
+        ).all()
+        if not user_ids:
+            break
+        for user_id in user_ids:
+            keys = list(load_contact_keys(user_id, session, chunk_size))
+            candidates = find_duplicates(keys, min_score=min_score)
+            pairs += len(candidates)
+            if merge:
+                for primary_id, duplicate_ids in cluster_duplicates(candidates).items():
+                    repository_contacts.merge_contacts_by_user_id(primary_id, duplicate_ids, user_id, session)
+                    merged += len(duplicate_ids)
+            processed += len(keys)
+            users += 1
+            if progress:
+                progress(processed, total, users)
+        last_user_id = user_ids[-1]
+
+    return {"contacts": processed, "users": users, "pairs": pairs, "merged": merged}
+
+
+if __name__ == "__main__":
+    from src.database.db import DBSession
+
+    parser = argparse.ArgumentParser(description="Find and merge duplicate contacts")
+    parser.add_argument("--min-score", type=float, default=0.8)
+    parser.add_argument("--merge", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with DBSession() as db_session:
+        summary = run_dedupe_job(
+            db_session, min_score=args.min_score, merge=args.merge, chunk_size=args.chunk_size,
+            progress=lambda done, total, users: logging.info("dedupe: %s/%s contacts, %s users", done, total, users),
+        )
+    logging.info("dedupe finished: %s", summary)
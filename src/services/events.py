@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+from sqlalchemy.orm import Session
+
+from src.conf.config import config
+from src.database.db import after_commit
+
+CHANNEL_PREFIX = "contacts:"
+PUBLISH_RETRY_DELAY = 5.0
+LISTEN_RETRY_DELAY = 1.0
+
+
+def channel_for(user_id: int) -> str:
+    return f"{CHANNEL_PREFIX}{user_id}"
+
+
+class ContactEventPublisher:
+    """
+    Publishes contact events to Redis from the (synchronous) repository layer.
+    When Redis is down the publisher stops trying for PUBLISH_RETRY_DELAY seconds,
+    so writes never wait on a dead connection for every request.
+    """
+
+    def __init__(self, client: Optional[redis.Redis] = None):
+        self._client = client
+        self._retry_at = 0.0
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis(host=config.redis_host, port=config.redis_port, db=0,
+                                       socket_connect_timeout=0.2, socket_timeout=0.5)
+        return self._client
+
+    def publish(self, user_id: int, event: dict) -> None:
+        self.publish_many(user_id, [event])
+
+    def publish_many(self, user_id: int, events: list) -> None:
+        """
+        The publish_many method sends the events of one transaction in a single pipeline,
+        so a batch write costs one round trip to Redis instead of one per contact.
+
+        :param user_id: int: Owner of the contacts
+        :param events: list: Events in the order they are delivered
+        """
+        if not events or time.monotonic() < self._retry_at:
+            return
+        channel = channel_for(user_id)
+        try:
+            if len(events) == 1:
+                self.client.publish(channel, json.dumps(events[0], default=str))
+                return
+            pipeline = self.client.pipeline(transaction=False)
+            for event in events:
+                pipeline.publish(channel, json.dumps(event, default=str))
+            pipeline.execute()
+        except redis.RedisError as e:
+            self._retry_at = time.monotonic() + PUBLISH_RETRY_DELAY
+            logging.warning(f"Contact events were not published: {e}")
+
+
+publisher = ContactEventPublisher()
+
+
+def contact_event(event_type: str, contact_id: int, contact: Optional[dict] = None) -> dict:
+    event = {"type": event_type, "id": contact_id}
+    if contact is not None:
+        event["contact"] = contact
+    return event
+
+
+def publish_contact_event(session: Session, user_id: int, event_type: str, contact_id: int,
+                          contact: Optional[dict] = None) -> None:
+    """
+    The publish_contact_event function publishes a contact event after the transaction of the session is committed.
+
+    :param session: Session: Session of the write
+    :param user_id: int: Owner of the contact, the event goes to the channel of the user
+    :param event_type: str: created, updated or deleted
+    :param contact_id: int: Id of the contact
+    :param contact: dict: Fields of the contact for created and updated events
+    """
+    publish_contact_events(session, user_id, [contact_event(event_type, contact_id, contact)])
+
+
+def publish_contact_events(session: Session, user_id: int, events: list) -> None:
+    """
+    The publish_contact_events function publishes the events of a batch write with one pipeline
+    after the transaction of the session is committed.
+
+    :param session: Session: Session of the write
+    :param user_id: int: Owner of the contacts, the events go to the channel of the user
+    :param events: list: Events built with contact_event
+    """
+    if events:
+        after_commit(session, lambda: publisher.publish_many(user_id, events))
+
+
+class Subscription:
+    """
+    A bounded buffer of serialized events of one SSE connection. If the client does not read fast enough
+    and the buffer grows over max_events or max_bytes, the subscription is marked as overflowed and the connection
+    is closed with a reset event, instead of buffering without limit.
+    """
+
+    def __init__(self, user_id: int, max_events: int, max_bytes: int):
+        self.user_id = user_id
+        self.max_bytes = max_bytes
+        self.queue = asyncio.Queue(maxsize=max_events)
+        self.size = 0
+        self.overflowed = False
+
+    def offer(self, data: str) -> None:
+        if self.overflowed:
+            return
+        if self.size + len(data) > self.max_bytes or self.queue.full():
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            self.size = 0
+            return
+        self.size += len(data)
+        self.queue.put_nowait(data)
+
+    async def get(self, timeout: float) -> Optional[str]:
+        data = await asyncio.wait_for(self.queue.get(), timeout)
+        if data is not None:
+            self.size -= len(data)
+        return data
+
+
+class ContactEventHub:
+    """
+    Fans contact events out to the SSE connections of this worker. One pattern subscription to Redis
+    is shared by all connections, so an idle connection costs only a small queue and a waiting task.
+    """
+
+    def __init__(self, max_events: int = None, max_bytes: int = None):
+        self.max_events = max_events or config.contact_events_queue_size
+        self.max_bytes = max_bytes or config.contact_events_max_bytes
+        self.subscriptions = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, self.max_events, self.max_bytes)
+        self.subscriptions.setdefault(user_id, set()).add(subscription)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self.subscriptions.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscriptions[subscription.user_id]
+
+    def dispatch(self, channel: str, data: str) -> None:
+        try:
+            user_id = int(channel[len(CHANNEL_PREFIX):])
+            event_type = json.loads(data)["type"]
+        except (ValueError, KeyError, TypeError):
+            return
+        frame = f"event: {event_type}\ndata: {data}\n\n"
+        for subscription in list(self.subscriptions.get(user_id, ())):
+            subscription.offer(frame)
+
+    async def _listen(self) -> None:
+        while self.subscriptions:
+            client = aioredis.Redis(host=config.redis_host, port=config.redis_port, db=0)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                    while self.subscriptions:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if message is not None:
+                            self.dispatch(message["channel"].decode(), message["data"].decode())
+            except aioredis.RedisError as e:
+                logging.warning(f"Contact events listener lost Redis: {e}")
+                await asyncio.sleep(LISTEN_RETRY_DELAY)
+            finally:
+                await client.close()
+
+    async def stream(self, subscription: Subscription, heartbeat: float = None):
+        """
+        The stream method turns a subscription into a text/event-stream body.
+        A comment line is sent when nothing happened for heartbeat seconds, which keeps proxies from closing idle
+        connections and lets the server notice disconnected clients.
+
+        :param subscription: Subscription: Subscription of the connection
+        :param heartbeat: float: Seconds between heartbeats
+        :return: An async generator of SSE frames
+        """
+        heartbeat = heartbeat or config.contact_events_heartbeat
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    data = await subscription.get(heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if data is None:
+                    yield "event: reset\ndata: {}\n\n"
+                    return
+                yield data
+        finally:
+            self.unsubscribe(subscription)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+
+
+hub = ContactEventHub()
@@ -0,0 +1,197 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from src.conf.config import config
+from src.database.db import DBSession
+from src.services.metrics import metrics
+
+metrics.describe("write_batches_total", "Group commits of coalesced writes")
+metrics.describe("write_batch_writes_total", "Coalesced writes by outcome (committed, failed)")
+
+
+class WriteBatcher:
+    """
+    Writes of concurrent requests are handed over to a background thread that runs them in micro-batches:
+    up to batch_size writes, gathered for at most max_wait seconds after the first one. Every write of a batch
+    runs in its own SAVEPOINT, so a write that fails is rolled back alone and gets its error, and the batch is
+    committed once, one commit (one fsync of the WAL) for all its writes. The future of a write is resolved
+    only after that commit, with its own result or error.
+    Writes hold their row locks until the batch commits, so the locks of the lock keys of a batch (the owners
+    of the contacts) are taken first, sorted, before any write runs. Two batches with the same keys in another
+    order then wait for each other instead of deadlocking.
+    """
+
+    def __init__(self, session_factory=None, batch_size: int = None, max_wait: float = None, lock=None):
+        self.session_factory = session_factory or DBSession
+        self.lock = lock or lock_change_feeds
+        self.batch_size = batch_size or config.write_coalescing_batch_size
+        self.max_wait = max_wait if max_wait is not None else config.write_coalescing_max_wait
+        self.queue = queue.Queue()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        metrics.gauge("write_queue_depth", self.queue.qsize, "Coalesced writes waiting for a batch")
+
+    def submit(self, work, lock_key=None) -> Future:
+        """
+        The submit method queues a write for the next batch.
+
+        :param work: Callable that takes the session of the batch and returns the result of the write
+        :param lock_key: Key locked before the writes of the batch run, the id of the owner of the contacts
+        :return: A future of the result, resolved after the batch is committed
+        """
+        if self._stop.is_set():
+            raise RuntimeError("The write batcher is closed")
+        self.start()
+        future = Future()
+        self.queue.put((work, future, lock_key))
+        return future
+
+    def run(self, work, lock_key=None):
+        return self.submit(work, lock_key).result()
+
+    def next_batch(self, timeout: float) -> list:
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def commit_batch(self, batch: list) -> None:
+        """
+        The commit_batch method runs the writes of a batch in one transaction and resolves their futures.
+
+        :param batch: list: Tuples of a write, its future and its lock key
+        """
+        done = []
+        with self.session_factory() as session:
+            session.info["group_commit"] = True
+            keys = sorted({lock_key for _, _, lock_key in batch if lock_key is not None})
+            try:
+                self.lock(keys, session)
+            except Exception as e:
+                logging.error(f"Locks of a group commit were not taken: {e}")
+                for _, future, _ in batch:
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(e)
+                metrics.inc("write_batch_writes_total", len(batch), outcome="failed")
+                return
+            for work, future, _ in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                # The rollback of a savepoint drops every after_commit callback of the session,
+                # the callbacks of the writes before it are put back
+                callbacks = list(session.info.get("after_commit", []))
+                try:
+                    with session.begin_nested():
+                        result = work(session)
+                except Exception as e:
+                    session.info["after_commit"] = callbacks
+                    future.set_exception(e)
+                    metrics.inc("write_batch_writes_total", outcome="failed")
+                    continue
+                done.append((future, result))
+            try:
+                session.commit()
+            except Exception as e:
+                logging.error(f"Group commit of {len(done)} writes failed: {e}")
+                for future, _ in done:
+                    future.set_exception(e)
+                metrics.inc("write_batch_writes_total", len(done), outcome="failed")
+                return
+        metrics.inc("write_batches_total")
+        metrics.inc("write_batch_writes_total", len(done), outcome="committed")
+        for future, result in done:
+            future.set_result(result)
+
+    def flush(self) -> None:
+        while True:
+            batch = self.next_batch(timeout=0)
+            if not batch:
+                return
+            self.commit_batch(batch)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self.next_batch(timeout=0.1)
+            if batch:
+                self.commit_batch(batch)
+        self.flush()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="write-batcher", daemon=True)
+                self._thread.start()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        The close method stops the batcher after it committed the queued writes.
+
+        :param timeout: float: Longest wait for the batcher
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def lock_change_feeds(user_ids: list, session: Session) -> None:
+    # src.repository.contacts imports commit from this module
+    from src.repository.contacts import lock_change_feeds as lock
+    lock(user_ids, session)
+
+
+write_batcher = WriteBatcher()
+
+
+def commit(session: Session) -> None:
+    """
+    The commit function ends a write of the repository: it commits the session, or only flushes it when the
+    write runs in a batch of the write batcher, which commits once for all writes of the batch.
+
+    :param session: Session: Session of the write
+    """
+    if session.info.get("group_commit"):
+        session.flush()
+    else:
+        session.commit()
+
+
+def write(func, *args, session: Session, lock_key=None):
+    """
+    The write function calls a write of the repository, e.g. write(create_contact, body, user, session=session).
+    With write_coalescing_enabled it is queued for the write batcher instead: the session of the request is closed
+    first, so its connection goes back to the pool while the request waits, and the ORM instances among the
+    arguments are merged into the session of the batch.
+
+    :param func: Write of the repository that takes the session as the session keyword
+    :param args: Arguments of the write
+    :param session: Session: Session of the request
+    :param lock_key: The id of the user whose contacts are written, locked in order with the other writes of the batch
+    :return: The result of the write
+    """
+    if not config.write_coalescing_enabled:
+        return func(*args, session=session)
+    session.close()
+
+    def work(batch_session: Session):
+        merged = [batch_session.merge(arg, load=False) if inspect(arg, raiseerr=False) is not None else arg
+                  for arg in args]
+        return func(*merged, session=batch_session)
+
+    return write_batcher.run(work, lock_key)
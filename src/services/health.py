@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import socket
+import time
+from typing import Callable, Optional
+
+import redis
+from sqlalchemy import create_engine, text, Engine
+from sqlalchemy.pool import NullPool
+
+from src.conf.config import config
+
+OK = "ok"
+ERROR = "error"
+
+
+def check_database(probe_engine: Engine) -> None:
+    with probe_engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+def check_redis(client: redis.Redis) -> None:
+    client.ping()
+
+
+def check_smtp(host: str, port: int, timeout: float) -> None:
+    with socket.create_connection((host, port), timeout=timeout):
+        pass
+
+
+def pool_status(app_engine: Engine) -> dict:
+    """
+    The pool_status function reports how many connections of the application pool are in use.
+    It only reads the counters of the pool, no connection is checked out.
+
+    :param app_engine: Engine: The engine of the application
+    :return: A dict with the pool size, checked out connections and the saturation between 0 and 1
+    """
+    pool = app_engine.pool
+    size = pool.size() if hasattr(pool, "size") else 0
+    capacity = size + max(getattr(pool, "_max_overflow", 0), 0)
+    checked_out = pool.checkedout() if hasattr(pool, "checkedout") else 0
+    return {
+        "size": size,
+        "checked_out": checked_out,
+        "overflow": pool.overflow() if hasattr(pool, "overflow") else 0,
+        "saturation": round(checked_out / capacity, 3) if capacity else 0.0,
+    }
+
+
+class HealthChecker:
+    """
+    Probes the dependencies of the application in the background and keeps the last results, so the
+    readiness endpoint answers from memory. The database is probed through its own engine without a pool,
+    so probes never wait for (or take) a connection of the application pool.
+    """
+
+    def __init__(self, checks: dict, required: tuple = ("database",), interval: float = None,
+                 timeout: float = None, pool: Optional[Callable[[], dict]] = None,
+                 max_pool_saturation: float = None):
+        self.checks = checks
+        self.required = required
+        self.interval = interval or config.health_check_interval
+        self.timeout = timeout or config.health_check_timeout
+        self.pool = pool
+        self.max_pool_saturation = max_pool_saturation or config.health_max_pool_saturation
+        self.results = {}
+        self.checked_at = None
+
+    async def _probe(self, name: str, check: Callable) -> dict:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.to_thread(check), self.timeout)
+            result = {"status": OK}
+        except asyncio.TimeoutError:
+            result = {"status": ERROR, "detail": f"timed out after {self.timeout}s"}
+        except Exception as e:
+            result = {"status": ERROR, "detail": str(e) or e.__class__.__name__}
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        if result["status"] != OK:
+            logging.warning(f"Health check {name} failed: {result['detail']}")
+        return result
+
+    async def run_once(self) -> None:
+        results = await asyncio.gather(*(self._probe(name, check) for name, check in self.checks.items()))
+        self.results = dict(zip(self.checks, results))
+        self.checked_at = time.time()
+
+    async def run_periodically(self) -> None:
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    def status(self) -> dict:
+        """
+        The status method returns the cached readiness of the application. It is not ready before the first
+        round of checks, when the results are older than three intervals or when a required check failed.
+        The saturation of the application pool is always reported, it makes the application not ready only
+        when max_pool_saturation is set, a busy pool alone is not a reason to take a worker out of rotation.
+
+        :return: A dict with ready, the results of every check and the pool status
+        """
+        pool = self.pool() if self.pool else None
+        stale = self.checked_at is None or time.time() - self.checked_at > 3 * self.interval
+        ready = (
+            not stale
+            and all(self.results.get(name, {}).get("status") == OK for name in self.required)
+            and (not self.max_pool_saturation or pool is None or pool["saturation"] < self.max_pool_saturation)
+        )
+        return {
+            "ready": ready,
+            "stale": stale,
+            "checked_at": self.checked_at,
+            "checks": self.results,
+            "pool": pool,
+        }
+
+    def is_ok(self, name: str) -> bool:
+        return self.results.get(name, {}).get("status") == OK
+
+
+def create_checker(app_engine: Engine) -> HealthChecker:
+    """
+    The create_checker function creates the checker of the database, Redis and the mail relay from the settings.
+    Redis is required for readiness when revoked tokens fail closed, without it no token can be checked.
+
+    :param app_engine: Engine: The engine of the application, only its pool counters are read
+    :return: A HealthChecker
+    """
+    connect_args = {"connect_timeout": int(config.health_check_timeout) or 1} \
+        if app_engine.dialect.name == "postgresql" else {}
+    probe_engine = create_engine(config.sqlalchemy_database_url, poolclass=NullPool, connect_args=connect_args)
+    redis_client = redis.Redis(host=config.redis_host, port=config.redis_port, db=0,
+                               socket_connect_timeout=config.health_check_timeout,
+                               socket_timeout=config.health_check_timeout)
+    return HealthChecker(
+        checks={
+            "database": lambda: check_database(probe_engine),
+            "redis": lambda: check_redis(redis_client),
+            "smtp": lambda: check_smtp(config.mail_server, config.mail_port, config.health_check_timeout),
+        },
+        required=("database", "redis") if config.revocation_fail_closed else ("database",),
+        pool=lambda: pool_status(app_engine),
+    )
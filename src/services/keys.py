@@ -0,0 +1,143 @@
+import argparse
+import json
+import pathlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt, JWTError
+from jose.backends.base import Key
+
+from src.conf.config import config
+
+ASYMMETRIC_ALGORITHM = "RS256"
+
+
+@dataclass(slots=True)
+class VerificationKey:
+    kid: str
+    key: Key
+    jwk: dict
+
+
+class KeyRing:
+    """
+    Keys of the tokens, parsed once at start. Every PEM file of the keys directory is a key, its file name is
+    the kid. Private keys can sign, public keys only verify, which is how a retired key is kept until the
+    tokens signed with it expire. The signing key is jwt_signing_kid or the last private key by name.
+    Without a keys directory tokens are signed with HS256 and secret_key, as before.
+
+    Rotation: add a new private key, switch jwt_signing_kid to it, replace the old one with its public key
+    and remove it once the longest token lifetime has passed.
+    """
+
+    def __init__(self, keys_dir: str = None, signing_kid: str = None, secret_key: str = None,
+                 algorithm: str = None, accept_secret: bool = None):
+        self.secret_key = secret_key or config.secret_key
+        self.secret_algorithm = algorithm or config.algorithm
+        self.verification_keys = {}
+        self.signing_key: Optional[Key] = None
+        self.signing_kid: Optional[str] = None
+
+        keys_dir = config.jwt_keys_dir if keys_dir is None else keys_dir
+        private_kids = []
+        for path in sorted(pathlib.Path(keys_dir).glob("*.pem")) if keys_dir else ():
+            pem = path.read_bytes()
+            key = jwk.construct(pem, ASYMMETRIC_ALGORITHM)
+            public_key = key.public_key()
+            public_jwk = {**public_key.to_dict(), "kid": path.stem, "use": "sig"}
+            self.verification_keys[path.stem] = VerificationKey(path.stem, public_key, public_jwk)
+            if b"PRIVATE KEY" in pem:
+                private_kids.append((path.stem, key))
+
+        signing_kid = config.jwt_signing_kid if signing_kid is None else signing_kid
+        for kid, key in private_kids:
+            if not signing_kid or kid == signing_kid:
+                self.signing_kid, self.signing_key = kid, key
+        if signing_kid and self.signing_kid != signing_kid:
+            raise ValueError(f"No private key with kid {signing_kid} in {keys_dir}")
+
+        # HS256 tokens stay valid after the switch to RS256 until accept_secret is turned off
+        self.accept_secret = self.signing_key is None or (
+            config.jwt_accept_secret if accept_secret is None else accept_secret)
+        self.jwks_json = json.dumps({"keys": [key.jwk for key in self.verification_keys.values()]}).encode()
+
+    def encode(self, claims: dict) -> str:
+        if self.signing_key is None:
+            return jwt.encode(claims, self.secret_key, algorithm=self.secret_algorithm)
+        return jwt.encode(claims, self.signing_key, algorithm=ASYMMETRIC_ALGORITHM,
+                          headers={"kid": self.signing_kid})
+
+    def decode(self, token: str) -> dict:
+        """
+        The decode method verifies a token with the key named by its kid header and returns the claims.
+        The algorithm is fixed by the key, the alg header of the token cannot choose another one.
+
+        :param token: str: Encoded token
+        :return: The claims of the token
+        """
+        header = jwt.get_unverified_header(token)
+        kid = header.get("kid")
+        if kid is None:
+            if not self.accept_secret:
+                raise JWTError("Token without kid")
+            return jwt.decode(token, self.secret_key, algorithms=[self.secret_algorithm])
+        if not isinstance(kid, str):
+            raise JWTError("Malformed kid")
+        verification_key = self.verification_keys.get(kid)
+        if verification_key is None:
+            raise JWTError(f"Unknown kid {kid}")
+        return jwt.decode(token, verification_key.key, algorithms=[ASYMMETRIC_ALGORITHM])
+
+
+def generate_key(keys_dir: str, kid: str = None, key_size: int = 2048) -> pathlib.Path:
+    """
+    The generate_key function writes a new RSA private key into the keys directory.
+
+    :param keys_dir: str: The keys directory
+    :param kid: str: Name of the key, a timestamp by default
+    :param key_size: int: Size of the key in bits
+    :return: Path of the new key
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    path = pathlib.Path(keys_dir) / f"{kid or datetime.utcnow().strftime('%Y%m%d%H%M%S')}.pem"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                               serialization.NoEncryption()))
+    path.chmod(0o600)
+    return path
+
+
+def export_public_key(path: str) -> pathlib.Path:
+    """
+    The export_public_key function replaces a private key with its public key, so the key only verifies.
+
+    :param path: str: Path of the private key
+    :return: Path of the public key
+    """
+    path = pathlib.Path(path)
+    private_key = serialization.load_pem_private_key(path.read_bytes(), password=None)
+    path.write_bytes(private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                           serialization.PublicFormat.SubjectPublicKeyInfo))
+    return path
+
+
+key_ring = KeyRing()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the token signing keys")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="Create a new private key")
+    generate.add_argument("--dir", default=config.jwt_keys_dir or "keys")
+    generate.add_argument("--kid")
+    retire = commands.add_parser("retire", help="Keep only the public part of a key")
+    retire.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        print(generate_key(args.dir, args.kid))
+    else:
+        print(export_public_key(args.path))
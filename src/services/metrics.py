@@ -0,0 +1,91 @@
+from collections import Counter
+from threading import Lock
+
+from sqlalchemy import Engine, event
+from sqlalchemy.engine.interfaces import CacheStats
+
+CACHE_RESULTS = {
+    CacheStats.CACHE_HIT: "hit",
+    CacheStats.CACHE_MISS: "miss",
+    CacheStats.CACHING_DISABLED: "disabled",
+    CacheStats.NO_CACHE_KEY: "no_key",
+    CacheStats.NO_DIALECT_SUPPORT: "no_dialect_support",
+}
+
+
+class Metrics:
+    """
+    Process wide counters exported at /metrics in the Prometheus text format.
+    Counters are keyed by name and a tuple of label pairs, gauges are read from callbacks when rendered.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.gauges = {}
+        self.help = {}
+        self._lock = Lock()
+
+    def describe(self, name: str, help_text: str) -> None:
+        self.help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def gauge(self, name: str, callback, help_text: str = "") -> None:
+        self.gauges[name] = callback
+        if help_text:
+            self.describe(name, help_text)
+
+    def value(self, name: str, **labels) -> float:
+        return self.counters[(name, tuple(sorted(labels.items())))]
+
+    def render(self) -> str:
+        lines = []
+        seen = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in seen:
+                seen.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} counter")
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        for name, callback in sorted(self.gauges.items()):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {callback()}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("sqlalchemy_statements_total", "Executed statements by compiled cache result")
+
+
+def statement_cache_ratio() -> float:
+    hits = metrics.value("sqlalchemy_statements_total", cache="hit")
+    misses = metrics.value("sqlalchemy_statements_total", cache="miss")
+    return round(hits / (hits + misses), 4) if hits + misses else 0.0
+
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    The instrument_engine function counts how the statements of an engine were compiled:
+    taken from the compiled cache (hit), compiled and cached (miss) or compiled every time (no_key).
+    A low hit ratio means some query builds a different statement structure on every call.
+
+    :param engine: Engine: The engine to observe
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_cache_result(conn, cursor, statement, parameters, context, executemany):
+        result = CACHE_RESULTS.get(getattr(context, "cache_hit", None))
+        if result is not None:
+            metrics.inc("sqlalchemy_statements_total", cache=result)
+
+    metrics.gauge("sqlalchemy_compiled_cache_hit_ratio", statement_cache_ratio,
+                  "Share of cacheable statements served from the compiled cache")
+    if engine._compiled_cache is not None:
+        metrics.gauge("sqlalchemy_compiled_cache_size", lambda: len(engine._compiled_cache),
+                      "Entries in the compiled cache of the engine")
@@ -0,0 +1,61 @@
+import re
+from typing import Optional
+
+from src.conf.config import config
+
+E164_MAX_DIGITS = 15
+
+
+def normalize_phone(phone: Optional[str], country_code: Optional[str] = None) -> Optional[str]:
+    """
+    The normalize_phone function turns a free-form phone number into E.164 (+380967774411).
+    Numbers written with a trunk prefix (0967774411) or without one (967774411) get the default country code,
+    00 is treated as the international prefix.
+
+    :param phone: str: Phone number as typed by the user
+    :param country_code: str: Country code for national numbers, config.phone_country_code by default
+    :return: The phone number in E.164 or None if it has no digits
+    """
+    if not phone:
+        return None
+    country_code = country_code or config.phone_country_code
+    raw = phone.strip()
+    digits = re.sub(r"\D", "", raw)
+    if not digits:
+        return None
+    if raw.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif digits.startswith(country_code):
+        pass
+    elif digits.startswith("0"):
+        digits = country_code + digits[1:]
+    else:
+        digits = country_code + digits
+    return "+" + digits[:E164_MAX_DIGITS]
+
+
+def normalize_email(email: Optional[str]) -> Optional[str]:
+    """
+    The normalize_email function returns the lookup key of an email: stripped and lowercased.
+
+    :param email: str: Email address
+    :return: The lowercased email or None
+    """
+    if not email:
+        return None
+    return email.strip().lower()
+
+
+def email_domain(email: Optional[str]) -> Optional[str]:
+    """
+    The email_domain function returns the lowercased domain of an email, the key of the email domain filter.
+
+    :param email: str: Email address
+    :return: The domain or None
+    """
+    email = normalize_email(email)
+    if not email or "@" not in email:
+        return None
+    return email.rsplit("@", 1)[1]
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+
+from src.conf.config import config
+
+REVOKED_KEY = "revoked_tokens"
+REVOKED_CHANNEL = "revoked_tokens"
+LISTEN_RETRY_DELAY = 1.0
+CHECK_RETRY_DELAY = 1.0
+
+
+class BloomFilter:
+    """
+    A fixed size Bloom filter. A miss proves that the item was never added, a hit means that it was added
+    or, with probability error_rate at full capacity, that it is a false positive.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _hashes(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+    def add(self, item: str) -> None:
+        first, second = self._hashes(item)
+        # Kirsch-Mitzenmacher: k positions from two independent hashes
+        for i in range(self.hashes):
+            position = (first + i * second) % self.size
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        first, second = self._hashes(item)
+        bits, size = self.bits, self.size
+        for i in range(self.hashes):
+            position = (first + i * second) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class TokenRevocationList:
+    """
+    Revoked access token ids (jti) live in a Redis sorted set scored by the expiry of the token.
+    Every worker keeps them in a Bloom filter, filled from the set on start and updated from pub/sub,
+    so checking a token that was not revoked is a few hash lookups in memory. Only filter hits are
+    confirmed in Redis, which removes the false positives. The filter is trusted only while it is synced,
+    i.e. it was loaded and the pub/sub connection is up, until then every check goes to Redis.
+
+    With fail_closed (revocation_fail_closed, on by default) a token that Redis cannot check is rejected,
+    which makes Redis a hard dependency of every authenticated request: the readiness check then requires
+    Redis as well. Without it such tokens are accepted and a revoked token works until Redis is back.
+    """
+
+    def __init__(self, client: Optional[redis.Redis] = None, capacity: int = None, error_rate: float = None,
+                 fail_closed: bool = None):
+        self._client = client
+        self.capacity = capacity or config.revocation_bloom_capacity
+        self.error_rate = error_rate or config.revocation_bloom_error_rate
+        self.bloom = BloomFilter(self.capacity, self.error_rate)
+        self.synced = False
+        self.fail_closed = config.revocation_fail_closed if fail_closed is None else fail_closed
+        self._retry_at = 0.0
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis(host=config.redis_host, port=config.redis_port, db=0,
+                                       socket_connect_timeout=0.2, socket_timeout=0.5)
+        return self._client
+
+    def revoke(self, jti: str, expires_at: int) -> None:
+        """
+        The revoke method stores the id of a token until the token expires and tells the other workers about it.
+
+        :param jti: str: Id of the token
+        :param expires_at: int: Unix time of the expiry of the token
+        """
+        pipeline = self.client.pipeline()
+        pipeline.zadd(REVOKED_KEY, {jti: expires_at})
+        pipeline.zremrangebyscore(REVOKED_KEY, "-inf", time.time())
+        pipeline.publish(REVOKED_CHANNEL, jti)
+        pipeline.execute()
+        self.bloom.add(jti)
+
+    def is_revoked(self, jti: str) -> bool:
+        """
+        The is_revoked method checks a token id. Tokens missing from a synced Bloom filter are answered from memory,
+        filter hits and every check while the filter is not synced go to Redis.
+        When Redis cannot answer, the token is treated as revoked if fail_closed is set. After a failure Redis
+        is not asked again for CHECK_RETRY_DELAY seconds, so requests do not each wait for the connect timeout.
+
+        :param jti: str: Id of the token
+        :return: True if the token was revoked
+        """
+        if self.synced and jti not in self.bloom:
+            return False
+        if time.monotonic() < self._retry_at:
+            return self.fail_closed
+        try:
+            return self.client.zscore(REVOKED_KEY, jti) is not None
+        except redis.RedisError as e:
+            self._retry_at = time.monotonic() + CHECK_RETRY_DELAY
+            logging.warning(f"Token revocation could not be checked: {e}")
+            return self.fail_closed
+
+    def load(self, jtis) -> None:
+        jtis = list(jtis)
+        capacity = self.capacity
+        while len(jtis) > capacity // 2:
+            capacity *= 2
+        # A fresh filter drops the ids of tokens that expired since the last load
+        bloom = BloomFilter(capacity, self.error_rate)
+        for jti in jtis:
+            bloom.add(jti.decode() if isinstance(jti, bytes) else jti)
+        self.bloom = bloom
+
+    async def _listen(self) -> None:
+        while True:
+            client = aioredis.Redis(host=config.redis_host, port=config.redis_port, db=0)
+            try:
+                async with client.pubsub() as pubsub:
+                    # Subscribe before loading, so ids revoked during the load are not missed
+                    await pubsub.subscribe(REVOKED_CHANNEL)
+                    self.load(await client.zrangebyscore(REVOKED_KEY, time.time(), "+inf"))
+                    self.synced = True
+                    while True:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if message is not None:
+                            self.bloom.add(message["data"].decode())
+                            if self.bloom.count > self.bloom.capacity:
+                                break
+            except aioredis.RedisError as e:
+                logging.warning(f"Token revocation listener lost Redis: {e}")
+                await asyncio.sleep(LISTEN_RETRY_DELAY)
+            finally:
+                # Revocations published while the connection is down are missed, the filter is reloaded first
+                self.synced = False
+                await client.close()
+
+    def start(self) -> asyncio.Task:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        return self._listener
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+
+
+revoked_tokens = TokenRevocationList()
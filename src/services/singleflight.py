@@ -0,0 +1,174 @@
+import asyncio
+import functools
+import inspect
+import threading
+from typing import Any, Callable, Hashable
+
+from src.database.db import after_commit
+from src.services.metrics import metrics
+
+metrics.describe("singleflight_calls_total", "Coalesced reads by function and role (leader ran the query)")
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time. Callers that ask for a key which is already in flight wait for that call
+    and get its result (or its exception) instead of running the query again. Nothing is cached: once the
+    call finished the next caller starts a new one.
+    Sync callers (threadpool routes) wait on an Event, async callers await a Future of their event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]):
+        """
+        The do method runs fn, or waits for the running call with the same key.
+
+        :param key: Hashable: Identity of the call
+        :param fn: Callable: The call
+        :return: A tuple of the result and True when the result came from another caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Any]):
+        """
+        The do_async method is do for coroutine functions, calls are shared within one event loop.
+
+        :param key: Hashable: Identity of the call
+        :param fn: Callable: A coroutine function without arguments
+        :return: A tuple of the result and True when the result came from another caller
+        """
+        loop_key = (id(asyncio.get_running_loop()), key)
+        future = self._async_calls.get(loop_key)
+        if future is not None:
+            return await asyncio.shield(future), True
+
+        future = self._async_calls[loop_key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # The exception is delivered to the followers, do not report it as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            if self._async_calls.get(loop_key) is future:
+                del self._async_calls[loop_key]
+        return result, False
+
+    def forget(self, match: Callable[[Hashable], bool]) -> None:
+        """
+        The forget method makes the next callers of the matching keys start a new call.
+        Writers call it after commit, so a read that started before the write is not shared with later readers.
+
+        :param match: Callable: Predicate on the keys
+        """
+        with self._lock:
+            for key in [key for key in self._calls if match(key)]:
+                del self._calls[key]
+            for loop_key in [loop_key for loop_key in self._async_calls if match(loop_key[1])]:
+                del self._async_calls[loop_key]
+
+
+flights = SingleFlight()
+
+
+def _check_shareable(result, name: str) -> None:
+    # Followers get the very object of the leader: an ORM instance belongs to the session of the leader and may be
+    # changed by its request, only immutable snapshots (Core rows, tuples) can be shared
+    sample = result[0] if isinstance(result, list) and result else result
+    if hasattr(sample, "_sa_instance_state"):
+        raise TypeError(f"{name} is coalesced and must return immutable rows, not ORM instances")
+
+
+def coalesce(key: Callable[..., Hashable]):
+    """
+    The coalesce decorator puts a read repository function behind the single-flight group.
+    Concurrent calls with the same key share one query and one result, the key function gets the arguments
+    of the call. The result is handed to every caller as is, so the function must return immutable snapshots
+    (ContactRecord tuples, Core rows), never ORM instances. It must take the session as the session argument.
+
+    :param key: Callable: Builds the key from the arguments of the call
+    :return: The decorator
+    """
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        name = fn.__name__
+
+        def prepare(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return (name, *key(**bound.arguments))
+
+        def count(result, shared):
+            _check_shareable(result, name)
+            metrics.inc("singleflight_calls_total", function=name, role="follower" if shared else "leader")
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                result, shared = await flights.do_async(prepare(args, kwargs), lambda: fn(*args, **kwargs))
+                count(result, shared)
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            result, shared = flights.do(prepare(args, kwargs), lambda: fn(*args, **kwargs))
+            count(result, shared)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def forget_after_commit(session, *prefix) -> None:
+    """
+    The forget_after_commit function drops the in-flight reads whose key starts with the given parts
+    (e.g. the id of a user) once the current transaction of the session is committed.
+
+    :param session: Session: Session of the write
+    :param prefix: Parts of the key after the function name
+    """
+    after_commit(session, lambda: flights.forget(lambda key: key[1:1 + len(prefix)] == prefix))
@@ -14,13 +14,14 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from main import app
 from src.database.models import Base, User
 from src.database.db import get_db
+from src.services.revocation import revoked_tokens
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 
 @pytest.fixture(scope="module")
@@ -50,6 +51,8 @@ def client(session):
             session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    # The tests run without Redis, the empty filter stands in for a loaded revocation list
+    revoked_tokens.synced = True
 
     yield TestClient(app)
 
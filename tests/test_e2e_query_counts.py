@@ -0,0 +1,106 @@
+from contextlib import contextmanager
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy import event
+
+
+@contextmanager
+def count_statements(session):
+    engine = session.get_bind()
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split()[0].upper())
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture()
+def headers(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_signup_queries(client, session, monkeypatch):
+    monkeypatch.setattr("src.routes.auth.send_email", MagicMock())
+    with count_statements(session) as statements:
+        response = client.post("/auth/signup", json={"username": "counter", "email": "counter@gmail.com",
+                                                      "password": "11223344"})
+    assert response.status_code == 201, response.text
+    assert statements == ["SELECT", "INSERT"]
+
+
+def test_login_queries(client, session, user, token, monkeypatch):
+    monkeypatch.setattr("src.routes.auth.auth_service.create_refresh_token", lambda data: "login-refresh-token")
+    with count_statements(session) as statements:
+        response = client.post("/auth/login", data={"username": user["email"], "password": user["password"]})
+    assert response.status_code == 200, response.text
+    assert statements == ["SELECT", "UPDATE"]
+
+
+def test_refresh_token_queries(client, session, user, token, monkeypatch):
+    refresh_token = client.post("/auth/login", data={"username": user["email"],
+                                                      "password": user["password"]}).json()["refresh_token"]
+    monkeypatch.setattr("src.routes.auth.auth_service.create_refresh_token", lambda data: "next-refresh-token")
+    with count_statements(session) as statements:
+        response = client.get("/auth/refresh_token", headers={"Authorization": f"Bearer {refresh_token}"})
+    assert response.status_code == 200, response.text
+    assert statements == ["SELECT", "UPDATE"]
+
+
+def test_confirmed_email_queries(client, session, monkeypatch):
+    from src.services.auth import auth_service
+
+    monkeypatch.setattr("src.routes.auth.send_email", MagicMock())
+    client.post("/auth/signup", json={"username": "confirm", "email": "confirm@gmail.com", "password": "11223344"})
+    email_token = auth_service.create_email_token({"sub": "confirm@gmail.com"})
+    with count_statements(session) as statements:
+        response = client.get(f"/auth/confirmed_email/{email_token}")
+    assert response.json() == {"message": "Email confirmed"}
+    assert statements == ["SELECT", "UPDATE"]
+
+
+def test_update_avatar_queries(client, session, headers, monkeypatch):
+    monkeypatch.setattr("src.routes.users.UploadService.upload", MagicMock(return_value={"version": 1}))
+    with count_statements(session) as statements:
+        response = client.patch("/users/avatar", files={"avatar": ("avatar.png", b"png", "image/png")},
+                                headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar"].startswith("http")
+    assert statements == ["SELECT", "UPDATE"]
+
+
+def test_contact_write_queries(client, session, contact, headers):
+    body = {**contact, "phone": "+380000000100"}
+    with count_statements(session) as statements:
+        response = client.post("/api/contacts", json=body, headers=headers)
+    assert response.status_code == 201, response.text
+    created = response.json()
+    assert created["created_at"] is not None
+    # user, duplicate phone check, change feed lock, INSERT ... RETURNING, contact_stats upsert
+    assert statements == ["SELECT", "SELECT", "INSERT", "INSERT", "INSERT"]
+
+    with count_statements(session) as statements:
+        response = client.patch(f"/api/contacts/{created['id']}", json={**body, "name": "Renamed"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["name"] == "Renamed"
+    # user, contact, phone conflict check, change feed lock, UPDATE ... RETURNING
+    assert statements == ["SELECT", "SELECT", "SELECT", "INSERT", "UPDATE"]
+
+    with count_statements(session) as statements:
+        response = client.delete(f"/api/contacts/{created['id']}", headers=headers)
+    assert response.status_code == 204, response.text
+    # user, contact, change feed lock, DELETE, the tombstone, the tag links and the contact_stats upsert
+    # (the order depends on autoflush)
+    assert sorted(statements) == ["DELETE", "DELETE", "INSERT", "INSERT", "INSERT", "SELECT", "SELECT"]
+
+
+def test_contact_read_queries(client, session, contact, headers):
+    with count_statements(session) as statements:
+        response = client.get("/api/contacts", headers=headers)
+    assert response.status_code == 200, response.text
+    assert statements == ["SELECT", "SELECT"]
@@ -67,3 +67,52 @@ def test_login_user_wrong_email(client, user):
     assert response.status_code == 401, response.text
     data = response.json()
     assert data["detail"] == "Invalid email"
+
+
+def test_logout(client, user, monkeypatch):
+    revoked = {}
+    monkeypatch.setattr("src.services.revocation.revoked_tokens.revoke",
+                        lambda jti, expires_at: revoked.setdefault(jti, expires_at))
+    monkeypatch.setattr("src.services.revocation.revoked_tokens.is_revoked", lambda jti: jti in revoked)
+    login = client.post("/auth/login", data={"username": user.get('email'), "password": user.get('password')}).json()
+    headers = {"Authorization": f"Bearer {login['access_token']}"}
+
+    response = client.post("/auth/logout", headers=headers)
+    assert response.status_code == 204, response.text
+    assert len(revoked) == 1
+    assert client.get("/users/me/", headers=headers).status_code == 401
+    response = client.get("/auth/refresh_token", headers={"Authorization": f"Bearer {login['refresh_token']}"})
+    assert response.status_code == 401
+
+
+def test_revoke_all(client, session, user):
+    login = client.post("/auth/login", data={"username": user.get('email'), "password": user.get('password')}).json()
+    headers = {"Authorization": f"Bearer {login['access_token']}"}
+
+    response = client.post("/auth/revoke_all", headers=headers)
+    assert response.status_code == 204, response.text
+    assert client.get("/users/me/", headers=headers).status_code == 401
+
+    current_user: User = session.query(User).filter(User.email == user.get('email')).first()
+    current_user.tokens_valid_after = None
+    session.commit()
+
+
+def test_jwks_route(client):
+    response = client.get("/.well-known/jwks.json")
+    assert response.status_code == 200
+    assert response.json() == {"keys": []}
+    assert response.headers["cache-control"].startswith("public")
+
+
+def test_current_user_is_a_shared_snapshot(client, session, user):
+    from src.repository.users import UserRecord, get_user_row
+
+    login = client.post("/auth/login", data={"username": user.get('email'), "password": user.get('password')}).json()
+    response = client.get("/users/me/", headers={"Authorization": f"Bearer {login['access_token']}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == user.get('email')
+
+    record = get_user_row(user.get('email'), session)
+    assert isinstance(record, UserRecord)
+    assert record.id == response.json()["id"]
@@ -1,3 +1,7 @@
+import base64
+import json
+from unittest.mock import MagicMock
+
 from starlette import status
 
 
@@ -60,3 +64,302 @@ def test_delete_contact_not_existed(client, contact, token):
     )
 
     assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_update_contacts_batch(client, contact, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    first = client.post("/api/contacts", json={**contact, "phone": "+380000000001"}, headers=headers).json()
+    second = client.post("/api/contacts", json={**contact, "phone": "+380000000002"}, headers=headers).json()
+
+    response = client.patch(
+        "/api/contacts/batch",
+        json={"contacts": [
+            {"id": first["id"], "name": "Winston"},
+            {"id": second["id"], "phone": "+380000000001"},
+            {"id": 999},
+        ]},
+        headers=headers,
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [item["status"] for item in data] == ["updated", "conflict", "not_found"]
+
+    response = client.get(f"/api/contacts/{first['id']}", headers=headers)
+    assert response.json()["name"] == "Winston"
+
+
+def test_delete_contacts_batch(client, contact, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    ids = [item["id"] for item in client.get("/api/contacts", headers=headers).json()]
+
+    response = client.request("DELETE", "/api/contacts/batch", json={"ids": ids + [999]}, headers=headers)
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [item["status"] for item in data] == ["deleted"] * len(ids) + ["not_found"]
+    assert client.get("/api/contacts", headers=headers).json() == []
+
+
+def test_merge_duplicate_contacts(client, contact, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    first = client.post("/api/contacts", json=contact, headers=headers).json()
+    second = client.post("/api/contacts", json={**contact, "phone": "+380000000003"}, headers=headers).json()
+
+    response = client.get("/api/contacts/duplicates", params={"min_score": 0.5}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [(item["contact_id"], item["duplicate_id"]) for item in data] == [(first["id"], second["id"])]
+
+    response = client.post(f"/api/contacts/{first['id']}/merge", json={"duplicate_ids": [second["id"]]},
+                           headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["id"] for item in client.get("/api/contacts", headers=headers).json()] == [first["id"]]
+
+
+def test_lookup_uses_normalized_keys(client, contact, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post("/api/contacts", json={**contact, "phone": "0967774411", "email": "Mixed@gmail.com"},
+                           headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+
+    response = client.post("/api/contacts", json={**contact, "phone": "+380967774411"}, headers=headers)
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+    response = client.get("/api/contacts/email/mixed@gmail.com", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["email"] == "Mixed@gmail.com"
+
+
+def test_contact_changes(client, session, contact, token):
+    from sqlalchemy import func
+    from src.database.models import ContactChangeFeed
+
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/api/contacts/changes", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["reset"] is True
+    assert data["has_more"] is False
+    known = {item["id"] for item in data["changed"]}
+    cursor = data["cursor"]
+
+    writes = session.query(func.sum(ContactChangeFeed.writes)).scalar()
+    created = client.post("/api/contacts", json={**contact, "phone": "+380000000004"}, headers=headers).json()
+    removed = known.pop()
+    client.delete(f"/api/contacts/{removed}", headers=headers)
+    # Both writes took the change feed lock of the user
+    assert session.query(func.sum(ContactChangeFeed.writes)).scalar() == writes + 2
+
+    response = client.get("/api/contacts/changes", params={"since": cursor}, headers=headers)
+    data = response.json()
+    assert data["reset"] is False
+    assert [item["id"] for item in data["changed"]] == [created["id"]]
+    assert data["deleted"] == [removed]
+
+    response = client.get("/api/contacts/changes", params={"since": data["cursor"]}, headers=headers)
+    assert response.json()["changed"] == []
+    assert response.json()["deleted"] == []
+
+
+def test_contact_changes_invalid_cursor(client, token):
+    for since in ("abc", "1.99999999999999999", "1.-99999999999999999"):
+        response = client.get("/api/contacts/changes", params={"since": since},
+                              headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST, since
+
+
+def test_contact_events_published_after_commit(client, contact, token, monkeypatch):
+    mock_publish = MagicMock()
+    monkeypatch.setattr("src.services.events.publisher.publish_many", mock_publish)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    created = client.post("/api/contacts", json={**contact, "phone": "+380000000005"}, headers=headers).json()
+    client.post("/api/contacts", json={**contact, "phone": "+380000000005"}, headers=headers)
+    client.delete(f"/api/contacts/{created['id']}", headers=headers)
+
+    events = [(user_id, event) for user_id, batch in (call.args for call in mock_publish.call_args_list)
+              for event in batch]
+    assert [(user_id, event["type"], event["id"]) for user_id, event in events] == [
+        (events[0][0], "created", created["id"]),
+        (events[0][0], "deleted", created["id"]),
+    ]
+
+    first = client.post("/api/contacts", json={**contact, "phone": "+380000000007"}, headers=headers).json()
+    second = client.post("/api/contacts", json={**contact, "phone": "+380000000008"}, headers=headers).json()
+    mock_publish.reset_mock()
+    client.request("DELETE", "/api/contacts/batch", json={"ids": [second["id"], first["id"]]}, headers=headers)
+
+    mock_publish.assert_called_once()
+    assert [(event["type"], event["id"]) for event in mock_publish.call_args.args[1]] == [
+        ("deleted", first["id"]), ("deleted", second["id"]),
+    ]
+
+
+def test_get_contacts_sparse_fields(client, contact, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    created = client.post("/api/contacts", json={**contact, "phone": "+380000000006"}, headers=headers).json()
+
+    response = client.get("/api/contacts", params={"fields": "phone,id,name"}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    data = {item["id"]: item for item in response.json()}
+    assert data[created["id"]] == {"id": created["id"], "name": contact["name"], "phone": "+380000000006"}
+
+    response = client.get(f"/api/contacts/{created['id']}", params={"fields": "sur_name"}, headers=headers)
+    assert response.json() == {"sur_name": contact["sur_name"]}
+
+    response = client.get("/api/contacts", params={"fields": "id,password"}, headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_contact_stats(client, session, contact, token):
+    from src.database.models import ContactStats
+    from src.repository.stats import reconcile_contact_stats
+
+    headers = {"Authorization": f"Bearer {token}"}
+    before = client.get("/api/contacts/stats", params={"recent": 0}, headers=headers).json()
+
+    first = client.post("/api/contacts", json={**contact, "phone": "+380000000201", "birthday": "1990-03-05"},
+                        headers=headers).json()
+    second = client.post("/api/contacts", json={**contact, "phone": "+380000000202", "birthday": "1990-03-06"},
+                         headers=headers).json()
+    client.patch(f"/api/contacts/{second['id']}", json={**contact, "phone": "+380000000202",
+                                                        "birthday": "1990-07-01"}, headers=headers)
+    client.request("DELETE", "/api/contacts/batch", json={"ids": [first["id"]]}, headers=headers)
+
+    response = client.get("/api/contacts/stats", params={"recent": 1}, headers=headers)
+    assert response.status_code == 200, response.text
+    stats = response.json()
+    assert stats["total"] == before["total"] + 1
+    assert stats["birthdays_by_month"]["3"] == before["birthdays_by_month"]["3"]
+    assert stats["birthdays_by_month"]["7"] == before["birthdays_by_month"]["7"] + 1
+    assert [item["id"] for item in stats["recent"]] == [second["id"]]
+
+    # Drift is repaired by the reconciliation job
+    session.query(ContactStats).update({"total": 1000, "birthdays_07": 0})
+    session.commit()
+    assert reconcile_contact_stats(session, chunk_size=1) >= 1
+    assert client.get("/api/contacts/stats", headers=headers).json()["total"] == stats["total"]
+    assert client.get("/api/contacts/stats", headers=headers).json()["birthdays_by_month"] == stats["birthdays_by_month"]
+
+
+def test_contact_changes_are_audited(client, session, contact, token, monkeypatch):
+    from sqlalchemy import select
+    from src.database.models import ContactAudit
+    from src.services.audit import AuditLog, DatabaseSink
+
+    audit = AuditLog(DatabaseSink(lambda: session))
+    monkeypatch.setattr("src.services.audit.audit_log", audit)
+    headers = {"Authorization": f"Bearer {token}"}
+    created = client.post("/api/contacts", json={**contact, "phone": "+380000000301"}, headers=headers).json()
+    client.patch(f"/api/contacts/{created['id']}", json={**contact, "phone": "+380000000301", "name": "Audited"},
+                 headers=headers)
+    client.request("DELETE", "/api/contacts/batch", json={"ids": [created["id"]]}, headers=headers)
+    # Nothing is written by the requests themselves
+    assert audit.queue.qsize() == 3
+    audit.flush()
+
+    trail = session.scalars(select(ContactAudit).where(ContactAudit.contact_id == created["id"])
+                            .order_by(ContactAudit.id)).all()
+    assert [item.action for item in trail] == ["created", "updated", "deleted"]
+    assert trail[1].changes == {"name": [contact["name"], "Audited"]}
+    assert trail[2].changes["name"] == ["Audited", None]
+
+
+def test_query_contacts(client, contact, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    people = [("Alma", "alma@Work.com", "1990-01-10"), ("Alice", "alice@home.net", "1990-02-10"),
+              ("Albert", "albert@work.com", "1990-03-10"), ("Bruno", "bruno@work.com", "1990-04-10")]
+    ids = {}
+    for number, (name, email, birthday) in enumerate(people):
+        body = {**contact, "name": name, "email": email, "birthday": birthday, "phone": f"+380000000{401 + number}"}
+        ids[name] = client.post("/api/contacts", json=body, headers=headers).json()["id"]
+
+    def query(**params):
+        response = client.get("/api/contacts", params=params, headers=headers)
+        assert response.status_code == status.HTTP_200_OK, response.text
+        return [item["name"] for item in response.json()], response.headers.get("X-Next-Cursor")
+
+    assert query(name_prefix="Al") == (["Albert", "Alice", "Alma"], None)
+    assert query(name_prefix="Al", sort="-name") == (["Alma", "Alice", "Albert"], None)
+    assert query(email_domain="WORK.com", fields="id,name") == (["Alma", "Albert", "Bruno"], None)
+    assert query(birthday_from="1990-02-10", birthday_to="1990-03-10") == (["Alice", "Albert"], None)
+
+    names, cursor = query(name_prefix="Al", limit=2)
+    assert names == ["Albert", "Alice"]
+    assert query(name_prefix="Al", limit=2, cursor=cursor) == (["Alma"], None)
+
+    # Combinations without an index of their own, foreign and crafted cursors are rejected
+    def crafted(*payload):
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    for params in ({"name_prefix": "Al", "sort": "birthday"}, {"name_prefix": "Al", "email_domain": "work.com"},
+                   {"sort": "phone"}, {"sort": "-birthday", "cursor": cursor}, {"cursor": "garbage"},
+                   {"sort": "created_at", "cursor": crafted("created_at", False, 5, 1)},
+                   {"sort": "name", "cursor": crafted("name", False, ["Al"], 1)},
+                   {"sort": "name", "cursor": crafted("name", False, "Al", "1")}):
+        response = client.get("/api/contacts", params=params, headers=headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST, params
+
+
+def test_query_contacts_pages_on_datetimes(client, session, contact, token):
+    from src.database.models import Contact
+
+    headers = {"Authorization": f"Bearer {token}"}
+    created = [client.post("/api/contacts", json={**contact, "phone": f"+380000000{701 + number}"},
+                           headers=headers).json()["id"] for number in range(5)]
+    # A row without created_at can not be placed in the keyset order of the column
+    session.query(Contact).filter(Contact.id == created[-1]).update({"created_at": None})
+    session.commit()
+
+    for sort in ("created_at", "-created_at", "updated_at", "-updated_at"):
+        first = client.get("/api/contacts", params={"sort": sort, "limit": 1000, "fields": "id"}, headers=headers)
+        expected = [item["id"] for item in first.json()]
+        pages, cursor = [], None
+        while True:
+            params = {"sort": sort, "limit": 2, "fields": "id", **({"cursor": cursor} if cursor else {})}
+            response = client.get("/api/contacts", params=params, headers=headers)
+            assert response.status_code == status.HTTP_200_OK, response.text
+            pages += [item["id"] for item in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        assert pages == expected, sort
+        assert set(created[:-1]) <= set(pages)
+        assert (created[-1] in pages) == ("updated_at" in sort)
+
+
+def test_coalesced_writes(client, session, contact, token, monkeypatch):
+    from sqlalchemy.orm import sessionmaker
+    from src.services.group_commit import WriteBatcher
+
+    batcher = WriteBatcher(sessionmaker(bind=session.get_bind(), expire_on_commit=False), max_wait=0)
+    monkeypatch.setattr("src.services.group_commit.write_batcher", batcher)
+    monkeypatch.setattr("src.services.group_commit.config.write_coalescing_enabled", True)
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        response = client.post("/api/contacts", json={**contact, "phone": "+380000000501"}, headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED, response.text
+        created = response.json()
+
+        response = client.patch(f"/api/contacts/{created['id']}",
+                                json={**contact, "phone": "+380000000501", "name": "Coalesced"}, headers=headers)
+        assert response.json()["name"] == "Coalesced"
+        assert client.get(f"/api/contacts/{created['id']}", headers=headers).json()["name"] == "Coalesced"
+
+        assert client.delete(f"/api/contacts/{created['id']}", headers=headers).status_code == \
+            status.HTTP_204_NO_CONTENT
+        assert client.get(f"/api/contacts/{created['id']}", headers=headers).status_code == status.HTTP_404_NOT_FOUND
+    finally:
+        batcher.close()
+
+
+def test_update_contacts_batch_rejects_nulls_and_duplicate_ids(client, contact, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    created = client.post("/api/contacts", json={**contact, "phone": "+380000000601"}, headers=headers).json()
+
+    for patches in ([{"id": created["id"], "name": None}], [{"id": created["id"], "birthday": None}],
+                    [{"id": created["id"], "name": "First"}, {"id": created["id"], "phone": "+380000000602"}]):
+        response = client.patch("/api/contacts/batch", json={"contacts": patches}, headers=headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, patches
+    assert client.get(f"/api/contacts/{created['id']}", headers=headers).json()["name"] == contact["name"]
@@ -0,0 +1,23 @@
+import time
+
+from main import health_checker
+
+
+def test_probe_routes(client, monkeypatch):
+    assert client.get("/livez").json() == {"status": "ok"}
+
+    monkeypatch.setattr(health_checker, "checked_at", None)
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["stale"] is True
+
+    monkeypatch.setattr(health_checker, "checked_at", time.time())
+    monkeypatch.setattr(health_checker, "results", {"database": {"status": "ok", "latency_ms": 1.0},
+                                                    "redis": {"status": "error", "detail": "refused"}})
+    # Revoked tokens fail closed, without Redis no authenticated request can be served
+    assert client.get("/readyz").status_code == 503
+    health_checker.results["redis"] = {"status": "ok", "latency_ms": 1.0}
+    response = client.get("/readyz")
+    assert response.status_code == 200, response.text
+    assert response.json()["pool"]["checked_out"] >= 0
+    assert client.get("/api/healthchecker").json() == {"message": "Welcome to FastAPI!"}
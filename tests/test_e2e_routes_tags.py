@@ -0,0 +1,58 @@
+from starlette import status
+
+
+def create_contacts(client, contact, headers, first_phone, count):
+    return [client.post("/api/contacts", json={**contact, "phone": f"+38000000{number:04d}"},
+                        headers=headers).json()["id"]
+            for number in range(first_phone, first_phone + count)]
+
+
+def tag_counts(client, headers):
+    return {tag["name"]: tag["contact_count"] for tag in client.get("/api/tags", headers=headers).json()}
+
+
+def test_tag_and_filter_contacts(client, contact, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    first, second, third = create_contacts(client, contact, headers, 0, 3)
+
+    response = client.post("/api/tags/work/contacts", json={"ids": [first, second, 999999]}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.json()["contact_count"] == 2
+    client.post("/api/tags/family/contacts", json={"ids": [second, third]}, headers=headers)
+    # Tagging again does not count twice
+    assert client.post("/api/tags/work/contacts", json={"ids": [first]}, headers=headers).json()["contact_count"] == 2
+
+    def tagged(**params):
+        response = client.get("/api/tags/contacts", params=params, headers=headers)
+        assert response.status_code == status.HTTP_200_OK, response.text
+        return [item["id"] for item in response.json()]
+
+    assert tagged(tag=["work", "family"]) == [first, second, third]
+    assert tagged(tag=["work", "family"], match="all") == [second]
+    assert tagged(tag=["work", "unknown"], match="all") == []
+    assert tagged(tag=["work", "family"], limit=2) == [first, second]
+    assert tagged(tag=["work", "family"], limit=2, after=second) == [third]
+    response = client.get("/api/tags/contacts", params={"tag": "work", "fields": "id,name"}, headers=headers)
+    assert response.json() == [{"id": first, "name": contact["name"]}, {"id": second, "name": contact["name"]}]
+
+    response = client.request("DELETE", "/api/tags/work/contacts", json={"ids": [first]}, headers=headers)
+    assert response.json()["contact_count"] == 1
+    assert tag_counts(client, headers) == {"family": 2, "work": 1}
+
+
+def test_deleted_and_merged_contacts_update_tags(client, contact, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    primary, duplicate, deleted = create_contacts(client, contact, headers, 10, 3)
+    client.post("/api/tags/friends/contacts", json={"ids": [duplicate, deleted]}, headers=headers)
+
+    client.delete(f"/api/contacts/{deleted}", headers=headers)
+    assert tag_counts(client, headers)["friends"] == 1
+
+    client.post(f"/api/contacts/{primary}/merge", json={"duplicate_ids": [duplicate]}, headers=headers)
+    assert tag_counts(client, headers)["friends"] == 1
+    response = client.get("/api/tags/contacts", params={"tag": "friends"}, headers=headers)
+    assert [item["id"] for item in response.json()] == [primary]
+
+    assert client.delete("/api/tags/friends", headers=headers).status_code == status.HTTP_204_NO_CONTENT
+    assert "friends" not in tag_counts(client, headers)
+    assert client.delete("/api/tags/friends", headers=headers).status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,80 @@
+import tempfile
+import unittest
+from datetime import date, datetime
+
+from src.services.audit import AuditLog, contact_diff
+
+
+class MemorySink:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.batches = []
+
+    def write(self, entries):
+        if self.fail:
+            raise ConnectionError("database is down")
+        self.batches.append(list(entries))
+
+
+def entry(number: int) -> dict:
+    return {"event_id": f"{number:032x}", "user_id": 1, "contact_id": number, "action": "deleted",
+            "changes": {}, "created_at": datetime(2026, 1, 1).isoformat()}
+
+
+class TestContactDiff(unittest.TestCase):
+    def test_only_changed_fields(self):
+        before = {"name": "Borys", "phone": "+380123456789", "birthday": datetime(1988, 1, 1)}
+        after = {"name": "Boris", "phone": "+380123456789", "birthday": date(1988, 1, 1)}
+        self.assertEqual(contact_diff(before, after), {"name": ["Borys", "Boris"]})
+
+    def test_created_and_deleted(self):
+        self.assertEqual(contact_diff(None, {"name": "Borys"}), {"name": [None, "Borys"]})
+        self.assertEqual(contact_diff({"birthday": date(1988, 1, 1)}, None), {"birthday": ["1988-01-01", None]})
+
+
+class TestAuditLog(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_batches_by_size(self):
+        sink = MemorySink()
+        audit = AuditLog(sink, queue_size=10, batch_size=2, spill_dir=self.directory)
+        for number in range(5):
+            audit.record(entry(number))
+        audit.flush()
+        self.assertEqual([len(batch) for batch in sink.batches], [2, 2, 1])
+
+    def test_full_queue_spills_and_replays(self):
+        sink = MemorySink()
+        audit = AuditLog(sink, queue_size=2, batch_size=10, spill_dir=self.directory)
+        for number in range(5):
+            audit.record(entry(number))
+        self.assertEqual(audit.queue.qsize(), 2)
+
+        audit.flush()
+        audit.replay_spilled()
+        written = sorted(item["contact_id"] for batch in sink.batches for item in batch)
+        self.assertEqual(written, [0, 1, 2, 3, 4])
+        self.assertEqual(list(audit.spill_dir.iterdir()), [])
+
+    def test_failed_batch_is_kept_on_disk(self):
+        sink = MemorySink(fail=True)
+        audit = AuditLog(sink, queue_size=10, batch_size=10, spill_dir=self.directory)
+        audit.record(entry(1))
+        audit.flush()
+        audit.replay_spilled()
+        self.assertEqual(len(list(audit.spill_dir.iterdir())), 1)
+
+        sink.fail = False
+        audit.replay_spilled()
+        self.assertEqual(sink.batches, [[entry(1)]])
+
+    def test_close_writes_queued_entries(self):
+        sink = MemorySink()
+        audit = AuditLog(sink, queue_size=10, batch_size=10, flush_interval=0.01, spill_dir=self.directory)
+        audit.start()
+        audit.record(entry(1))
+        audit.close()
+        self.assertEqual(sink.batches, [[entry(1)]])
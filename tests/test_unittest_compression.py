@@ -0,0 +1,92 @@
+import gzip
+import unittest
+
+from fastapi import FastAPI, Depends
+from fastapi.responses import PlainTextResponse, StreamingResponse, Response
+from fastapi.testclient import TestClient
+
+from src.middleware.compression import CompressionMiddleware, negotiate_encoding, no_compression
+
+BODY = "contact," * 500
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+
+@app.get("/large")
+def large():
+    return PlainTextResponse(BODY)
+
+
+@app.get("/small")
+def small():
+    return PlainTextResponse("contact")
+
+
+@app.get("/stream")
+def stream():
+    return StreamingResponse(iter([BODY, BODY]), media_type="text/plain")
+
+
+@app.get("/opt-out", dependencies=[Depends(no_compression)])
+def opt_out():
+    return PlainTextResponse(BODY)
+
+
+@app.get("/encoded")
+def encoded():
+    return Response(gzip.compress(BODY.encode()), headers={"Content-Encoding": "gzip"}, media_type="text/plain")
+
+
+@app.get("/image")
+def image():
+    return Response(BODY.encode(), media_type="image/png")
+
+
+class TestNegotiateEncoding(unittest.TestCase):
+    def test_server_preference_breaks_ties(self):
+        self.assertEqual(negotiate_encoding("gzip, br, zstd", ["zstd", "br", "gzip"]), "zstd")
+
+    def test_client_quality_wins(self):
+        self.assertEqual(negotiate_encoding("zstd;q=0.5, gzip", ["zstd", "gzip"]), "gzip")
+
+    def test_refused_and_unknown(self):
+        self.assertIsNone(negotiate_encoding("gzip;q=0", ["gzip"]))
+        self.assertIsNone(negotiate_encoding("identity", ["gzip"]))
+        self.assertEqual(negotiate_encoding("*", ["gzip"]), "gzip")
+
+
+class TestCompressionMiddleware(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app, headers={"Accept-Encoding": "gzip"})
+
+    def test_large_body_is_compressed(self):
+        response = self.client.get("/large")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["vary"])
+        self.assertLess(int(response.headers["content-length"]), len(BODY))
+        self.assertEqual(response.text, BODY)
+
+    def test_small_body_is_not_compressed(self):
+        response = self.client.get("/small")
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(response.text, "contact")
+
+    def test_stream_is_compressed(self):
+        response = self.client.get("/stream")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertNotIn("content-length", response.headers)
+        self.assertEqual(response.text, BODY * 2)
+
+    def test_skipped_responses(self):
+        for path in ("/opt-out", "/image"):
+            response = self.client.get(path)
+            self.assertNotIn("content-encoding", response.headers)
+            self.assertEqual(response.content, BODY.encode())
+        response = self.client.get("/encoded")
+        self.assertEqual(response.text, BODY)
+
+    def test_client_without_accept_encoding(self):
+        response = self.client.get("/large", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(response.text, BODY)
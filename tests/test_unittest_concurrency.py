@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.middleware.concurrency import (
+    AdaptiveLimiter, ConcurrencyLimitMiddleware, Overloaded, RouteGroup, route_group,
+)
+
+
+class TestRouteGroup(unittest.TestCase):
+    def test_groups(self):
+        self.assertEqual(route_group("POST", "/auth/login"), "auth")
+        self.assertEqual(route_group("PATCH", "/users/avatar"), "uploads")
+        self.assertEqual(route_group("GET", "/api/contacts/1"), "reads")
+        self.assertEqual(route_group("DELETE", "/api/contacts/1"), "writes")
+        self.assertIsNone(route_group("GET", "/readyz"))
+        self.assertIsNone(route_group("GET", "/api/contacts/events"))
+
+
+class TestAdaptiveLimiter(unittest.IsolatedAsyncioTestCase):
+    async def test_times_out_when_full(self):
+        limiter = AdaptiveLimiter("test", 1)
+        await limiter.acquire(timeout=0.01)
+        with self.assertRaises(Overloaded):
+            await limiter.acquire(timeout=0.01)
+        self.assertEqual(limiter.in_flight, 1)
+        self.assertEqual(limiter._waiters, [])
+
+    async def test_reads_are_admitted_before_writes(self):
+        limiter = AdaptiveLimiter("test", 1)
+        await limiter.acquire()
+        admitted = []
+
+        async def wait(name, priority):
+            await limiter.acquire(priority=priority)
+            admitted.append(name)
+
+        write = asyncio.create_task(wait("write", 2))
+        await asyncio.sleep(0)
+        read = asyncio.create_task(wait("read", 0))
+        await asyncio.sleep(0)
+        limiter.release(0.01)
+        await read
+        limiter.release(0.01)
+        await write
+        self.assertEqual(admitted, ["read", "write"])
+
+    async def test_writes_leave_room_for_reads(self):
+        limiter = AdaptiveLimiter("test", 5)
+        for _ in range(4):
+            await limiter.acquire(priority=2, share=0.8)
+        with self.assertRaises(Overloaded):
+            await limiter.acquire(priority=2, timeout=0.01, share=0.8)
+        await limiter.acquire(priority=0, timeout=0.01)
+        self.assertEqual(limiter.in_flight, 5)
+
+    async def test_limit_follows_latency(self):
+        limiter = AdaptiveLimiter("test", 2, max_limit=10)
+        for _ in range(20):
+            await limiter.acquire()
+            await limiter.acquire()
+            limiter.release(0.01)
+            limiter.release(0.01)
+        grown = limiter.limit
+        self.assertGreater(grown, 2)
+
+        await limiter.acquire()
+        limiter.release(1.0)
+        self.assertAlmostEqual(limiter.limit, grown * limiter.backoff)
+
+
+class TestConcurrencyLimitMiddleware(unittest.TestCase):
+    def test_shed_request_gets_503_with_retry_after(self):
+        app = FastAPI()
+        limiter = AdaptiveLimiter("test", 1)
+        limiter.in_flight = 1
+        app.add_middleware(ConcurrencyLimitMiddleware, retry_after=2,
+                           groups={"writes": RouteGroup("writes", limiter, priority=2, queue_timeout=0.01)})
+
+        @app.post("/api/contacts/")
+        def create():
+            return {}
+
+        @app.get("/api/contacts/")
+        def read():
+            return []
+
+        client = TestClient(app)
+        response = client.post("/api/contacts/")
+        self.assertEqual(response.status_code, 503, response.text)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        self.assertEqual(client.get("/api/contacts/").status_code, 200)
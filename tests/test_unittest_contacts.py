@@ -1,14 +1,20 @@
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from sqlalchemy.orm import Session
 
 from src.database.models import User, Contact
-from src.repository.contacts import create_contact, get_contacts, delete_contact, update_contact
+from src.repository.contacts import create_contact, get_contacts, get_contact_rows, delete_contact, update_contact
 
 
 class TestContactsRepository(unittest.TestCase):
     def setUp(self):
+        # contact_stats upserts, tag links and change feed locks are covered by the e2e tests
+        for target in ("src.repository.contacts.apply_stats_delta", "src.repository.stats.birthday_column",
+                       "src.repository.contacts.remove_contact_tags", "src.repository.contacts.lock_change_feed"):
+            patcher = patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
         self.session = Mock(spec=Session)
         self.user = User(
             id=1, email="test@gmail.com", password="11223344", confirmed=True
@@ -30,12 +36,21 @@ class TestContactsRepository(unittest.TestCase):
 
     def test_get_contacts(self):
         expected_contacts = [self.contact]
-        mock_contacts = Mock()
-        mock_contacts.all.return_value = expected_contacts
-        self.session.query.return_value.filter_by.return_value = mock_contacts
+        self.session.scalars.return_value.all.return_value = expected_contacts
         result = get_contacts(self.user, self.session)
         self.assertEqual(result, expected_contacts)
 
+    def test_get_contact_rows(self):
+        connection = self.session.connection.return_value
+        connection.execute.return_value = iter([(1, "Borys")])
+        result = get_contact_rows(self.user, self.session, fields=("id", "name"))
+        self.assertEqual(result, [(1, "Borys")])
+        self.assertEqual(result[0].name, "Borys")
+        stmt, params = connection.execute.call_args.args
+        self.assertEqual([column.name for column in stmt.selected_columns], ["id", "name"])
+        self.assertEqual(params, {"user_id": self.user.id})
+        self.session.scalars.assert_not_called()
+
     def test_update_contact(self):
         contact_id = 1
         contact_create = self.contact
@@ -0,0 +1,38 @@
+import unittest
+from datetime import date
+
+from src.services.dedupe import ContactKeys, soundex, find_duplicates, cluster_duplicates
+
+
+class TestDedupe(unittest.TestCase):
+    def setUp(self):
+        self.contacts = [
+            ContactKeys(1, "Borys", "Johnson", "bj@gmail.com", "+380967774411", date(1988, 1, 1)),
+            ContactKeys(2, "Boris", "Jonson", "BJ@gmail.com ", "0967774411", date(1988, 1, 1)),
+            ContactKeys(3, "Boris", "Johnson", "boris@ukr.net", "+380501112233", None),
+            ContactKeys(4, "Albert", "Einstein", "ae@gmail.com", "+380671234567", date(1879, 3, 14)),
+        ]
+
+    def test_soundex(self):
+        self.assertEqual(soundex("Johnson"), soundex("Jonson"))
+        self.assertEqual(soundex("Robert"), "R163")
+        self.assertEqual(soundex("Тарас"), "тарас")
+
+    def test_find_duplicates(self):
+        candidates = find_duplicates(self.contacts, min_score=0.5)
+        self.assertEqual([(item.contact_id, item.duplicate_id) for item in candidates], [(1, 2)])
+        self.assertEqual(candidates[0].reasons, ["phone", "email", "name", "birthday"])
+
+    def test_find_duplicates_skips_large_blocks(self):
+        contacts = [ContactKeys(i, "Ivan", "Petrenko", f"{i}@a.com", f"+38050000{i:04d}", None) for i in range(1, 10)]
+        self.assertEqual(len(find_duplicates(contacts, min_score=0.1)), 36)
+        self.assertEqual(find_duplicates(contacts, min_score=0.1, max_block_size=5), [])
+
+    def test_cluster_duplicates(self):
+        candidates = find_duplicates(self.contacts, min_score=0.1)
+        clusters = cluster_duplicates(candidates)
+        self.assertEqual(clusters, {1: [2, 3]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import json
+import unittest
+from unittest.mock import MagicMock
+
+import redis
+
+from src.services.events import ContactEventHub, ContactEventPublisher, channel_for
+
+
+class TestContactEventPublisher(unittest.TestCase):
+    def test_publish(self):
+        client = MagicMock()
+        ContactEventPublisher(client).publish(1, {"type": "deleted", "id": 5})
+        client.publish.assert_called_once_with("contacts:1", json.dumps({"type": "deleted", "id": 5}))
+
+    def test_publish_backs_off_when_redis_is_down(self):
+        client = MagicMock()
+        client.publish.side_effect = redis.ConnectionError("down")
+        publisher = ContactEventPublisher(client)
+        publisher.publish(1, {"type": "deleted", "id": 5})
+        publisher.publish(1, {"type": "deleted", "id": 6})
+        self.assertEqual(client.publish.call_count, 1)
+
+    def test_publish_many_uses_one_pipeline(self):
+        client = MagicMock()
+        ContactEventPublisher(client).publish_many(1, [{"type": "deleted", "id": 5}, {"type": "deleted", "id": 6}])
+        client.publish.assert_not_called()
+        client.pipeline.assert_called_once_with(transaction=False)
+        pipeline = client.pipeline.return_value
+        self.assertEqual([call.args for call in pipeline.publish.call_args_list], [
+            ("contacts:1", json.dumps({"type": "deleted", "id": 5})),
+            ("contacts:1", json.dumps({"type": "deleted", "id": 6})),
+        ])
+        pipeline.execute.assert_called_once_with()
+
+
+class TestContactEventHub(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.hub = ContactEventHub(max_events=2, max_bytes=1024)
+        self.hub._listener = MagicMock(done=lambda: False)
+
+    async def test_dispatch_to_user(self):
+        own = self.hub.subscribe(1)
+        other = self.hub.subscribe(2)
+        self.hub.dispatch(channel_for(1), json.dumps({"type": "created", "id": 3}))
+
+        frame = await own.get(timeout=1)
+        self.assertEqual(frame, 'event: created\ndata: {"type": "created", "id": 3}\n\n')
+        self.assertTrue(other.queue.empty())
+
+    async def test_overflow_resets_connection(self):
+        subscription = self.hub.subscribe(1)
+        for contact_id in range(3):
+            self.hub.dispatch(channel_for(1), json.dumps({"type": "deleted", "id": contact_id}))
+
+        self.assertTrue(subscription.overflowed)
+        frames = [frame async for frame in self.hub.stream(subscription, heartbeat=1)]
+        self.assertEqual(frames, ["retry: 5000\n\n", "event: reset\ndata: {}\n\n"])
+        self.assertNotIn(1, self.hub.subscriptions)
+
+    async def test_heartbeat(self):
+        subscription = self.hub.subscribe(1)
+        stream = self.hub.stream(subscription, heartbeat=0.01)
+        self.assertEqual(await stream.__anext__(), "retry: 5000\n\n")
+        self.assertEqual(await stream.__anext__(), ": ping\n\n")
+        await stream.aclose()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from src.database.db import after_commit
+from src.database.models import Base, Tag
+from src.services.group_commit import WriteBatcher, commit
+
+
+def add_tag(name: str, callbacks: list = None):
+    def work(session):
+        session.add(Tag(user_id=1, name=name, contact_count=0))
+        if callbacks is not None:
+            after_commit(session, lambda: callbacks.append(name))
+        commit(session)
+        return name
+    return work
+
+
+class TestWriteBatcher(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.engine = create_engine(f"sqlite:///{directory.name}/writes.db")
+        self.addCleanup(self.engine.dispose)
+        Base.metadata.create_all(self.engine)
+        self.commits = []
+        event.listen(self.engine, "commit", lambda connection: self.commits.append(1))
+        self.batcher = WriteBatcher(sessionmaker(bind=self.engine, expire_on_commit=False), batch_size=10,
+                                    max_wait=0.05)
+        self.addCleanup(self.batcher.close)
+
+    def names(self):
+        with self.engine.connect() as connection:
+            return sorted(connection.scalars(select(Tag.name)))
+
+    def test_failed_write_is_rolled_back_alone(self):
+        done = []
+        batch = [(add_tag("work", done), Future(), None), (add_tag("work", done), Future(), None),
+                 (add_tag("home", done), Future(), None)]
+        self.batcher.commit_batch(batch)
+
+        self.assertEqual(batch[0][1].result(), "work")
+        self.assertIsInstance(batch[1][1].exception(), IntegrityError)
+        self.assertEqual(batch[2][1].result(), "home")
+        self.assertEqual(self.names(), ["home", "work"])
+        # The callbacks of the failed write are dropped, the others run after the commit
+        self.assertEqual(done, ["work", "home"])
+
+    def test_concurrent_writes_share_commits(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda number: self.batcher.run(add_tag(f"tag{number}")), range(20)))
+
+        self.assertEqual(results, [f"tag{number}" for number in range(20)])
+        self.assertEqual(len(self.names()), 20)
+        self.assertLess(len(self.commits), 20)
+
+    def test_interleaved_batches_lock_in_order(self):
+        # Row locks of a database: held by the thread of a batch until its commit, taken again without waiting
+        rows = {key: threading.RLock() for key in "AB"}
+        held = threading.local()
+
+        def lock_row(key, session):
+            if not rows[key].acquire(timeout=1):
+                raise TimeoutError(f"deadlock on {key}")
+            if not hasattr(held, "rows"):
+                held.rows = []
+            held.rows.append(rows[key])
+            after_commit(session, lambda: [row.release() for row in held.__dict__.pop("rows")])
+
+        def write_rows(first, second):
+            def work(session):
+                lock_row(first, session)
+                time.sleep(0.1)
+                lock_row(second, session)
+                return first + second
+            return work
+
+        batcher = WriteBatcher(sessionmaker(bind=self.engine, expire_on_commit=False),
+                               lock=lambda keys, session: [lock_row(key, session) for key in keys])
+        batches = [[(write_rows("A", "B"), Future(), "A"), (write_rows("B", "B"), Future(), "B")],
+                   [(write_rows("B", "A"), Future(), "B"), (write_rows("A", "A"), Future(), "A")]]
+        threads = [threading.Thread(target=batcher.commit_batch, args=(batch,)) for batch in batches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([future.result(timeout=0) for batch in batches for _, future, _ in batch],
+                         ["AB", "BB", "BA", "AA"])
+
+    def test_closed_batcher_refuses_writes(self):
+        self.batcher.close()
+        with self.assertRaises(RuntimeError):
+            self.batcher.submit(add_tag("late"))
@@ -0,0 +1,69 @@
+import time
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from src.services.health import HealthChecker, pool_status
+
+
+def failing():
+    raise ConnectionError("refused")
+
+
+def slow():
+    time.sleep(0.5)
+
+
+class TestHealthChecker(unittest.IsolatedAsyncioTestCase):
+    async def test_not_ready_before_first_round(self):
+        checker = HealthChecker({"database": lambda: None})
+        status = checker.status()
+        self.assertFalse(status["ready"])
+        self.assertTrue(status["stale"])
+
+    async def test_ready_when_required_checks_pass(self):
+        checker = HealthChecker({"database": lambda: None, "redis": failing}, interval=5)
+        await checker.run_once()
+        status = checker.status()
+        self.assertTrue(status["ready"])
+        self.assertEqual(status["checks"]["database"]["status"], "ok")
+        self.assertEqual(status["checks"]["redis"], {"status": "error", "detail": "refused",
+                                                     "latency_ms": status["checks"]["redis"]["latency_ms"]})
+
+    async def test_required_check_fails_or_times_out(self):
+        for check in (failing, slow):
+            checker = HealthChecker({"database": check}, interval=5, timeout=0.05)
+            await checker.run_once()
+            self.assertFalse(checker.status()["ready"])
+            self.assertFalse(checker.is_ok("database"))
+
+    async def test_saturated_pool(self):
+        checker = HealthChecker({"database": lambda: None}, interval=5, max_pool_saturation=0.8,
+                                pool=lambda: {"saturation": 1.0})
+        await checker.run_once()
+        self.assertFalse(checker.status()["ready"])
+
+    async def test_saturated_pool_is_reported_only_by_default(self):
+        checker = HealthChecker({"database": lambda: None}, interval=5, pool=lambda: {"saturation": 1.0})
+        await checker.run_once()
+        status = checker.status()
+        self.assertTrue(status["ready"])
+        self.assertEqual(status["pool"], {"saturation": 1.0})
+
+    async def test_stale_results(self):
+        checker = HealthChecker({"database": lambda: None}, interval=5)
+        await checker.run_once()
+        checker.checked_at -= 60
+        self.assertFalse(checker.status()["ready"])
+
+
+class TestPoolStatus(unittest.TestCase):
+    def test_counters(self):
+        engine = create_engine("sqlite://", pool_size=4, max_overflow=0, poolclass=QueuePool)
+        connection = engine.connect()
+        try:
+            self.assertEqual(pool_status(engine), {"size": 4, "checked_out": 1, "overflow": -3, "saturation": 0.25})
+        finally:
+            connection.close()
+
@@ -0,0 +1,64 @@
+import json
+import tempfile
+import unittest
+
+from jose import JWTError, jwt
+
+from src.services.keys import KeyRing, generate_key, export_public_key
+
+
+class TestKeyRing(unittest.TestCase):
+    def setUp(self):
+        self.keys_dir = tempfile.TemporaryDirectory()
+        self.old_key = generate_key(self.keys_dir.name, "2023-old")
+        generate_key(self.keys_dir.name, "2024-new")
+
+    def tearDown(self):
+        self.keys_dir.cleanup()
+
+    def test_signs_with_the_last_key(self):
+        keys = KeyRing(self.keys_dir.name, signing_kid="", accept_secret=False)
+        token = keys.encode({"sub": "user@gmail.com"})
+        self.assertEqual(jwt.get_unverified_header(token), {"alg": "RS256", "kid": "2024-new", "typ": "JWT"})
+        self.assertEqual(keys.decode(token), {"sub": "user@gmail.com"})
+
+    def test_rotation(self):
+        old = KeyRing(self.keys_dir.name, signing_kid="2023-old", accept_secret=False)
+        token = old.encode({"sub": "user@gmail.com"})
+        export_public_key(self.old_key)
+        rotated = KeyRing(self.keys_dir.name, signing_kid="", accept_secret=False)
+        self.assertEqual(rotated.signing_kid, "2024-new")
+        self.assertEqual(rotated.decode(token), {"sub": "user@gmail.com"})
+        with self.assertRaises(ValueError):
+            KeyRing(self.keys_dir.name, signing_kid="2023-old")
+
+    def test_jwks(self):
+        keys = KeyRing(self.keys_dir.name, signing_kid="", accept_secret=False)
+        jwks = json.loads(keys.jwks_json)
+        self.assertEqual([key["kid"] for key in jwks["keys"]], ["2023-old", "2024-new"])
+        self.assertTrue(all("d" not in key and key["kty"] == "RSA" for key in jwks["keys"]))
+
+    def test_secret_tokens(self):
+        secret_token = KeyRing("", secret_key="secret", algorithm="HS256").encode({"sub": "user@gmail.com"})
+        self.assertEqual(KeyRing(self.keys_dir.name, signing_kid="", secret_key="secret",
+                                 accept_secret=True).decode(secret_token), {"sub": "user@gmail.com"})
+        with self.assertRaises(JWTError):
+            KeyRing(self.keys_dir.name, signing_kid="", accept_secret=False).decode(secret_token)
+
+    def test_unknown_kid_and_algorithm_confusion(self):
+        keys = KeyRing(self.keys_dir.name, signing_kid="", accept_secret=True)
+        public_pem = json.dumps(keys.verification_keys["2024-new"].jwk)
+        forged = jwt.encode({"sub": "admin"}, "anything", algorithm="HS256", headers={"kid": "2024-new"})
+        with self.assertRaises(JWTError):
+            keys.decode(forged)
+        forged = jwt.encode({"sub": "admin"}, public_pem, algorithm="HS256", headers={"kid": "missing"})
+        with self.assertRaises(JWTError):
+            keys.decode(forged)
+
+
+    def test_malformed_kid(self):
+        keys = KeyRing(self.keys_dir.name, signing_kid="", accept_secret=True)
+        for kid in ([], {}, 1):
+            forged = jwt.encode({"sub": "admin"}, "anything", algorithm="HS256", headers={"kid": kid})
+            with self.assertRaises(JWTError):
+                keys.decode(forged)
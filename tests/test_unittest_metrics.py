@@ -0,0 +1,30 @@
+import unittest
+
+from sqlalchemy import create_engine, select, literal
+
+from src.services.metrics import Metrics, metrics, instrument_engine
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        registry = Metrics()
+        registry.describe("requests_total", "Requests")
+        registry.inc("requests_total", route="a")
+        registry.inc("requests_total", 2, route="a")
+        registry.gauge("queue_size", lambda: 7)
+        self.assertEqual(registry.render(), "# HELP requests_total Requests\n"
+                                            "# TYPE requests_total counter\n"
+                                            'requests_total{route="a"} 3\n'
+                                            "# TYPE queue_size gauge\n"
+                                            "queue_size 7\n")
+
+    def test_statement_cache_is_counted(self):
+        engine = create_engine("sqlite://")
+        instrument_engine(engine)
+        stmt = select(literal(1))
+        before = metrics.value("sqlalchemy_statements_total", cache="hit")
+        with engine.connect() as connection:
+            for _ in range(3):
+                connection.execute(stmt)
+        self.assertEqual(metrics.value("sqlalchemy_statements_total", cache="hit") - before, 2)
+        self.assertIn("sqlalchemy_compiled_cache_hit_ratio", metrics.render())
@@ -0,0 +1,27 @@
+import unittest
+
+from src.services.normalize import normalize_phone, normalize_email
+
+
+class TestNormalize(unittest.TestCase):
+    def test_normalize_phone(self):
+        expected = "+380967774411"
+        for phone in ("+380967774411", "+380 (96) 777-44-11", "0967774411", "380967774411", "00380967774411",
+                      "967774411"):
+            self.assertEqual(normalize_phone(phone), expected, phone)
+
+    def test_normalize_phone_foreign(self):
+        self.assertEqual(normalize_phone("+1 (202) 555-0143"), "+12025550143")
+        self.assertEqual(normalize_phone("0967774411", country_code="48"), "+48967774411")
+
+    def test_normalize_phone_empty(self):
+        self.assertIsNone(normalize_phone(""))
+        self.assertIsNone(normalize_phone("phone"))
+
+    def test_normalize_email(self):
+        self.assertEqual(normalize_email(" BJ@Gmail.com "), "bj@gmail.com")
+        self.assertIsNone(normalize_email(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
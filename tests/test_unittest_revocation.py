@@ -0,0 +1,72 @@
+import unittest
+from unittest.mock import MagicMock
+
+import redis
+
+from src.services.revocation import BloomFilter, TokenRevocationList
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        items = [f"jti-{i}" for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TestTokenRevocationList(unittest.TestCase):
+    def setUp(self):
+        self.client = MagicMock()
+        self.revoked = TokenRevocationList(self.client, capacity=100, error_rate=0.01)
+        self.revoked.synced = True
+
+    def test_miss_does_not_touch_redis(self):
+        self.assertFalse(self.revoked.is_revoked("jti"))
+        self.client.zscore.assert_not_called()
+
+    def test_not_synced_checks_redis(self):
+        self.revoked.synced = False
+        self.client.zscore.return_value = 2000000000
+        self.assertTrue(self.revoked.is_revoked("jti"))
+        self.client.zscore.return_value = None
+        self.assertFalse(self.revoked.is_revoked("jti"))
+        self.client.zscore.side_effect = redis.ConnectionError("down")
+        self.assertTrue(self.revoked.is_revoked("jti"))
+
+    def test_revoke(self):
+        self.revoked.revoke("jti", 2000000000)
+        self.client.pipeline.return_value.zadd.assert_called_once_with("revoked_tokens", {"jti": 2000000000})
+        self.client.pipeline.return_value.publish.assert_called_once_with("revoked_tokens", "jti")
+        self.client.zscore.return_value = 2000000000
+        self.assertTrue(self.revoked.is_revoked("jti"))
+
+    def test_hit_is_confirmed_in_redis(self):
+        self.revoked.load([b"jti"])
+        self.client.zscore.return_value = None
+        self.assertFalse(self.revoked.is_revoked("jti"))
+        self.client.zscore.side_effect = redis.ConnectionError("down")
+        self.assertTrue(self.revoked.is_revoked("jti"))
+
+    def test_redis_down(self):
+        self.revoked.synced = False
+        self.client.zscore.side_effect = redis.ConnectionError("down")
+        self.assertTrue(self.revoked.is_revoked("jti"))
+        # Redis is not asked again right away, the policy answers
+        self.assertTrue(self.revoked.is_revoked("other"))
+        self.assertEqual(self.client.zscore.call_count, 1)
+
+        fail_open = TokenRevocationList(self.client, capacity=100, error_rate=0.01, fail_closed=False)
+        self.assertFalse(fail_open.is_revoked("jti"))
+
+    def test_load_grows_the_filter(self):
+        self.revoked.load(f"jti-{i}" for i in range(500))
+        self.assertGreaterEqual(self.revoked.bloom.capacity, 1000)
+        self.assertIn("jti-499", self.revoked.bloom)
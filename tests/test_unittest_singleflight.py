@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+from src.services.metrics import metrics
+from src.services.singleflight import SingleFlight, coalesce, flights
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_call(self):
+        group = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def query():
+            calls.append(1)
+            release.wait(1)
+            return "contacts"
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            futures = [pool.submit(group.do, "key", query) for _ in range(5)]
+            while not group._calls:
+                pass
+            threading.Timer(0.1, release.set).start()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True, True])
+        self.assertTrue(all(result == "contacts" for result, _ in results))
+        self.assertEqual(group._calls, {})
+
+    def test_errors_are_shared_and_not_cached(self):
+        group = SingleFlight()
+        with self.assertRaises(ValueError):
+            group.do("key", lambda: (_ for _ in ()).throw(ValueError("db")))
+        self.assertEqual(group.do("key", lambda: 1), (1, False))
+
+    def test_forget(self):
+        group = SingleFlight()
+        group._calls[("get_contacts", 1, None)] = object()
+        group._calls[("get_contacts", 2, None)] = object()
+        group.forget(lambda key: key[1:2] == (1,))
+        self.assertEqual(list(group._calls), [("get_contacts", 2, None)])
+
+
+class TestAsyncSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_call(self):
+        group = SingleFlight()
+        calls = []
+
+        async def query():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "contacts"
+
+        results = await asyncio.gather(*(group.do_async("key", query) for _ in range(5)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([shared for _, shared in results], [False, True, True, True, True])
+
+
+class TestCoalesce(unittest.TestCase):
+    def test_follower_shares_the_result_of_the_leader(self):
+        leader_session, follower_session = MagicMock(), MagicMock()
+        record = ("Albert", "Einstein")
+        release = threading.Event()
+
+        @coalesce(lambda user_id, **_: (user_id,))
+        def get_contact_rows(user_id, session):
+            release.wait(1)
+            return [record]
+
+        before = metrics.value("singleflight_calls_total", function="get_contact_rows", role="follower")
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(get_contact_rows, 1, leader_session)
+            while not flights._calls:
+                pass
+            follower = pool.submit(get_contact_rows, 1, session=follower_session)
+            threading.Timer(0.1, release.set).start()
+            self.assertEqual(leader.result(), [record])
+            self.assertIs(follower.result()[0], record)
+
+        follower_session.merge.assert_not_called()
+        self.assertEqual(metrics.value("singleflight_calls_total", function="get_contact_rows", role="follower"),
+                         before + 1)
+
+    def test_orm_instances_are_not_shared(self):
+        @coalesce(lambda contact_id, **_: (contact_id,))
+        def get_contact(contact_id, session):
+            return MagicMock(_sa_instance_state=object())
+
+        with self.assertRaises(TypeError):
+            get_contact(1, session=MagicMock())